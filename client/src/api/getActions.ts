@@ -1,7 +1,6 @@
-import { axios } from '../lib/axios';
+import { getAllPages } from '../lib/pagination';
 import { Action } from '../types';
 
 export const getActions = async (): Promise<Action[]> => {
-  const result = await axios.get('/api/actions');
-  return result.data;
+  return getAllPages<Action>('/api/actions');
 };
\ No newline at end of file
@@ -1,7 +1,6 @@
-import { axios } from '../lib/axios';
+import { getAllPages } from '../lib/pagination';
 import { Campaign } from '../types';
 
 export const getCampaigns = async (): Promise<Campaign[]> => {
-  const result = await axios.get('/api/campaigns');
-  return result.data;
+  return getAllPages<Campaign>('/api/campaigns');
 };
\ No newline at end of file
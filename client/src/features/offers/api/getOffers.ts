@@ -1,7 +1,6 @@
-import { axios } from '../../../lib/axios';
+import { getAllPages } from '../../../lib/pagination';
 import { Offer } from '../../../types';
 
 export const getOffers = async (): Promise<Offer[]> => {
-  const result = await axios.get('/api/offers');
-  return result.data;
+  return getAllPages<Offer>('/api/offers');
 };
\ No newline at end of file
@@ -1,7 +1,6 @@
-import { axios } from '../../../lib/axios';
+import { getAllPages } from '../../../lib/pagination';
 import { Transaction } from '../../../types';
 
 export const getTransactions = async (): Promise<Transaction[]> => {
-  const result = await axios.get('/api/transactions');
-  return result.data;
+  return getAllPages<Transaction>('/api/transactions');
 };
\ No newline at end of file
@@ -0,0 +1,15 @@
+import { axios } from './axios';
+
+const CURSOR_HEADER = 'x-next-cursor';
+
+// The list endpoints return a page at a time; follow the cursor of each page until the last one.
+export const getAllPages = async <T>(url: string): Promise<T[]> => {
+  const rows: T[] = [];
+  let after: string | undefined;
+  do {
+    const result = await axios.get(url, { params: after ? { after } : {} });
+    rows.push(...result.data);
+    after = result.headers[CURSOR_HEADER];
+  } while (after);
+  return rows;
+};
@@ -0,0 +1,9 @@
+"""WSGI entry point of the worker benchmark (see bench/workers.py): the API, with the latency of the 'memory'
+network taken from the BENCH_LATENCY environment variable."""
+from src.app import app
+from src.common.blockchain import blockchain_manager
+import os
+
+manager = getattr(blockchain_manager, 'manager', blockchain_manager)
+if 'BENCH_LATENCY' in os.environ:
+    manager.latency = float(os.environ['BENCH_LATENCY'])
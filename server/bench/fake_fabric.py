@@ -0,0 +1,129 @@
+"""Local stand-in of the Fabric gateway API (/login, /submit and /evaluate), backed by an in-memory ledger.\n
+Used to benchmark the 'fabric' network without a Fabric deployment:
+    python -m bench.fake_fabric --port 8801 --latency 0.05
+and in src/config.py:
+    FABRIC_LOGIN_URL = 'http://localhost:8801/login'
+    FABRIC_TRANSACTION_URL = 'http://localhost:8801'"""
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from secrets import token_hex
+from src.common.memory import MemoryLedger
+import json
+import random
+import threading
+import time
+
+
+class FakeGateway:
+    """State of the fake gateway: the ledger, the open sessions and the simulated latency and failures."""
+
+    def __init__(self, latency=0, failure_rate=0, session_ttl=0):
+        self.ledger = MemoryLedger()
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.session_ttl = session_ttl      # seconds a login is valid for, 0 to never expire
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def login(self) -> str:
+        session = token_hex(16)
+        with self.lock:
+            self.sessions[session] = time.monotonic() + self.session_ttl if self.session_ttl else None
+        return session
+
+    def valid(self, session) -> bool:
+        with self.lock:
+            if session not in self.sessions:
+                return False
+            expiry = self.sessions[session]
+            if expiry is not None and time.monotonic() > expiry:
+                del self.sessions[session]
+                return False
+            return True
+
+    def evaluate(self, fn, args) -> str:
+        if fn == 'balanceOf':
+            return str(self.ledger.balance_of(args[0]))
+        raise ValueError(f'unknown function {fn}')
+
+    def submit(self, fn, args) -> str:
+        if fn == 'mint':
+            done = self.ledger.mint(args[0], args[1])
+        elif fn == 'burn':
+            done = self.ledger.burn(args[0], args[1])
+        elif fn == 'processAction':
+            done = self.ledger.process_action(args[0], args[1], args[3])
+        else:
+            raise ValueError(f'unknown function {fn}')
+        if not done:
+            raise ValueError(f'{fn} rejected by the chaincode')
+        return ''
+
+
+class Handler(BaseHTTPRequestHandler):
+    gateway: FakeGateway = None
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        gateway = self.gateway
+
+        if gateway.latency:
+            time.sleep(gateway.latency)
+
+        if self.path == '/login':
+            self.send_response(200)
+            self.send_header('Set-Cookie', f'session={gateway.login()}; Path=/')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if self.path not in ('/submit', '/evaluate'):
+            return self.reply(404, 'not found')
+
+        cookie = self.headers.get('Cookie', '')
+        session = dict(part.strip().split('=', 1) for part in cookie.split(';') if '=' in part).get('session')
+        if not gateway.valid(session):
+            return self.reply(510, 'session expired')
+
+        if gateway.failure_rate and random.random() < gateway.failure_rate:
+            return self.reply(500, 'injected failure')
+
+        try:
+            data = json.loads(body)
+            if self.path == '/evaluate':
+                result = gateway.evaluate(data['fn'], data['args'])
+            else:
+                result = gateway.submit(data['fn'], data['args'])
+        except Exception as err:
+            return self.reply(500, str(err))
+        self.reply(200, result)
+
+    def reply(self, status, text):
+        content = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=8801, latency=0, failure_rate=0, session_ttl=0) -> ThreadingHTTPServer:
+    """Returns a fake gateway server bound to localhost, to be run with serve_forever()."""
+    handler = type('GatewayHandler', (Handler,), {'gateway': FakeGateway(latency, failure_rate, session_ttl)})
+    return ThreadingHTTPServer(('localhost', port), handler)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Local stand-in of the Fabric gateway API')
+    parser.add_argument('--port', type=int, default=8801)
+    parser.add_argument('--latency', type=float, default=0, help='seconds each request takes')
+    parser.add_argument('--failure-rate', type=float, default=0, help='share (0 to 1) of failed requests')
+    parser.add_argument('--session-ttl', type=float, default=0, help='seconds a login is valid for (0: forever)')
+    args = parser.parse_args()
+
+    server = serve(args.port, args.latency, args.failure_rate, args.session_ttl)
+    print(f'# Fake Fabric gateway listening on http://localhost:{args.port}')
+    server.serve_forever()
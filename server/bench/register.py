@@ -0,0 +1,156 @@
+"""Concurrent action registrations against the 'memory' network, reporting how long requests hold DB connections.\n
+Requires NETWORK = 'memory' in src/config.py; MEMORY_LATENCY is overridden by --latency, and --ipfs-latency replaces
+the Pinata upload with a wait of that many seconds:
+    python -m bench.register --requests 200 --concurrency 20 --latency 0.2 --ipfs-latency 0.2
+Creates its own users, campaign and action, and deletes them when done."""
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import event
+from src.app import app
+from src.common.blockchain import blockchain_manager, MemoryManager
+from src.config import APP_SECRET, NETWORK
+from src.database.db import db_session, engine
+from src.database.models import Action, Campaign, User
+from src.resources import actions
+import io
+import jwt
+import threading
+import time
+import uuid
+
+
+class PoolMonitor:
+    """Counts the connections checked out of the pool and the time they are held, from the pool events."""
+
+    def __init__(self, engine):
+        self.lock = threading.Lock()
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.checkouts = 0
+        self.held = 0.0
+        self.since = {}
+        event.listen(engine, 'checkout', self.on_checkout)
+        event.listen(engine, 'checkin', self.on_checkin)
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self.lock:
+            self.checked_out += 1
+            self.checkouts += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+            self.since[id(connection_record)] = time.monotonic()
+
+    def on_checkin(self, dbapi_connection, connection_record):
+        with self.lock:
+            started = self.since.pop(id(connection_record), None)
+            if started is not None:
+                self.checked_out -= 1
+                self.held += time.monotonic() - started
+
+
+class UploadResponse:
+    status_code = 200
+
+    def json(self):
+        return {'IpfsHash': 'QmBench'}
+
+
+def fake_upload(latency):
+    def upload_file(file):
+        time.sleep(latency)
+        return UploadResponse()
+    return upload_file
+
+
+def token_of(user) -> str:
+    token = jwt.encode({'user': user.as_dict()}, APP_SECRET, algorithm='HS256')
+    return token.decode('utf-8') if isinstance(token, bytes) else token
+
+
+def setup(collaborators):
+    suffix = uuid.uuid4().hex[:8]
+    company = User(f'bench company {suffix}', f'company-{suffix}@bench', f'0xbench{suffix}', '', '', 'PM')
+    company.save()
+    campaign = Campaign('bench campaign', 'bench campaign', company.id)
+    campaign.save()
+    action = Action('bench action', 'bench action', 1, 10 ** 9, 'bench', company.id, campaign.id)
+    action.save()
+    blockchain_manager.mint(None, None, company.blockchain_public, 10 ** 9)
+
+    users = [
+        User(f'bench collaborator {i}', f'collaborator-{i}-{suffix}@bench', f'0xbench{suffix}{i}', '', '', 'CB')
+        for i in range(collaborators)
+    ]
+    for user in users:
+        db_session.add(user)
+    db_session.commit()
+    tokens = [token_of(user) for user in users]
+    ids = (str(action.id), str(company.id), [user.id for user in users])
+    db_session.remove()
+    return ids, tokens
+
+
+def teardown(company_id, user_ids):
+    User.query.filter(User.id.in_(user_ids)).delete(synchronize_session=False)
+    User.query.filter_by(id=company_id).delete()     # cascades to the campaign and the action
+    db_session.commit()
+    db_session.remove()
+
+
+def main():
+    parser = ArgumentParser(description='Concurrent action registrations against the memory network')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds each blockchain call takes')
+    parser.add_argument('--ipfs-latency', type=float, default=None, help='seconds each IPFS upload takes (no uploads if missing)')
+    args = parser.parse_args()
+
+    manager = getattr(blockchain_manager, 'manager', blockchain_manager)
+    if NETWORK != 'memory' or not isinstance(manager, MemoryManager):
+        raise SystemExit("the benchmark requires NETWORK = 'memory' in src/config.py")
+    manager.latency = args.latency
+    if args.ipfs_latency is not None:
+        actions.IPFS_ON = True
+        actions.upload_file = fake_upload(args.ipfs_latency)
+
+    (action_id, company_id, user_ids), tokens = setup(args.concurrency)
+    monitor = PoolMonitor(engine)
+    client = app.test_client()
+    statuses = {}
+    durations = []
+
+    def register(i):
+        data = {
+            'kpi': 1,
+            'verification_url': 'https://example.com/proof'
+        }
+        if args.ipfs_latency is not None:
+            data['image_proof'] = (io.BytesIO(b'proof'), 'proof.png')
+        started = time.monotonic()
+        response = client.post(f'/api/actions/{action_id}/register', headers={
+            'Authorization': f'bearer {tokens[i % len(tokens)]}'
+        }, data=data)
+        durations.append(time.monotonic() - started)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    try:
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            list(executor.map(register, range(args.requests)))
+        elapsed = time.monotonic() - started
+    finally:
+        teardown(company_id, user_ids)
+
+    durations.sort()
+    print(f'# {args.requests} registrations, {args.concurrency} concurrent, {args.latency}s blockchain latency, '
+          f'{args.ipfs_latency}s IPFS latency')
+    print(f'status codes:             {statuses}')
+    print(f'throughput:               {args.requests / elapsed:.1f} requests/s')
+    print(f'latency p50 / p95:        {durations[len(durations) // 2]:.3f}s / {durations[int(len(durations) * 0.95)]:.3f}s')
+    print(f'connection checkouts:     {monitor.checkouts}')
+    print(f'max connections in use:   {monitor.max_checked_out} (pool size {engine.pool.size()})')
+    print(f'mean connections in use:  {monitor.held / elapsed:.1f}')
+    print(f'connection time / request: {monitor.held / args.requests:.3f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Concurrent action registrations served by a single gunicorn worker, once for each given worker class, to compare
+how many registrations a pod can serve at the same time with sync and gevent workers.\n
+Requires NETWORK = 'memory' in src/config.py. Each worker keeps its own in-memory ledger, so the company has no
+balance there and the rewards are 0, but every registration still makes its blockchain calls:
+    python -m bench.workers --worker-classes sync gevent --requests 200 --concurrency 50 --latency 0.2"""
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from bench.register import setup, teardown
+from src.config import NETWORK
+import os
+import requests
+import subprocess
+import sys
+import time
+
+
+def start_server(worker_class, port, latency):
+    environment = dict(
+        os.environ,
+        GUNICORN_WORKER_CLASS=worker_class,
+        GUNICORN_WORKERS='1',
+        GUNICORN_BIND=f'127.0.0.1:{port}',
+        GUNICORN_LOG_LEVEL='warning',
+        BENCH_LATENCY=str(latency)
+    )
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'bench.app:app'],
+        env=environment
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f'http://127.0.0.1:{port}/', timeout=5)
+            return server
+        except requests.RequestException:   # not listening, or the worker is still loading the app
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit(f'the {worker_class} server did not start')
+
+
+def run(worker_class, args, action_id, tokens):
+    server = start_server(worker_class, args.port, args.latency)
+    statuses = {}
+    durations = []
+
+    def register(i):
+        started = time.monotonic()
+        response = requests.post(f'http://127.0.0.1:{args.port}/api/actions/{action_id}/register', headers={
+            'Authorization': f'bearer {tokens[i % len(tokens)]}'
+        }, data={
+            'kpi': 1,
+            'verification_url': 'https://example.com/proof'
+        })
+        durations.append(time.monotonic() - started)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    try:
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            list(executor.map(register, range(args.requests)))
+        elapsed = time.monotonic() - started
+    finally:
+        server.terminate()
+        server.wait()
+
+    durations.sort()
+    print(f'{worker_class:>8}: {statuses}, {args.requests / elapsed:.1f} requests/s, '
+          f'latency p50 / p95 {durations[len(durations) // 2]:.3f}s / {durations[int(len(durations) * 0.95)]:.3f}s')
+
+
+def main():
+    parser = ArgumentParser(description='Concurrent action registrations served by a single gunicorn worker')
+    parser.add_argument('--worker-classes', nargs='+', default=['sync', 'gevent'])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds each blockchain call takes')
+    parser.add_argument('--port', type=int, default=8802)
+    args = parser.parse_args()
+
+    if NETWORK != 'memory':
+        raise SystemExit("the benchmark requires NETWORK = 'memory' in src/config.py")
+
+    (action_id, company_id, user_ids), tokens = setup(args.concurrency)
+    print(f'# {args.requests} registrations, {args.concurrency} concurrent, {args.latency}s blockchain latency, 1 worker')
+    try:
+        for worker_class in args.worker_classes:
+            run(worker_class, args, action_id, tokens)
+    finally:
+        teardown(company_id, user_ids)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 // SPDX-License-Identifier: GPL-3.0
 
 pragma solidity >=0.7.0 <0.9.0;
+pragma experimental ABIEncoderV2; // needed for the struct array of batchProcessAction on 0.7.x
 
 /// @title ERC20-based token used in the Deustocoin project for the University of Deusto
 contract Deustocoin {
@@ -12,6 +13,16 @@ contract Deustocoin {
 
     mapping(address => uint256) balances; // Balances of users, saved with 2 decimals (the value is equivalent to cents)
 
+    /// @notice good action to register in a batchProcessAction call, with the same fields as processAction
+    struct ActionRecord {
+        address from;       // Promoter
+        address to;         // Collaborator
+        uint256 actionID;
+        uint256 value;      // Reward for the action
+        uint256 time;       // When does the action happen
+        bytes32 ipfsHash;   // Hash of the action proof image
+    }
+
     /// @notice MUST trigger when tokens are transferred, including zero value transfers
     /// @dev a token contract which creates new tokens SHOULD trigger the event with _from set to 0x0 when tokens are created
     event Transfer(
@@ -96,6 +107,20 @@ contract Deustocoin {
         emit Transfer(address(0), _to, _value);
     }
 
+    /// @notice mints an amount of UDCs to each of the _to addresses in a single transaction; only an administrator can perform the operation
+    /// @dev _to and _values are matched by position, and a transfer event is emitted for each recipient
+    function batchMint(address[] calldata _to, uint256[] calldata _values) external {
+        require(msg.sender == _contractOwner); // Only the owner can mint
+        require(_to.length == _values.length);
+
+        for (uint256 i = 0; i < _to.length; i++) {
+            require(_to[i] != address(0)); // Do not mint to 0x00...0
+            _totalSupply += _values[i];
+            balances[_to[i]] += _values[i];
+            emit Transfer(address(0), _to[i], _values[i]);
+        }
+    }
+
     /// @notice burns an amount of UDCs from the _from address; only an administrator can perform the operation
     /// @dev a transfer event is emitted noting that the tokens are sent to the 0x00...0 address
     function burn(address _from, uint256 _value) public {
@@ -118,12 +143,34 @@ contract Deustocoin {
         bytes32 _ipfsHash   // Hash of the action proof image
     ) public returns (bool success) {
         require(msg.sender == _contractOwner);   // Only the owner can register an action
+        _processAction(_from, _to, _actionID, _value, _time, _ipfsHash);
+        return true;
+    }
+
+    /// @notice registers several good actions in a single transaction; only an administrator can perform the operation
+    /// @dev the whole batch is reverted if any of the actions is not valid
+    function batchProcessAction(ActionRecord[] calldata _actions) external {
+        require(msg.sender == _contractOwner);   // Only the owner can register actions
+
+        for (uint256 i = 0; i < _actions.length; i++) {
+            ActionRecord calldata action = _actions[i];
+            _processAction(action.from, action.to, action.actionID, action.value, action.time, action.ipfsHash);
+        }
+    }
+
+    function _processAction(
+        address _from,
+        address _to,
+        uint256 _actionID,
+        uint256 _value,
+        uint256 _time,
+        bytes32 _ipfsHash
+    ) private {
         require(balances[_from] >= _value);
 
         require(_to != _contractOwner && _to != address(0)); // Avoid transferring to the contract owner account or the 0x00..0 account
         balances[_from] -= _value;
         balances[_to] += _value;
         emit Action(_from, _to, _actionID, _value, _time, _ipfsHash);
-        return true;
     }
 }
@@ -1,4 +1,7 @@
 #!/bin/bash
 source .env
 # export DATABASE_URL=$DATABASE_URL
-gunicorn -b 0.0.0.0:5000 --chdir ./src app:app --log-level debug
\ No newline at end of file
+# worker type, count and the other gunicorn settings are taken from the GUNICORN_* variables (see gunicorn.conf.py)
+# migrations run once here, not in every worker, as building an index can outlast the worker boot timeout
+python -m src.database.migrations || exit 1
+gunicorn -c gunicorn.conf.py --chdir ./src app:app
@@ -0,0 +1,20 @@
+"""Gunicorn settings, read from environment variables by entrypoint.sh.\n
+GUNICORN_WORKER_CLASS selects the worker type: 'sync' (default) serves one request at a time per worker, while
+'gevent' runs each request in a greenlet, so the requests waiting on the blockchain, IPFS or Google do not block the
+worker. In gevent mode the standard library is patched by gunicorn, which makes the HTTP clients (requests, web3)
+cooperative, and post_fork() makes psycopg2 wait for the database cooperatively as well."""
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
+workers = int(os.environ.get('GUNICORN_WORKERS', 1))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))   # concurrent requests per gevent worker
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'debug')
+preload_app = False     # the app must be imported after gevent patches the standard library
+
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
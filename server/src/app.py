@@ -2,17 +2,19 @@ from flask import Flask
 from flask_cors import CORS
 from flask_restful import Api, Resource
 from src.common.admin import create_admin
+from src.common.pagination import CURSOR_HEADER
 from src.config import APP_SECRET
-from src.database.db import init_db, db_session
+from src.database.db import begin_unit_of_work, db_session, end_unit_of_work, init_db
 from src.resources.actions import *
 from src.resources.auth import *
 from src.resources.campaigns import *
 from src.resources.offers import *
+from src.resources.operations import *
 from src.resources.transactions import *
 from src.resources.users import *
 
 app = Flask(__name__)
-CORS(app, supports_credentials=True)
+CORS(app, supports_credentials=True, expose_headers=[CURSOR_HEADER])
 app.secret_key = APP_SECRET
 api = Api(app)
 
@@ -20,6 +22,18 @@ init_db()
 create_admin(app)
 
 
+@app.before_request
+def start_unit_of_work():
+    begin_unit_of_work()
+
+
+@app.after_request
+def commit_unit_of_work(response):
+    # a single commit per request, and nothing written by failed requests
+    end_unit_of_work(response.status_code < 400)
+    return response
+
+
 @app.teardown_appcontext
 def shutdown_session(exception=None):
     db_session.remove()
@@ -49,6 +63,8 @@ api.add_resource(OffersAll, '/api/offers')
 api.add_resource(OffersDetail, '/api/offers/<string:offer_id>')
 api.add_resource(OfferRedeem, '/api/offers/<string:offer_id>/redeem')
 
+api.add_resource(OperationsDetail, '/api/operations/<string:operation_id>')
+
 api.add_resource(TransactionsAll, '/api/transactions')
 
 api.add_resource(UsersAdmin, '/api/users/admin')
@@ -4,11 +4,26 @@ from secrets import token_bytes
 from pathlib import Path
 from sha3 import keccak_256
 from web3 import Web3
+from src.common.cache import TTLCache
+from src.common.executor import IO_MAX_WORKERS, io_executor
+from src.common.fabric import FabricClient
+from src.common.http import HTTP_TIMEOUT, session_for
+from src.common.memory import MemoryLedger
+from src.common.nonce import NonceManager
+from src.common.txbuilder import TransactionBuilder, nonce_of
 from src.config import BLOCKCHAIN_URL, CONTRACT_ADDRESS, FABRIC_ADMIN_PWD, FABRIC_ADMIN_USER, FABRIC_LOGIN_URL, FABRIC_TRANSACTION_URL, NETWORK
-import requests
+from src import config
+import json
+import random
+import time as clock
 
-
-s = requests.Session()
+BALANCE_CACHE_TTL = getattr(config, 'BALANCE_CACHE_TTL', 5)
+BALANCE_CACHE_SERVE_STALE = getattr(config, 'BALANCE_CACHE_SERVE_STALE', False)
+FABRIC_POOL_SIZE = getattr(config, 'FABRIC_POOL_SIZE', IO_MAX_WORKERS)
+FABRIC_CONNECT_TIMEOUT = getattr(config, 'FABRIC_CONNECT_TIMEOUT', 5)
+FABRIC_READ_TIMEOUT = getattr(config, 'FABRIC_READ_TIMEOUT', 30)
+MEMORY_LATENCY = getattr(config, 'MEMORY_LATENCY', 0)              # seconds each call to the memory network takes
+MEMORY_FAILURE_RATE = getattr(config, 'MEMORY_FAILURE_RATE', 0)    # share (0 to 1) of memory network calls that fail
 
 
 def generate_keys():
@@ -20,64 +35,24 @@ def generate_keys():
     return {'address': '0x' + address.hex(), 'key': private_key.hex()}
 
 
-def fabric_login():
-    headers = {
-        "Content-Type": "application/json; charset=utf-8"
-    }
-    data = {
-        "userID": FABRIC_ADMIN_USER,
-        "password": FABRIC_ADMIN_PWD
-    }
-    response = s.post(
-        FABRIC_LOGIN_URL,
-        headers=headers,
-        json=data
-    )
-
-
-def fabric_send_transaction(method, *params):
-    headers = {
-        "Content-Type": "application/json; charset=utf-8"
-    }
-    data = {
-        "fn": method,
-        "args": [*params]
-    }
-    if method == 'balanceOf':
-        response = s.post(
-            f'{FABRIC_TRANSACTION_URL}/evaluate',
-            headers=headers,
-            json=data
-        )
-        if response.status_code == 400 or response.status_code == 510:
-            fabric_login()
-            response = s.post(
-                f'{FABRIC_TRANSACTION_URL}/evaluate',
-                headers=headers,
-                json=data
-            )
-        return int(response.content.decode("utf-8"))
-    else:
-        response = s.post(
-            f'{FABRIC_TRANSACTION_URL}/submit',
-            headers=headers,
-            json=data
-        )
-        if response.status_code == 400 or response.status_code == 510:
-            fabric_login()
-            response = s.post(
-                f'{FABRIC_TRANSACTION_URL}/submit',
-                headers=headers,
-                json=data
-            )
-        return response.content.decode("utf-8")
+class TransactionRejected(ValueError):
+    """The node rejected a signed transaction without keeping it, so it can never be mined."""
 
 
 class BlockchainManager(metaclass=ABCMeta):
+    # whether the batch methods apply all of their writes or none of them
+    atomic_batches = True
+    # whether balances reflect the writes as soon as the write methods return, or only once they are mined
+    instant_writes = False
+
     @abstractmethod
     def balance_of(self, address):
         pass
 
+    @abstractmethod
+    def balance_of_many(self, addresses):
+        pass
+
     @abstractmethod
     def mint(self, caller, caller_key, to, value):
         pass
@@ -90,93 +65,399 @@ class BlockchainManager(metaclass=ABCMeta):
     def processAction(self, caller, caller_key, promoter, to, action_id, reward, time, ipfs_hash):
         pass
 
+    @abstractmethod
+    def batchMint(self, caller, caller_key, recipients, values):
+        pass
+
+    @abstractmethod
+    def batchProcessAction(self, caller, caller_key, actions):
+        pass
+
+    def sign(self, caller, caller_key, method, params):
+        """Signs the call of a write method with 'params' without sending it, returning the signed transaction and
+        its hash, to be sent with send_signed(). Returns None on networks whose writes are not signed locally."""
+        return None
+
+    def send_signed(self, caller, signed_transaction, transaction_hash):
+        raise NotImplementedError
+
 
 class EthereumManager(BlockchainManager):
+    RPC_BATCH_SIZE = 500
+
     def __init__(self) -> None:
-        self.w3 = Web3(Web3.HTTPProvider(BLOCKCHAIN_URL))
+        self.session = session_for(BLOCKCHAIN_URL)     # kept-alive connections to the node for web3 and rpc_batch
+        self.w3 = Web3(Web3.HTTPProvider(BLOCKCHAIN_URL, session=self.session, request_kwargs={'timeout': HTTP_TIMEOUT}))
 
         p = Path(__file__).with_name('contractABI.json')
-        abi = p.open('r').read()
-        self.contract = self.w3.eth.contract(address=Web3.toChecksumAddress(CONTRACT_ADDRESS), abi=abi)
+        abi = json.loads(p.open('r').read())
+        contract_address = Web3.toChecksumAddress(CONTRACT_ADDRESS)
+        self.contract = self.w3.eth.contract(address=contract_address, abi=abi)
+        self.builder = TransactionBuilder(self.w3, contract_address, abi)
+        self.nonces = {}
 
     def balance_of(self, address):
         """Returns the balance of the input address."""
         valid_address = Web3.toChecksumAddress(address)
         return self.contract.functions.balanceOf(valid_address).call()
 
+    def balance_of_many(self, addresses):
+        """Returns the balances of the input addresses, in the same order, using JSON-RPC batch requests."""
+        calls = [
+            ('eth_call', [{'to': self.contract.address, 'data': '0x' + self.builder.encode('balanceOf', address).hex()}, 'latest'])
+            for address in addresses
+        ]
+        return [int(result, 16) for result in self.rpc_batch(calls)]
+
+    def rpc_batch(self, calls):
+        """Sends (method, params) JSON-RPC calls to the node in batches, returning their results in order.\n
+        Responses with an error raise a ValueError, like web3 does for single requests."""
+        results = []
+        for start in range(0, len(calls), self.RPC_BATCH_SIZE):
+            chunk = calls[start:start + self.RPC_BATCH_SIZE]
+            payload = [
+                {'jsonrpc': '2.0', 'id': i, 'method': method, 'params': params}
+                for i, (method, params) in enumerate(chunk)
+            ]
+            response = self.session.post(BLOCKCHAIN_URL, json=payload, timeout=HTTP_TIMEOUT)
+            response.raise_for_status()
+
+            by_id = {item.get('id'): item for item in response.json()}
+            for i in range(len(chunk)):
+                item = by_id[i]
+                if 'error' in item:
+                    raise ValueError(item['error'])
+                results.append(item.get('result'))
+        return results
+
+    def _nonce_manager(self, caller) -> NonceManager:
+        if caller not in self.nonces:
+            self.nonces[caller] = NonceManager(self.w3, caller)
+        return self.nonces[caller]
+
+    @staticmethod
+    def contract_args(method, params) -> list:
+        """Returns the contract function arguments of a call to a write method with 'params'."""
+        if method == 'mint':
+            return [params['to'], int(params['value'])]
+        if method == 'burn':
+            return [params['from_acc'], int(params['value'])]
+        if method == 'processAction':
+            return [params['promoter'], params['to'], params['action_id'], int(params['reward']), params['time'],
+                    params['ipfs_hash']]
+        if method == 'batchMint':
+            return [list(params['recipients']), [int(value) for value in params['values']]]
+        if method == 'batchProcessAction':
+            return [[
+                (a['promoter'], a['to'], a['action_id'], int(a['reward']), a['time'], a['ipfs_hash'])
+                for a in params['actions']
+            ]]
+        raise ValueError(f'unknown write method {method}')
+
+    def sign(self, caller, caller_key, method, params):
+        nonce = self._nonce_manager(caller).allocate()
+        transaction = self.builder.build(method, self.contract_args(method, params), nonce)
+        signed_tx = self.builder.sign(transaction, caller_key)
+        return signed_tx.rawTransaction.hex(), signed_tx.hash.hex()
+
+    def send_signed(self, caller, signed_transaction, transaction_hash):
+        """Sends a transaction signed by sign(), returning its hash. Sending it again is harmless: if the node
+        already has it (e.g. a previous attempt timed out after reaching the node) it is taken as sent. A transaction
+        the node rejects without having it raises TransactionRejected, and its nonce is given back when possible."""
+        try:
+            self.w3.eth.send_raw_transaction(signed_transaction)
+            return transaction_hash
+        except ValueError as err:
+            known, = self.rpc_batch([('eth_getTransactionByHash', [transaction_hash])])
+            if known is not None:
+                return transaction_hash
+
+            nonces = self._nonce_manager(caller)
+            nonces.release(nonce_of(signed_transaction))
+            nonces.resync()
+            raise TransactionRejected(str(err)) from err
+
+    def _send_transaction(self, function_name, args, caller, caller_key):
+        """Signs a contract call with a locally allocated nonce and submits it to the node, returning its hash.\n
+        If the node rejects the transaction (e.g. its nonce is too low or too distant) the nonce is given back when
+        possible, the nonce sequence is moved forward to the node count if it is behind, and the transaction is
+        retried once."""
+        nonces = self._nonce_manager(caller)
+
+        for attempt in range(2):
+            nonce = nonces.allocate()
+            transaction = self.builder.build(function_name, args, nonce)
+            signed_tx = self.builder.sign(transaction, caller_key)
+            try:
+                self.w3.eth.send_raw_transaction(signed_tx.rawTransaction)
+                return signed_tx.hash.hex()
+            except ValueError:
+                # rejected by the node, so this nonce was not used by the transaction
+                nonces.release(nonce)
+                nonces.resync()
+                if attempt > 0:
+                    raise
+            except Exception:
+                # the transaction may or may not have reached the node, so the nonce cannot be given back
+                nonces.resync()
+                raise
+
+    def fill_nonce_gap(self, caller, caller_key) -> str or None:
+        """Sends a transfer of no ether from the caller to itself with the nonce its transactions are stuck behind, if
+        any (see NonceManager.stalled_nonce), so the node can mine them, returning its hash."""
+        nonce = self._nonce_manager(caller).stalled_nonce()
+        if nonce is None:
+            return None
+
+        print(f'# Filling the nonce gap {nonce} of {caller}')
+        signed_tx = self.builder.sign(self.builder.build_self_transfer(caller, nonce), caller_key)
+        try:
+            self.w3.eth.send_raw_transaction(signed_tx.rawTransaction)
+        except ValueError as err:
+            # a transaction with that nonce reached the node in the meantime
+            print(f'# Nonce gap {nonce} not filled: {err}')
+            return None
+        return signed_tx.hash.hex()
+
     def mint(self, caller, caller_key, to, value):
         """Allows an administrator to mint/generate an amount of coins to the 'to' address."""
-        transaction = self.contract.functions.mint(
-            to, int(value)
-        ).buildTransaction({
-            'gas': 10000000,
-            'gasPrice': self.w3.toWei(self.w3.eth.gas_price, 'gwei'),
-            'from': caller,
-            'nonce': self.w3.eth.getTransactionCount(caller, 'pending')
-        })
-        signed_tx = self.w3.eth.account.signTransaction(
-            transaction, private_key=caller_key)
-        return self.w3.eth.sendRawTransaction(signed_tx.rawTransaction)
+        return self._send_transaction('mint', self.contract_args('mint', {'to': to, 'value': value}), caller, caller_key)
 
     def burn(self, caller, caller_key, from_acc, value):
         """Allows an administrator to burn/delete and amount of coins from the 'from_acc' address."""
-        transaction = self.contract.functions.burn(
-            from_acc, int(value)
-        ).buildTransaction({
-            'gas': 10000000,
-            'gasPrice': self.w3.toWei(self.w3.eth.gas_price, 'gwei'),
-            'from': caller,
-            'nonce': self.w3.eth.getTransactionCount(caller, 'pending')
-        })
-        signed_tx = self.w3.eth.account.signTransaction(
-            transaction, private_key=caller_key)
-        return self.w3.eth.sendRawTransaction(signed_tx.rawTransaction)
+        return self._send_transaction(
+            'burn', self.contract_args('burn', {'from_acc': from_acc, 'value': value}), caller, caller_key
+        )
 
     def processAction(self, caller, caller_key, promoter, to, action_id, reward, time, ipfs_hash):
         """Registers a collaborator's good action on the blockchain and gives them credit for its completion."""
-        transaction = self.contract.functions.processAction(
-            promoter, to, action_id, reward, time, ipfs_hash
-        ).buildTransaction({
-            'gas': 10000000,
-            'gasPrice': self.w3.toWei(self.w3.eth.gas_price, 'gwei'),
-            'from': caller,
-            'nonce': self.w3.eth.getTransactionCount(caller, 'pending')
-        })
-        signed_tx = self.w3.eth.account.signTransaction(
-            transaction, private_key=caller_key)
-        return self.w3.eth.sendRawTransaction(signed_tx.rawTransaction)
+        params = {'promoter': promoter, 'to': to, 'action_id': action_id, 'reward': reward, 'time': time, 'ipfs_hash': ipfs_hash}
+        return self._send_transaction('processAction', self.contract_args('processAction', params), caller, caller_key)
+
+    def batchMint(self, caller, caller_key, recipients, values):
+        """Mints an amount of coins to each of the recipients in a single transaction."""
+        params = {'recipients': recipients, 'values': values}
+        return self._send_transaction('batchMint', self.contract_args('batchMint', params), caller, caller_key)
+
+    def batchProcessAction(self, caller, caller_key, actions):
+        """Registers several good actions in a single transaction.\n
+        Each action is a dict with the arguments of processAction: promoter, to, action_id, reward, time and ipfs_hash."""
+        params = {'actions': actions}
+        return self._send_transaction('batchProcessAction', self.contract_args('batchProcessAction', params), caller, caller_key)
 
 
 class FabricManager(BlockchainManager):
+    # the Fabric chaincode has no batch functions, so a batch can fail after applying some of its writes
+    atomic_batches = False
+    instant_writes = True   # the gateway answers once the transaction is committed
+
     def __init__(self):
-        fabric_login()
+        self.client = FabricClient(
+            FABRIC_LOGIN_URL,
+            FABRIC_TRANSACTION_URL,
+            FABRIC_ADMIN_USER,
+            FABRIC_ADMIN_PWD,
+            pool_size=FABRIC_POOL_SIZE,
+            timeout=(FABRIC_CONNECT_TIMEOUT, FABRIC_READ_TIMEOUT)
+        )
+        self.client.login()
 
     def balance_of(self, address):
         try:
-            balance = fabric_send_transaction('balanceOf', address)
+            balance = int(self.client.call('balanceOf', address))
             return balance
         except:
             return 0
 
+    def balance_of_many(self, addresses):
+        """Returns the balances of the input addresses, in the same order, evaluating them in parallel."""
+        return list(io_executor.map(self.balance_of, addresses))
+
+    # write errors are raised, so the outbox retries the writes that failed instead of taking them as done
     def mint(self, caller, caller_key, to, value):
+        self.client.call('mint', to, value)
+        return ''
+
+    def burn(self, caller, caller_key, from_acc, value):
+        self.client.call('burn', from_acc, value)
+        return ''
+
+    def processAction(self, caller, caller_key, promoter, to, action_id, reward, time, ipfs_hash):
+        self.client.call('processAction', promoter, to, action_id, reward, time, ipfs_hash)
+        return ''
+
+    # the Fabric chaincode has no batch functions, so batches are submitted one call at a time
+    def batchMint(self, caller, caller_key, recipients, values):
+        for to, value in zip(recipients, values):
+            self.mint(caller, caller_key, to, value)
+        return ''
+
+    def batchProcessAction(self, caller, caller_key, actions):
+        for action in actions:
+            self.processAction(caller, caller_key, **action)
+        return ''
+
+
+class MemoryManager(BlockchainManager):
+    """In-process network for tests and load benchmarks, without any blockchain node.\n
+    Every call waits 'latency' seconds and fails with a ConnectionError with probability 'failure_rate', to
+    emulate a remote node. Writes are applied at once and return a random transaction hash; writes the contract
+    would revert do not change the balances, as a reverted transaction on the ethereum network."""
+    instant_writes = True
+
+    def __init__(self, latency=0, failure_rate=0):
+        self.ledger = MemoryLedger()
+        self.latency = latency
+        self.failure_rate = failure_rate
+
+    def _call(self):
+        if self.latency:
+            clock.sleep(self.latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise ConnectionError('memory network: injected failure')
+
+    def _transaction_hash(self):
+        return '0x' + token_bytes(32).hex()
+
+    def balance_of(self, address):
+        self._call()
+        return self.ledger.balance_of(address)
+
+    def balance_of_many(self, addresses):
+        """Returns the balances of the input addresses, in the same order, paying the latency once as a batch request."""
+        self._call()
+        return [self.ledger.balance_of(address) for address in addresses]
+
+    def mint(self, caller, caller_key, to, value):
+        self._call()
+        self.ledger.mint(to, value)
+        return self._transaction_hash()
+
+    def burn(self, caller, caller_key, from_acc, value):
+        self._call()
+        self.ledger.burn(from_acc, value)
+        return self._transaction_hash()
+
+    def processAction(self, caller, caller_key, promoter, to, action_id, reward, time, ipfs_hash):
+        self._call()
+        self.ledger.process_action(promoter, to, reward)
+        return self._transaction_hash()
+
+    def batchMint(self, caller, caller_key, recipients, values):
+        self._call()
+        for to, value in zip(recipients, values):
+            self.ledger.mint(to, value)
+        return self._transaction_hash()
+
+    def batchProcessAction(self, caller, caller_key, actions):
+        self._call()
+        self.ledger.process_actions([(action['promoter'], action['to'], action['reward']) for action in actions])
+        return self._transaction_hash()
+
+
+class CachedBlockchainManager(BlockchainManager):
+    """Per-process balance cache in front of another BlockchainManager.\n
+    Balances are kept for 'ttl' seconds. When this process calls mint, burn or processAction, the entries of the
+    involved addresses are expired, and balances read for them during the next 'ttl' seconds are not cached, as the
+    submitted transaction may not have been mined yet. With 'serve_stale', the last known balance is returned when
+    the blockchain cannot be reached."""
+
+    def __init__(self, manager, ttl, serve_stale=False, max_size=10000):
+        self.manager = manager
+        self.serve_stale = serve_stale
+        self.balances = TTLCache(ttl, max_size)
+        self.recent_writes = TTLCache(ttl, max_size)
+
+    def __getattr__(self, name):
+        # network specific helpers (e.g. EthereumManager.rpc_batch) are served by the wrapped manager
+        return getattr(self.manager, name)
+
+    @property
+    def atomic_batches(self):
+        return self.manager.atomic_batches
+
+    @property
+    def instant_writes(self):
+        return self.manager.instant_writes
+
+    def sign(self, caller, caller_key, method, params):
+        return self.manager.sign(caller, caller_key, method, params)
+
+    def send_signed(self, caller, signed_transaction, transaction_hash):
+        return self.manager.send_signed(caller, signed_transaction, transaction_hash)
+
+    def _store(self, address, balance):
+        if address.lower() not in self.recent_writes:
+            self.balances.set(address.lower(), balance)
+
+    def _written(self, *addresses):
+        for address in addresses:
+            self.balances.expire(address.lower())
+            self.recent_writes.set(address.lower(), True)
+
+    def balance_of(self, address):
+        balance = self.balances.get(address.lower())
+        if balance is not None:
+            return balance
+
         try:
-            fabric_send_transaction('mint', to, value)
-            return ''
-        except:
-            return 0
+            balance = self.manager.balance_of(address)
+        except Exception:
+            stale = self.balances.get(address.lower(), allow_stale=True)
+            if not self.serve_stale or stale is None:
+                raise
+            return stale
+
+        self._store(address, balance)
+        return balance
+
+    def balance_of_many(self, addresses):
+        balances = {address: self.balances.get(address.lower()) for address in addresses}
+        missing = [address for address, balance in balances.items() if balance is None]
+
+        if missing:
+            try:
+                fetched = self.manager.balance_of_many(missing)
+            except Exception:
+                fetched = [self.balances.get(address.lower(), allow_stale=True) for address in missing]
+                if not self.serve_stale or None in fetched:
+                    raise
+            else:
+                for address, balance in zip(missing, fetched):
+                    self._store(address, balance)
+            balances.update(zip(missing, fetched))
+
+        return [balances[address] for address in addresses]
+
+    def mint(self, caller, caller_key, to, value):
+        try:
+            return self.manager.mint(caller, caller_key, to, value)
+        finally:
+            self._written(to)
 
     def burn(self, caller, caller_key, from_acc, value):
         try:
-            fabric_send_transaction('burn', from_acc, value)
-            return ''
-        except:
-            return 0
+            return self.manager.burn(caller, caller_key, from_acc, value)
+        finally:
+            self._written(from_acc)
 
     def processAction(self, caller, caller_key, promoter, to, action_id, reward, time, ipfs_hash):
         try:
-            fabric_send_transaction('processAction', promoter, to, action_id, reward, time, ipfs_hash)
-        except:
-            return 0
+            return self.manager.processAction(caller, caller_key, promoter, to, action_id, reward, time, ipfs_hash)
+        finally:
+            self._written(promoter, to)
+
+    def batchMint(self, caller, caller_key, recipients, values):
+        try:
+            return self.manager.batchMint(caller, caller_key, recipients, values)
+        finally:
+            self._written(*recipients)
+
+    def batchProcessAction(self, caller, caller_key, actions):
+        try:
+            return self.manager.batchProcessAction(caller, caller_key, actions)
+        finally:
+            self._written(*[a['promoter'] for a in actions], *[a['to'] for a in actions])
 
 
 def getBlockchainManager(network):
@@ -185,7 +466,11 @@ def getBlockchainManager(network):
         return FabricManager()
     elif network == 'ethereum':
         return EthereumManager()
+    elif network == 'memory':
+        return MemoryManager(MEMORY_LATENCY, MEMORY_FAILURE_RATE)
     else:
         return None
 
-blockchain_manager = getBlockchainManager(NETWORK)
\ No newline at end of file
+blockchain_manager = getBlockchainManager(NETWORK)
+if blockchain_manager and BALANCE_CACHE_TTL > 0:
+    blockchain_manager = CachedBlockchainManager(blockchain_manager, BALANCE_CACHE_TTL, BALANCE_CACHE_SERVE_STALE)
\ No newline at end of file
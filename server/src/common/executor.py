@@ -0,0 +1,7 @@
+from concurrent.futures import ThreadPoolExecutor
+from src import config
+
+IO_MAX_WORKERS = getattr(config, 'IO_MAX_WORKERS', 16)
+
+# Shared, bounded pool used to run independent blocking I/O calls (blockchain nodes, gateways) in parallel
+io_executor = ThreadPoolExecutor(max_workers=IO_MAX_WORKERS, thread_name_prefix='io')
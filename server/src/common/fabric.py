@@ -0,0 +1,101 @@
+from requests.adapters import HTTPAdapter
+import requests
+import threading
+import time
+
+EVALUATE_METHODS = ('balanceOf',)   # read-only chaincode functions, sent to /evaluate instead of /submit
+
+
+class FabricClient:
+    """Thread-safe client of the Fabric gateway API.\n
+    Requests share a sized connection pool and have connect and read timeouts. When the gateway session expires
+    (400/510 responses), a single caller logs in again while the others wait for it, instead of every concurrent
+    caller logging in at the same time. Latency is counted per chaincode method, see stats()."""
+
+    def __init__(self, login_url, transaction_url, user, password, pool_size=16, timeout=(5, 30)):
+        self.login_url = login_url
+        self.transaction_url = transaction_url
+        self.credentials = {
+            'userID': user,
+            'password': password
+        }
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._login_lock = threading.Lock()
+        self._login_generation = 0      # increased on each login, so callers can tell if they missed one
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def login(self):
+        with self._login_lock:
+            self._login()
+
+    def _login(self):
+        self.session.post(
+            self.login_url,
+            headers={'Content-Type': 'application/json; charset=utf-8'},
+            json=self.credentials,
+            timeout=self.timeout
+        )
+        self._login_generation += 1
+
+    def _relogin(self, generation):
+        """Logs in again, unless another caller already did it since 'generation' was read."""
+        with self._login_lock:
+            if self._login_generation == generation:
+                self._login()
+
+    def _post(self, endpoint, data):
+        return self.session.post(
+            f'{self.transaction_url}/{endpoint}',
+            headers={'Content-Type': 'application/json; charset=utf-8'},
+            json=data,
+            timeout=self.timeout
+        )
+
+    def call(self, method, *params) -> str:
+        """Evaluates or submits a chaincode function, returning the response body."""
+        endpoint = 'evaluate' if method in EVALUATE_METHODS else 'submit'
+        data = {
+            'fn': method,
+            'args': [*params]
+        }
+
+        started = time.monotonic()
+        failed = True
+        try:
+            generation = self._login_generation
+            response = self._post(endpoint, data)
+            if response.status_code == 400 or response.status_code == 510:
+                self._relogin(generation)
+                response = self._post(endpoint, data)
+            failed = not response.ok
+            return response.content.decode('utf-8')
+        finally:
+            self._record(method, time.monotonic() - started, failed)
+
+    def _record(self, method, elapsed, failed):
+        with self._stats_lock:
+            stats = self._stats.setdefault(method, {'count': 0, 'errors': 0, 'total': 0.0, 'max': 0.0})
+            stats['count'] += 1
+            stats['errors'] += int(failed)
+            stats['total'] += elapsed
+            stats['max'] = max(stats['max'], elapsed)
+
+    def stats(self) -> dict:
+        """Returns the number of calls, failed calls and the mean and max latency (in seconds) of each method."""
+        with self._stats_lock:
+            return {
+                method: {
+                    'count': s['count'],
+                    'errors': s['errors'],
+                    'mean': s['total'] / s['count'],
+                    'max': s['max']
+                }
+                for method, s in self._stats.items()
+            }
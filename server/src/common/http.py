@@ -0,0 +1,111 @@
+from requests.adapters import HTTPAdapter
+from src import config
+from urllib.parse import urlsplit
+import random
+import requests
+import threading
+import time
+
+try:
+    import h2   # optional, enables HTTP/2 through httpx
+    import httpx
+except ImportError:
+    httpx = None
+
+HTTP_CONNECT_TIMEOUT = getattr(config, 'HTTP_CONNECT_TIMEOUT', 5)  # seconds to wait for a connection to an external service
+HTTP_READ_TIMEOUT = getattr(config, 'HTTP_READ_TIMEOUT', 30)       # seconds to wait for an external service response
+HTTP_POOL_SIZE = getattr(config, 'HTTP_POOL_SIZE', 10)             # keep-alive connections per destination
+HTTP_RETRIES = getattr(config, 'HTTP_RETRIES', 2)
+HTTP_BACKOFF = getattr(config, 'HTTP_BACKOFF', 0.5)                # base delay in seconds between retries
+HTTP2_ON = getattr(config, 'HTTP2_ON', False)
+
+HTTP2 = HTTP2_ON and httpx is not None
+if HTTP2_ON and not HTTP2:
+    print('# HTTP2_ON is set but the h2 package is not installed, using HTTP/1.1')
+HTTP_TIMEOUT = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+# requests that can be sent again without side effects, unless the caller says otherwise
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+RETRY_STATUSES = (429, 502, 503, 504)
+TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout) + ((httpx.TransportError,) if httpx is not None else ())
+
+# shared clients of the outbound calls, one per destination (scheme and host), so connections are kept alive and reused
+_sessions = {}
+_clients = {}
+_lock = threading.Lock()
+
+
+def _destination(url):
+    parts = urlsplit(url)
+    return parts.scheme, parts.netloc
+
+
+def session_for(url) -> requests.Session:
+    """Returns the shared requests session of the URL destination, for the libraries that need one (e.g. web3).
+    Its requests must be given a timeout, like HTTP_TIMEOUT."""
+    destination = _destination(url)
+    session = _sessions.get(destination)
+    if session is None:
+        with _lock:
+            session = _sessions.get(destination)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _sessions[destination] = session
+    return session
+
+
+def client_for(url):
+    """Returns the shared client of the URL destination: an HTTP/2 capable httpx client if HTTP2_ON is set and the
+    h2 package is installed, or a requests session otherwise."""
+    if not HTTP2:
+        return session_for(url)
+
+    destination = _destination(url)
+    client = _clients.get(destination)
+    if client is None:
+        with _lock:
+            client = _clients.get(destination)
+            if client is None:
+                client = httpx.Client(
+                    http2=True,
+                    timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+                    limits=httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE)
+                )
+                _clients[destination] = client
+    return client
+
+
+def request(method, url, retry=None, **kwargs):
+    """Sends a request through the shared client of the URL destination, with connect and read timeouts.\n
+    Connection errors, timeouts and RETRY_STATUSES responses are retried up to HTTP_RETRIES times, with exponential
+    backoff and random jitter, so the clients that failed together do not retry together. Only IDEMPOTENT_METHODS
+    are retried, unless 'retry' says otherwise. The response has status_code, content, text and json() with either
+    client."""
+    if retry is None:
+        retry = method.upper() in IDEMPOTENT_METHODS
+    client = client_for(url)
+    if not HTTP2:
+        kwargs.setdefault('timeout', HTTP_TIMEOUT)
+
+    attempt = 0
+    while True:
+        try:
+            response = client.request(method, url, **kwargs)
+            if not retry or attempt >= HTTP_RETRIES or response.status_code not in RETRY_STATUSES:
+                return response
+        except TRANSIENT_ERRORS:
+            if not retry or attempt >= HTTP_RETRIES:
+                raise
+        time.sleep(HTTP_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5))
+        attempt += 1
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
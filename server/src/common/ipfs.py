@@ -1,5 +1,5 @@
+from src.common import http
 from src.config import PINATA_TOKEN, PINATA_URL
-import requests
 
 def upload_file(file):
     headers = {
@@ -8,9 +8,10 @@ def upload_file(file):
     data = {
         'file': file
     }
-    response = requests.post(
+    response = http.post(
         PINATA_URL,
         headers=headers,
-        files=data
+        files=data,
+        retry=True  # the content is addressed by its hash, so pinning it again has no effect
     )
     return response
\ No newline at end of file
@@ -0,0 +1,67 @@
+import threading
+
+ZERO_ADDRESS = '0x' + '0' * 40
+
+
+class MemoryLedger:
+    """In-process stand-in for the Smart Contract state, following the rules of contracts/ethereum/socialcoin.sol.\n
+    Calls that the contract would revert leave the state untouched and return False. Addresses are compared in
+    lowercase."""
+
+    def __init__(self):
+        self.balances = {}
+        self.total_supply = 0
+        self.events = []    # (event name, from, to, value), like the Transfer and Action contract events
+        self._lock = threading.Lock()
+
+    def balance_of(self, address) -> int:
+        with self._lock:
+            return self.balances.get(address.lower(), 0)
+
+    def mint(self, to, value) -> bool:
+        to, value = to.lower(), int(value)
+        with self._lock:
+            if to == ZERO_ADDRESS:
+                return False
+            self.total_supply += value
+            self.balances[to] = self.balances.get(to, 0) + value
+            self.events.append(('Transfer', ZERO_ADDRESS, to, value))
+            return True
+
+    def burn(self, from_acc, value) -> bool:
+        from_acc, value = from_acc.lower(), int(value)
+        with self._lock:
+            if from_acc == ZERO_ADDRESS or self.balances.get(from_acc, 0) < value:
+                return False
+            self.total_supply -= value
+            self.balances[from_acc] = self.balances.get(from_acc, 0) - value
+            self.events.append(('Transfer', from_acc, ZERO_ADDRESS, value))
+            return True
+
+    def process_action(self, promoter, to, value) -> bool:
+        promoter, to, value = promoter.lower(), to.lower(), int(value)
+        with self._lock:
+            if self.balances.get(promoter, 0) < value or to == ZERO_ADDRESS:
+                return False
+            self.balances[promoter] = self.balances.get(promoter, 0) - value
+            self.balances[to] = self.balances.get(to, 0) + value
+            self.events.append(('Action', promoter, to, value))
+            return True
+
+    def process_actions(self, actions) -> bool:
+        """Applies several (promoter, to, value) actions as a single transaction: if any of them would revert,
+        none is applied, as in the batchProcessAction contract call."""
+        actions = [(promoter.lower(), to.lower(), int(value)) for promoter, to, value in actions]
+        with self._lock:
+            balances = {}   # balances of the involved addresses after the actions applied so far
+            for promoter, to, value in actions:
+                balance = balances.get(promoter, self.balances.get(promoter, 0))
+                if balance < value or to == ZERO_ADDRESS:
+                    return False
+                balances[promoter] = balance - value
+                balances[to] = balances.get(to, self.balances.get(to, 0)) + value
+
+            self.balances.update(balances)
+            for promoter, to, value in actions:
+                self.events.append(('Action', promoter, to, value))
+            return True
@@ -0,0 +1,87 @@
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+from src import config
+from src.database.db import engine
+from src.database.models import Signer
+import time
+
+NONCE_GAP_TIMEOUT = getattr(config, 'NONCE_GAP_TIMEOUT', 60)   # seconds the node can mine nothing of a signer with nonces allocated before one counts as lost
+
+signers = Signer.__table__
+
+
+class NonceManager:
+    """Hands out the transaction nonces of a signer account locally.\n
+    The next nonce is kept in the 'signer' table, so every worker process draws from the same sequence
+    and concurrent transactions never get signed with the same nonce. The node is only asked for the
+    account's transaction count the first time, and again after a rejected transaction. The stored nonce only
+    moves back for a nonce known to be unsent (see release()), as other workers may hold nonces above the node
+    count that they have not sent yet. A nonce that is never sent (e.g. its send failed before reaching the node,
+    after a later nonce was allocated) leaves a gap every later transaction waits behind, which is found by
+    stalled_nonce()."""
+
+    def __init__(self, w3, address):
+        self.w3 = w3
+        self.address = address
+        self._stall = None  # (node count, when it was first seen) while allocated nonces are above it
+
+    def allocate(self) -> int:
+        """Reserves and returns the next nonce of the signer."""
+        with engine.begin() as conn:
+            # the row lock taken by the UPDATE serializes concurrent allocations across processes
+            next_nonce = conn.execute(
+                signers.update()
+                .where(signers.c.address == self.address)
+                .values(next_nonce=signers.c.next_nonce + 1)
+                .returning(signers.c.next_nonce)
+            ).scalar()
+
+        if next_nonce is None:
+            self.resync()
+            return self.allocate()
+        return next_nonce - 1
+
+    def release(self, nonce) -> bool:
+        """Gives back a nonce whose transaction never reached the node, which is only possible while no later
+        nonce has been allocated. Returns whether it was given back; otherwise it is left as a gap."""
+        with engine.begin() as conn:
+            released = conn.execute(
+                signers.update()
+                .where(signers.c.address == self.address, signers.c.next_nonce == nonce + 1)
+                .values(next_nonce=nonce)
+            ).rowcount
+        return released == 1
+
+    def resync(self):
+        """Moves the stored nonce forward to the pending transaction count of the node, if it is behind it."""
+        pending = self.w3.eth.get_transaction_count(self.address, 'pending')
+        statement = insert(signers).values(address=self.address, next_nonce=pending)
+        with engine.begin() as conn:
+            conn.execute(
+                statement.on_conflict_do_update(
+                    index_elements=[signers.c.address],
+                    set_={'next_nonce': func.greatest(signers.c.next_nonce, statement.excluded.next_nonce)}
+                )
+            )
+
+    def stalled_nonce(self) -> int or None:
+        """Returns the nonce the signer's transactions are stuck behind, if the node count of mined transactions
+        has stayed below the allocated nonces for NONCE_GAP_TIMEOUT seconds, or None. Meant to be called
+        periodically by a single process (the receipt tracker)."""
+        latest = self.w3.eth.get_transaction_count(self.address, 'latest')
+        with engine.connect() as conn:
+            next_nonce = conn.execute(select(signers.c.next_nonce).where(signers.c.address == self.address)).scalar()
+
+        if next_nonce is None or latest >= next_nonce:
+            self._stall = None
+            return None
+
+        now = time.monotonic()
+        if self._stall is None or self._stall[0] != latest:
+            self._stall = (latest, now)
+            return None
+        if now - self._stall[1] < NONCE_GAP_TIMEOUT:
+            return None
+
+        self._stall = None
+        return latest
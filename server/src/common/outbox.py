@@ -0,0 +1,68 @@
+from datetime import datetime
+from src import config
+from src.common.blockchain import blockchain_manager
+from src.config import ADMIN_ADDRESS, PRIVATE_KEY
+from src.database.db import db_session, save_changes
+from src.database.models import Operation, Transaction
+
+OUTBOX_ON = getattr(config, 'OUTBOX_ON', False)
+
+# kinds of writes that can be submitted together in a single transaction
+BATCHABLE = ('mint', 'processAction')
+
+
+def chain_write(kind: str, params: dict, record: dict = None, user_id=None) -> Operation or None:
+    """Performs a blockchain write as the administrator: 'kind' is the BlockchainManager method, 'params' its
+    arguments (except the caller and its key), 'record' the fields of the Transaction row to save for it, if any,
+    and 'user_id' the user whose request causes it, the only one (besides administrators) who can read its Operation.\n
+    If OUTBOX_ON is set, the write is only queued as an Operation in the current DB session, to be committed together
+    with the domain change (at the end of the request, in the API), and the Operation is returned. Otherwise the write is
+    submitted right away and None is returned."""
+    if OUTBOX_ON:
+        operation = Operation(kind=kind, params=params, record=record, user_id=user_id)
+        db_session.add(operation)
+        return operation
+
+    submit(kind, params, record, date=datetime.now())
+    save_changes()
+    return None
+
+
+def write_call(kind: str, params: list) -> (str, dict):
+    """Returns the BlockchainManager write method and its arguments (except the caller and its key) that submit
+    writes of 'kind' with 'params' in a single transaction: the method of the kind itself for a single write, or
+    its batch method for several writes of a BATCHABLE kind."""
+    if len(params) == 1:
+        return kind, params[0]
+    if kind == 'mint':
+        return 'batchMint', {'recipients': [p['to'] for p in params], 'values': [p['value'] for p in params]}
+    return 'batchProcessAction', {'actions': params}
+
+
+def add_transactions(records: list, dates: list, tx_hash: str):
+    """Adds the Transaction rows of submitted writes, skipping the writes without one, to the DB session."""
+    for record, date in zip(records, dates):
+        if record is not None:
+            db_session.add(Transaction(date=date, transaction_hash=tx_hash, **record))
+
+
+def submit(kind: str, params: dict, record: dict, date: datetime) -> str:
+    """Submits a blockchain write and adds its Transaction row, if any, to the DB session, returning the transaction hash."""
+    return submit_batch(kind, [params], [record], [date])
+
+
+def submit_batch(kind: str, params: list, records: list, dates: list) -> str:
+    """Submits one or several blockchain writes of a kind (BATCHABLE if several) in a single transaction and adds
+    their Transaction rows, if any, to the DB session, returning the hash of the transaction."""
+    method, args = write_call(kind, params)
+    tx_hash = getattr(blockchain_manager, method)(
+        caller=ADMIN_ADDRESS,
+        caller_key=PRIVATE_KEY,
+        **args
+    )
+
+    if tx_hash is None:
+        tx_hash = ''
+
+    add_transactions(records, dates, tx_hash)
+    return tx_hash
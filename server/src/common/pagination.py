@@ -0,0 +1,83 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from sqlalchemy import DateTime, literal, tuple_
+from sqlalchemy.dialects.postgresql import UUID
+from src import config
+import json
+import uuid
+
+MAX_PAGE_SIZE = getattr(config, 'MAX_PAGE_SIZE', 500)
+
+CURSOR_HEADER = 'X-Next-Cursor'
+
+
+def encode_cursor(values) -> str:
+    """Turns the sort key of the last row of a page into an opaque cursor."""
+    data = json.dumps([value.isoformat() if isinstance(value, datetime) else str(value) for value in values])
+    return urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, columns) -> list:
+    """Turns a cursor back into the values of the sort columns, raising a ValueError if it is not valid."""
+    try:
+        values = json.loads(urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError('invalid cursor')
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise ValueError('invalid cursor')
+
+    parsed = []
+    try:
+        for column, value in zip(columns, values):
+            if isinstance(column.type, DateTime):
+                parsed.append(datetime.fromisoformat(value))
+            elif isinstance(column.type, UUID):
+                parsed.append(uuid.UUID(value))
+            else:
+                parsed.append(value)
+    except (TypeError, ValueError):
+        raise ValueError('invalid cursor')
+    return parsed
+
+
+def page_params(args) -> tuple:
+    """Reads the 'limit' and 'after' query parameters. Without a limit a page holds MAX_PAGE_SIZE rows.\n
+    Raises a ValueError if they are not valid."""
+    limit = args.get('limit')
+    after = args.get('after')
+
+    limit = MAX_PAGE_SIZE if limit is None else int(limit)
+    if limit < 1:
+        raise ValueError('invalid limit')
+    return min(limit, MAX_PAGE_SIZE), after
+
+
+def paginate(query, columns, limit, after, descending=False, key=None) -> tuple:
+    """Keyset pagination: returns the rows of 'query' after the 'after' cursor, sorted by 'columns' (which must
+    identify each row), and the cursor of the next page, or None if this is the last one.\n
+    Without a limit the query is returned as it is, unbounded. 'key' returns the sort key of a row, by default the
+    'columns' attributes of the row."""
+    if limit is None:
+        return query, None
+
+    if after is not None:
+        values = [literal(value, column.type) for column, value in zip(columns, decode_cursor(after, columns))]
+        if descending:
+            query = query.filter(tuple_(*columns) < tuple_(*values))
+        else:
+            query = query.filter(tuple_(*columns) > tuple_(*values))
+
+    query = query.order_by(None).order_by(*[column.desc() if descending else column for column in columns])
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    if key is None:
+        key = lambda row: [getattr(row, column.key) for column in columns]
+    return rows, encode_cursor(key(rows[-1]))
+
+
+def page_headers(next_cursor) -> dict:
+    """Response headers carrying the cursor of the next page, if any."""
+    return {CURSOR_HEADER: next_cursor} if next_cursor else {}
@@ -0,0 +1,133 @@
+from eth_abi import encode_abi
+from eth_account import Account
+from eth_utils import function_signature_to_4byte_selector
+from src import config
+from uuid import UUID
+from web3 import Web3
+import base58
+import rlp
+import threading
+import time
+
+FEE_CACHE_TTL = getattr(config, 'FEE_CACHE_TTL', 30)   # seconds the node gas price is reused for
+GAS_LIMIT = 10000000
+
+
+def to_bytes32(value) -> bytes:
+    """Turns an IPFS hash (base58 multihash or hex string) into the bytes32 value stored in the Smart Contract."""
+    if isinstance(value, bytes):
+        return value.rjust(32, b'\0')
+    if not value:
+        return bytes(32)
+    if value.startswith('0x'):
+        return bytes.fromhex(value[2:]).rjust(32, b'\0')
+    # drop the multihash prefix (hash function and length), as in actions.decode_hash
+    return base58.b58decode(value)[2:]
+
+
+def to_uint256(value) -> int:
+    """Turns a numeric value or an UUID (e.g. an action id) into an unsigned integer."""
+    if isinstance(value, UUID):
+        return value.int
+    if isinstance(value, str) and not value.isdigit():
+        return UUID(value).int
+    return int(value)
+
+
+def nonce_of(signed_transaction) -> int:
+    """Returns the nonce of a signed legacy transaction (see TransactionBuilder.build), given as hex or bytes."""
+    if isinstance(signed_transaction, str):
+        signed_transaction = bytes.fromhex(signed_transaction[2:] if signed_transaction.startswith('0x') else signed_transaction)
+    return int.from_bytes(rlp.decode(signed_transaction)[0], 'big')
+
+
+_normalizers = {
+    'address': Web3.toChecksumAddress,
+    'bytes32': to_bytes32,
+    'uint256': to_uint256,
+}
+
+
+def abi_type(arg) -> str:
+    """Returns the canonical type of an ABI argument, expanding structs into tuples."""
+    if arg['type'].startswith('tuple'):
+        components = ','.join(abi_type(component) for component in arg['components'])
+        return f'({components}){arg["type"][len("tuple"):]}'
+    return arg['type']
+
+
+def normalize(arg, value):
+    """Converts a value into what eth_abi expects for the given ABI argument."""
+    if arg['type'].endswith('[]'):
+        item = dict(arg, type=arg['type'][:-2])
+        return [normalize(item, v) for v in value]
+    if arg['type'] == 'tuple':
+        return tuple(normalize(component, v) for component, v in zip(arg['components'], value))
+    return _normalizers.get(arg['type'], lambda v: v)(value)
+
+
+class TransactionBuilder:
+    """Builds and signs the Smart Contract transactions locally, so that submitting one costs a single RPC.\n
+    Calldata is encoded from function selectors precomputed from the contract ABI, the chain id is cached
+    forever and the gas price is reused for FEE_CACHE_TTL seconds."""
+
+    def __init__(self, w3, contract_address, abi):
+        self.w3 = w3
+        self.contract_address = contract_address
+
+        self.functions = {}
+        for entry in abi:
+            if entry.get('type') == 'function':
+                types = [abi_type(arg) for arg in entry['inputs']]
+                selector = function_signature_to_4byte_selector(f'{entry["name"]}({",".join(types)})')
+                self.functions[entry['name']] = (selector, types, entry['inputs'])
+
+        self._chain_id = None
+        self._gas_price = None
+        self._gas_price_expiry = 0
+        self._lock = threading.Lock()
+
+    @property
+    def chain_id(self) -> int:
+        if self._chain_id is None:
+            self._chain_id = self.w3.eth.chain_id
+        return self._chain_id
+
+    @property
+    def gas_price(self) -> int:
+        with self._lock:
+            if time.monotonic() >= self._gas_price_expiry:
+                self._gas_price = self.w3.toWei(self.w3.eth.gas_price, 'gwei')
+                self._gas_price_expiry = time.monotonic() + FEE_CACHE_TTL
+            return self._gas_price
+
+    def encode(self, function_name, *args) -> bytes:
+        """Returns the calldata of a call to the given contract function."""
+        selector, types, inputs = self.functions[function_name]
+        values = [normalize(arg, value) for arg, value in zip(inputs, args)]
+        return selector + encode_abi(types, values)
+
+    def build(self, function_name, args, nonce) -> dict:
+        return {
+            'to': self.contract_address,
+            'value': 0,
+            'data': self.encode(function_name, *args),
+            'gas': GAS_LIMIT,
+            'gasPrice': self.gas_price,
+            'nonce': nonce,
+            'chainId': self.chain_id,
+        }
+
+    def build_self_transfer(self, address, nonce) -> dict:
+        """Builds a transfer of no ether from an account to itself, which only uses up a nonce."""
+        return {
+            'to': Web3.toChecksumAddress(address),
+            'value': 0,
+            'gas': 21000,
+            'gasPrice': self.gas_price,
+            'nonce': nonce,
+            'chainId': self.chain_id,
+        }
+
+    def sign(self, transaction, private_key):
+        return Account.sign_transaction(transaction, private_key)
@@ -1,8 +1,90 @@
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import make_transient_to_detached, object_session
+from src import config
+from src.common.cache import TTLCache
 from src.config import APP_SECRET
+from src.database.db import RoutingSession, db_session
 from src.database.models import User
 from uuid import UUID
 import jwt
 
+USER_CACHE_TTL = getattr(config, 'USER_CACHE_TTL', 30)          # seconds a user is served from the cache, 0 disables it
+USER_CACHE_SIZE = getattr(config, 'USER_CACHE_SIZE', 10000)
+
+# per-process cache of the authenticated users, by email
+user_cache = TTLCache(USER_CACHE_TTL, USER_CACHE_SIZE)
+_generation = 0     # count of committed user changes, so a user loaded before one of them is not cached after it
+
+
+def get_cached_user(email) -> User or None:
+    """Returns the user with the given email, attached to the current DB session, loading it from the database only
+    when it is not in the per-process cache.\n
+    The cache keeps a snapshot of the user columns, from which the user is rebuilt in the session with
+    merge(load=False), without a query. Users changed through the ORM in this process are removed from the cache
+    when the change is committed (see the user change events below)."""
+    snapshot = user_cache.get(email) if USER_CACHE_TTL > 0 else None
+    if snapshot is None:
+        generation = _generation
+        user = User.get_by_email(email)
+        if user is not None and USER_CACHE_TTL > 0 and generation == _generation:
+            user_cache.set(email, {attr.key: getattr(user, attr.key) for attr in User.__mapper__.column_attrs})
+        return user
+
+    user = User.__mapper__.class_manager.new_instance()
+    for key, value in snapshot.items():
+        setattr(user, key, value)
+    make_transient_to_detached(user)
+    return db_session.merge(user, load=False)
+
+
+def forget_users(emails):
+    """Removes users from the cache of this process (all of them if 'emails' is None), after changing them."""
+    global _generation
+    _generation += 1
+    if emails is None:
+        user_cache.clear()
+    else:
+        for email in emails:
+            user_cache.pop(email)
+
+
+# Users changed in a session are only removed from the cache once the change is committed, as a request reading
+# them before that would cache them again as they were.
+
+def _changed_emails(session) -> set:
+    return session.info.setdefault('changed_user_emails', set())
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, user):
+    emails = _changed_emails(object_session(user))
+    emails.add(user.email)
+    emails.update(inspect(user).attrs.email.history.deleted)    # the old email, if it changed
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _users_changed_in_bulk(state):
+    # bulk updates and deletes (e.g. User.query.delete()) do not tell which users they change
+    if (state.is_update or state.is_delete) and any(mapper.class_ is User for mapper in state.all_mappers):
+        state.session.info['all_users_changed'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _forget_committed_users(session):
+    if session.info.pop('all_users_changed', False):
+        forget_users(None)
+    emails = session.info.pop('changed_user_emails', None)
+    if emails:
+        forget_users(emails)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_user_changes(session):
+    session.info.pop('all_users_changed', None)
+    session.info.pop('changed_user_emails', None)
+
+
 def get_user_from_token(request) -> User or None:
     cookie_token: str = request.cookies.get('jwt_token')
     header_token: str = request.headers.get('Authorization')
@@ -17,7 +99,7 @@ def get_user_from_token(request) -> User or None:
     try:
         decoded_user = jwt.decode(token, APP_SECRET, algorithms=["HS256"]).get('user')
         user_email = decoded_user.get('email')
-        user = User.get_by_email(user_email)
+        user = get_cached_user(user_email)
         return user
     except jwt.InvalidSignatureError as err:
         print(err)
@@ -1,16 +1,106 @@
+from functools import wraps
+from greenlet import getcurrent
 from sqlalchemy import create_engine
-from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.orm import Session, scoped_session, sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from src import config
 from src.config import DATABASE_URL
 
+DATABASE_REPLICA_URL = getattr(config, 'DATABASE_REPLICA_URL', None)    # read replica for the read-only endpoints
+DB_POOL_SIZE = getattr(config, 'DB_POOL_SIZE', 5)                   # connections kept open by each process
+DB_MAX_OVERFLOW = getattr(config, 'DB_MAX_OVERFLOW', 10)            # connections opened above DB_POOL_SIZE under load
+DB_POOL_RECYCLE = getattr(config, 'DB_POOL_RECYCLE', 1800)          # seconds after which a connection is replaced
+DB_POOL_TIMEOUT = getattr(config, 'DB_POOL_TIMEOUT', 30)            # seconds to wait for a free connection
+DB_POOL_PRE_PING = getattr(config, 'DB_POOL_PRE_PING', True)        # check connections before using them
+DB_STATEMENT_TIMEOUT = getattr(config, 'DB_STATEMENT_TIMEOUT', 0)   # milliseconds a statement can run for, 0 for no limit
+
 # https://flask.palletsprojects.com/en/2.0.x/patterns/sqlalchemy/
 
-engine = create_engine(DATABASE_URL)
-db_session = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=engine))
+def make_engine(url):
+    connect_args = {}
+    if DB_STATEMENT_TIMEOUT:
+        connect_args['options'] = f'-c statement_timeout={int(DB_STATEMENT_TIMEOUT)}'
+    return create_engine(
+        url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        connect_args=connect_args
+    )
+
+engine = make_engine(DATABASE_URL)
+replica_engine = make_engine(DATABASE_REPLICA_URL) if DATABASE_REPLICA_URL else None
+
+
+class RoutingSession(Session):
+    """Session that runs its queries on the read replica while it is marked as read only (see read_only),
+    and everything else, including any flush, on the primary database."""
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if replica_engine is not None and self.info.get('read_only') and not self._flushing:
+            return replica_engine
+        return engine
+
+
+# one session per greenlet, so requests served by the same gevent worker do not share it (see gunicorn.conf.py);
+# without gevent each thread runs in its own greenlet, so this is also one session per thread
+db_session = scoped_session(sessionmaker(autocommit=False, autoflush=False, class_=RoutingSession), scopefunc=getcurrent)
 
 Base = declarative_base()
 Base.query = db_session.query_property()
 
+
+def read_only(function):
+    """Marks an endpoint as read only, so its queries go to the read replica when DATABASE_REPLICA_URL is set.\n
+    The replica may lag behind the primary database, so only endpoints that do not need to read their own
+    writes should use it."""
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        db_session.info['read_only'] = True
+        try:
+            return function(*args, **kwargs)
+        finally:
+            db_session.info.pop('read_only', None)
+    return wrapper
+
+
+def release_connection():
+    """Commits the current DB transaction, returning its connection to the pool, before slow external calls
+    (blockchain, IPFS), so waiting requests do not hold idle connections. The next query starts a new, short
+    transaction.\n
+    Reading attributes that are not loaded yet (e.g. lazy relationships) would check a connection out again, so the
+    values needed during the external calls must be copied before calling this."""
+    db_session.commit()
+
+
+def begin_unit_of_work():
+    """Starts the unit of work of a request: until it ends, save() and the other model writes only flush their
+    changes, which end_unit_of_work() commits all at once. Objects are not expired by commits made during the
+    request, so the rows it has just written are serialized without reloading them."""
+    session = db_session()
+    session.info['unit_of_work'] = True
+    session.expire_on_commit = False
+
+
+def end_unit_of_work(success):
+    """Commits the changes of the request if it succeeded, or rolls them back."""
+    if success:
+        db_session.commit()
+    else:
+        db_session.rollback()
+
+
+def save_changes():
+    """Commits the session, or only flushes it during the unit of work of a request (see begin_unit_of_work)."""
+    if db_session.info.get('unit_of_work'):
+        db_session.flush()
+    else:
+        db_session.commit()
+
+
 def init_db():
     # import src.database.models
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    # only creates the missing tables; schema changes to existing ones are applied by src/database/migrations.py
+    Base.metadata.create_all(bind=engine)
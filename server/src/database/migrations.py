@@ -0,0 +1,144 @@
+from sqlalchemy import text
+import re
+
+# create_all() only creates missing tables, so columns and indexes added to existing tables are applied by these
+# migrations, in order, and recorded in the schema_version table. Every statement must be idempotent, as new
+# databases already get the current schema from create_all().
+# Migrations marked as concurrent run outside of a transaction, so their indexes can be built with
+# CREATE INDEX CONCURRENTLY without locking writes to a live table.
+# Migrations are applied as a deploy step, before starting the servers (python -m src.database.migrations), as
+# building an index on a large table can take longer than a worker is given to boot.
+MIGRATIONS = [
+    # (version, description, concurrent, statements)
+    (1, 'transaction confirmation status', False, [
+        'ALTER TABLE "transaction" ADD COLUMN IF NOT EXISTS status VARCHAR(15)',
+        'ALTER TABLE "transaction" ADD COLUMN IF NOT EXISTS block_number BIGINT',
+        'ALTER TABLE "transaction" ADD COLUMN IF NOT EXISTS gas_used BIGINT',
+    ]),
+    (2, 'indexes for the pending transactions, unique user addresses, per-company listings and transaction history', True, [
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_transaction_pending ON "transaction" (date) WHERE status = \'pending\'',
+        'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ix_user_blockchain_public ON "user" (blockchain_public)',
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_transaction_sender_address_date ON "transaction" (sender_address, date)',
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_transaction_receiver_address_date ON "transaction" (receiver_address, date)',
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_action_company_id ON action (company_id)',
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_action_campaign_id ON action (campaign_id)',
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_offer_company_id ON offer (company_id)',
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_campaign_company_id ON campaign (company_id)',
+    ]),
+    (3, 'index for the paginated transaction history', True, [
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_transaction_date_id ON "transaction" (date, id)',
+    ]),
+    (4, 'campaign progress aggregates', False, [
+        'ALTER TABLE campaign ADD COLUMN IF NOT EXISTS total_budget DOUBLE PRECISION NOT NULL DEFAULT 0',
+        'ALTER TABLE campaign ADD COLUMN IF NOT EXISTS rewarded DOUBLE PRECISION NOT NULL DEFAULT 0',
+        'ALTER TABLE campaign ADD COLUMN IF NOT EXISTS registration_count INTEGER NOT NULL DEFAULT 0',
+        # total_budget is what has been minted net of burns: the rewards paid plus the rewards left in the actions
+        'UPDATE campaign SET rewarded = COALESCE(registrations.rewarded, 0), '
+        'registration_count = COALESCE(registrations.count, 0), '
+        'total_budget = COALESCE(registrations.rewarded, 0) + COALESCE(actions.remaining, 0) '
+        'FROM campaign AS c '
+        'LEFT JOIN (SELECT campaign_id, SUM(reward * (COALESCE(kpi_target, 0) - COALESCE(kpi, 0))) AS remaining '
+        'FROM action GROUP BY campaign_id) AS actions ON actions.campaign_id = c.id '
+        'LEFT JOIN (SELECT action.campaign_id, COUNT(*) AS count, SUM("transaction".quantity) AS rewarded '
+        'FROM "transaction" JOIN action ON "transaction".transaction_info = \'Action id-\' || action.id || \' registration\' '
+        'GROUP BY action.campaign_id) AS registrations ON registrations.campaign_id = c.id '
+        'WHERE c.id = campaign.id',
+    ]),
+    (5, 'last receipt check of the pending transactions', False, [
+        'ALTER TABLE "transaction" ADD COLUMN IF NOT EXISTS last_checked_at TIMESTAMP',
+    ]),
+    (6, 'user that queued each operation', False, [
+        'ALTER TABLE operation ADD COLUMN IF NOT EXISTS user_id UUID REFERENCES "user" (id) ON DELETE SET NULL',
+    ]),
+    (7, 'unique ledger entries', False, [
+        'DELETE FROM ledger_entry duplicate USING ledger_entry kept WHERE duplicate.transaction_hash = kept.transaction_hash '
+        'AND duplicate.log_index = kept.log_index AND duplicate.id > kept.id',
+        'CREATE UNIQUE INDEX IF NOT EXISTS ix_ledger_entry_log ON ledger_entry (transaction_hash, log_index)',
+    ]),
+    (8, 'signed transaction of each operation', False, [
+        'ALTER TABLE operation ADD COLUMN IF NOT EXISTS signed_transaction TEXT',
+    ]),
+    (9, 'KPI reserved by each operation', False, [
+        'ALTER TABLE operation ADD COLUMN IF NOT EXISTS reserved_kpi INTEGER',
+    ]),
+    (10, 'index for the operations of a transaction', True, [
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_operation_transaction_hash ON operation (transaction_hash)',
+    ]),
+    (11, 'indexes for the paginated action, offer and campaign lists', True, [
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_action_name_id ON action (name, id)',
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_action_company_id_name_id ON action (company_id, name, id)',
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_offer_name_id ON offer (name, id)',
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_offer_company_id_name_id ON offer (company_id, name, id)',
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_campaign_name_id ON campaign (name, id)',
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_campaign_company_id_name_id ON campaign (company_id, name, id)',
+    ]),
+]
+
+MIGRATION_LOCK = 0x50c1a1c0     # key of the advisory lock held while migrating, so concurrent deploys wait for each other
+
+
+def index_names(statements) -> list:
+    """Returns the names of the indexes created by the statements of a migration."""
+    names = []
+    for statement in statements:
+        match = re.match(r'CREATE (?:UNIQUE )?INDEX (?:CONCURRENTLY )?(?:IF NOT EXISTS )?(\w+)', statement)
+        if match:
+            names.append(match.group(1))
+    return names
+
+
+def drop_invalid_indexes(conn, statements):
+    """Drops the indexes of a migration left invalid by a failed CREATE INDEX CONCURRENTLY, which IF NOT EXISTS
+    would skip. Other invalid indexes are left alone, as they may be being built right now."""
+    names = index_names(statements)
+    if not names:
+        return
+    invalid = conn.execute(text(
+        'SELECT indexrelid::regclass::text FROM pg_index WHERE NOT indisvalid AND indexrelid::regclass::text = ANY(:names)'
+    ), {'names': names}).scalars().all()
+    for index in invalid:
+        conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {index}'))
+
+
+def migrate(engine):
+    """Applies the pending migrations, returning their versions."""
+    applied = []
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+        conn.execute(text('SELECT pg_advisory_lock(:key)'), {'key': MIGRATION_LOCK})
+        try:
+            conn.execute(text(
+                'CREATE TABLE IF NOT EXISTS schema_version ('
+                'version INTEGER PRIMARY KEY, description VARCHAR(255) NOT NULL, applied_at TIMESTAMP NOT NULL DEFAULT now())'
+            ))
+            done = set(conn.execute(text('SELECT version FROM schema_version')).scalars())
+
+            for version, description, concurrent, statements in MIGRATIONS:
+                if version in done:
+                    continue
+
+                if concurrent:
+                    drop_invalid_indexes(conn, statements)
+                    for statement in statements:
+                        conn.execute(text(statement))
+                    conn.execute(text('INSERT INTO schema_version (version, description) VALUES (:v, :d)'),
+                                 {'v': version, 'd': description})
+                else:
+                    with engine.begin() as transaction:
+                        for statement in statements:
+                            transaction.execute(text(statement))
+                        transaction.execute(text('INSERT INTO schema_version (version, description) VALUES (:v, :d)'),
+                                            {'v': version, 'd': description})
+
+                print(f'# Applied migration {version}: {description}')
+                applied.append(version)
+        finally:
+            conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': MIGRATION_LOCK})
+    return applied
+
+
+if __name__ == '__main__':
+    from src.database.db import engine, init_db
+    import src.database.models
+    init_db()   # the tables of a new database
+    migrate(engine)
@@ -1,10 +1,31 @@
 from __future__ import annotations
-from sqlalchemy import Column, DateTime, Float, ForeignKey, Integer, String, or_
-from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.orm import relationship, backref
-from .db import Base, db_session
+from sqlalchemy import BigInteger, Column, DateTime, Float, ForeignKey, Index, Integer, Numeric, String, Text, func, or_, select, update
+from sqlalchemy.dialects.postgresql import JSONB, UUID
+from sqlalchemy.orm import aliased, backref, joinedload, relationship
+from .db import Base, db_session, save_changes
+from datetime import datetime, timedelta
 import uuid
 
+
+def row_serializer(model, *extra_names, **converters):
+    """Precompiles the conversion of plain rows, selected as the model table columns followed by the 'extra_names'
+    columns, into the dicts returned by as_dict(): UUID values are turned into strings. 'converters' maps column
+    names to other conversion functions.\n
+    Used by the list endpoints, which skip building ORM objects and reflecting their columns for each row."""
+    names = tuple(c.name for c in model.__table__.columns) + extra_names
+    for column in model.__table__.columns:
+        if isinstance(column.type, UUID):
+            converters.setdefault(column.name, str)
+    conversions = tuple((names.index(name), function) for name, function in converters.items())
+
+    def serialize(row) -> dict:
+        values = list(row)
+        for index, function in conversions:
+            values[index] = function(values[index])
+        return dict(zip(names, values))
+    return serialize
+
+
 class User(Base):
     __tablename__ = 'user'
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
@@ -16,7 +37,7 @@ class User(Base):
     # AD = administrator
     role = Column(String(15), nullable=False, default='CB')
 
-    blockchain_public = Column(String(127))
+    blockchain_public = Column(String(127), index=True, unique=True)
     blockchain_private = Column(String(127))    
     picture_url = Column(String(255))
 
@@ -42,7 +63,7 @@ class User(Base):
     def save(self):
         if not self.id:
             db_session.add(self)
-        db_session.commit()
+        save_changes()
         # db_session.expunge() # REVIEW necessary when using a single session?
     
     def as_dict(self):
@@ -82,13 +103,29 @@ class Campaign(Base):
     name = Column(String(80), nullable=False)
     description = Column(String, nullable=False)
 
-    company_id = Column(UUID(as_uuid=True), ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    company_id = Column(UUID(as_uuid=True), ForeignKey('user.id', ondelete='CASCADE'), nullable=False, index=True)
     actions = relationship('Action', backref=backref('campaign'))
 
+    # Aggregates of the campaign actions, kept up to date by add_totals() so progress never needs to scan them.
+    # total_budget is what has been minted for the actions, net of burns: the rewards already paid (which stay when
+    # an action is deleted) plus what the current actions can still reward, (KPI target - KPI) * reward.
+    total_budget = Column(Float, nullable=False, default=0, server_default='0')
+    rewarded = Column(Float, nullable=False, default=0, server_default='0')                 # sum of the rewards paid to registrations
+    registration_count = Column(Integer, nullable=False, default=0, server_default='0')
+
+    __table_args__ = (
+        # the sort keys of the paginated lists, of every company and of one
+        Index('ix_campaign_name_id', 'name', 'id'),
+        Index('ix_campaign_company_id_name_id', 'company_id', 'name', 'id'),
+    )
+
     def __init__(self, name, description, company_id):
         self.name = name
         self.description = description
         self.company_id = company_id    # TODO revise, check role, etc
+        self.total_budget = 0
+        self.rewarded = 0
+        self.registration_count = 0
 
     def __repr__(self):
         return f'<Campaign {self.name!r}>'
@@ -96,32 +133,78 @@ class Campaign(Base):
     def save(self):
         if not self.id:
             db_session.add(self)
-        db_session.commit()
+        save_changes()
         # db_session.expunge() # REVIEW necessary when using a single session?
         
     def as_dict(self):
         campaign = {c.name: getattr(self, c.name) for c in self.__table__.columns}
         campaign['id'] = str(campaign.get('id'))
         campaign['company_id'] = str(campaign.get('company_id'))
+        campaign['percent_complete'] = Campaign.percent_complete(self.total_budget, self.rewarded)
         return campaign
 
+    @staticmethod
+    def percent_complete(total_budget, rewarded) -> float:
+        if not total_budget:
+            return 0
+        return round(100 * rewarded / total_budget, 2)
+
+    @staticmethod
+    def add_totals(campaign_id, budget=0, rewarded=0, registrations=0):
+        """Adds to the campaign aggregates in a single atomic UPDATE, within the current DB transaction.\n
+        Callers update the action row first, so concurrent writers always lock the action before the campaign."""
+        db_session.execute(
+            update(Campaign)
+            .where(Campaign.id == campaign_id)
+            .values(
+                total_budget=Campaign.total_budget + budget,
+                rewarded=Campaign.rewarded + rewarded,
+                registration_count=Campaign.registration_count + registrations
+            )
+            .execution_options(synchronize_session=False)
+        )
+
     @staticmethod
     def all():
-        return Campaign.query.all()
+        return Campaign.query.options(joinedload(Campaign.user))
 
     @staticmethod
     def get(campaign_id) -> Campaign:
-        return Campaign.query.get(campaign_id)
+        return Campaign.query.options(joinedload(Campaign.user)).get(campaign_id)
 
     @staticmethod
     def get_by_company(company_id) -> Campaign:
-        return Campaign.query.filter_by(company_id=company_id)
+        return Campaign.query.options(joinedload(Campaign.user)).filter_by(company_id=company_id)
+
+    @staticmethod
+    def list_rows(company_id=None):
+        """Returns the columns of the campaigns (of a company, if given) followed by their company name, as plain rows."""
+        query = db_session.query(*Campaign.__table__.columns, User.name.label('company_name')).join(User, User.id == Campaign.company_id)
+        if company_id is not None:
+            query = query.filter(Campaign.company_id == company_id)
+        return query
+
+    @staticmethod
+    def by_company_rows():
+        """Returns the columns of the campaigns of promoters and administrators followed by the name, email, role and
+        blockchain_public of their company, as plain rows sorted by company, in a single query."""
+        return db_session.query(
+            *Campaign.__table__.columns,
+            User.name.label('company_name'),
+            User.email.label('company_email'),
+            User.role.label('company_role'),
+            User.blockchain_public.label('company_blockchain_public')
+        ).join(
+            User, User.id == Campaign.company_id
+        ).filter(
+            User.role != 'CB'
+        ).order_by(User.name, User.id, Campaign.id)
 
     @staticmethod
     def delete_one(campaign_id):
         campaign = Campaign.query.get(campaign_id)
         db_session.delete(campaign)
-        db_session.commit()
+        save_changes()
         
     @staticmethod
     def exists(campaign_id) -> bool:
@@ -138,8 +221,14 @@ class Action(Base):
     kpi_target = Column(Integer, default=0)
     kpi_indicator = Column(String(127), nullable=False)
 
-    company_id = Column(UUID(as_uuid=True), ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
-    campaign_id = Column(UUID(as_uuid=True), ForeignKey('campaign.id', ondelete='CASCADE'), nullable=False)
+    company_id = Column(UUID(as_uuid=True), ForeignKey('user.id', ondelete='CASCADE'), nullable=False, index=True)
+    campaign_id = Column(UUID(as_uuid=True), ForeignKey('campaign.id', ondelete='CASCADE'), nullable=False, index=True)
+
+    __table_args__ = (
+        # the sort keys of the paginated lists, of every company and of one
+        Index('ix_action_name_id', 'name', 'id'),
+        Index('ix_action_company_id_name_id', 'company_id', 'name', 'id'),
+    )
 
     def __init__(self, name, description, reward, kpi_target, kpi_indicator, company_id, campaign_id):
         self.name = name
@@ -158,7 +247,7 @@ class Action(Base):
     def save(self):
         if not self.id:
             db_session.add(self)
-        db_session.commit()
+        save_changes()
         # db_session.expunge() # REVIEW necessary when using a single session?
         
     def as_dict(self):
@@ -170,15 +259,23 @@ class Action(Base):
     
     @staticmethod
     def all():
-        return Action.query.all()
+        return Action.query.options(joinedload(Action.user))
 
     @staticmethod
     def get(action_id) -> Action:
-        return Action.query.get(action_id)
+        return Action.query.options(joinedload(Action.user)).get(action_id)
 
     @staticmethod
     def get_by_company(company_id) -> Action:
-        return Action.query.filter_by(company_id=company_id)
+        return Action.query.options(joinedload(Action.user)).filter_by(company_id=company_id)
+
+    @staticmethod
+    def list_rows(company_id=None):
+        """Returns the columns of the actions (of a company, if given) followed by their company name, as plain rows."""
+        query = db_session.query(*Action.__table__.columns, User.name.label('company_name')).join(User, User.id == Action.company_id)
+        if company_id is not None:
+            query = query.filter(Action.company_id == company_id)
+        return query
     
     @staticmethod
     def get_by_campaign(campaign_id) -> Action:
@@ -188,6 +285,44 @@ class Action(Base):
     def delete_one(action_id):
         action = Action.query.get(action_id)
         db_session.delete(action)
+        save_changes()
+
+    @staticmethod
+    def reserve_kpi(action_id, kpi) -> int or None:
+        """Adds 'kpi' to the action KPI in a single atomic UPDATE, only if the result does not exceed the KPI target,
+        counts the registration in the campaign aggregates and commits. Returns the new KPI, or None if the target
+        would be exceeded.\n
+        The rows are only locked for the duration of the transaction, so concurrent registrations of the same action
+        do not wait for each other's blockchain calls."""
+        result = db_session.execute(
+            update(Action)
+            .where(Action.id == action_id, Action.kpi + kpi <= Action.kpi_target)
+            .values(kpi=Action.kpi + kpi)
+            .returning(Action.kpi, Action.campaign_id, Action.reward)
+            .execution_options(synchronize_session=False)
+        ).first()
+        if result is None:
+            db_session.rollback()
+            return None
+
+        new_kpi, campaign_id, reward = result
+        Campaign.add_totals(campaign_id, rewarded=reward * kpi, registrations=1)
+        db_session.commit()
+        return new_kpi
+
+    @staticmethod
+    def release_kpi(action_id, kpi):
+        """Gives back the KPI taken by reserve_kpi() for a registration that failed."""
+        result = db_session.execute(
+            update(Action)
+            .where(Action.id == action_id)
+            .values(kpi=Action.kpi - kpi)
+            .returning(Action.campaign_id, Action.reward)
+            .execution_options(synchronize_session=False)
+        ).first()
+        if result is not None:
+            campaign_id, reward = result
+            Campaign.add_totals(campaign_id, rewarded=-reward * kpi, registrations=-1)
         db_session.commit()
 
 
@@ -199,7 +334,13 @@ class Offer(Base):
     description = Column(String(511))
     price = Column(Float, nullable=False)
 
-    company_id = Column(UUID(as_uuid=True), ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    company_id = Column(UUID(as_uuid=True), ForeignKey('user.id', ondelete='CASCADE'), nullable=False, index=True)
+
+    __table_args__ = (
+        # the sort keys of the paginated lists, of every company and of one
+        Index('ix_offer_name_id', 'name', 'id'),
+        Index('ix_offer_company_id_name_id', 'company_id', 'name', 'id'),
+    )
 
     def __init__(self, name, description, price, company_id):
         self.name = name
@@ -213,7 +354,7 @@ class Offer(Base):
     def save(self):
         if not self.id:
             db_session.add(self)
-        db_session.commit()
+        save_changes()
         # db_session.expunge() # REVIEW necessary when using a single session?
         
     def as_dict(self):
@@ -224,21 +365,29 @@ class Offer(Base):
     
     @staticmethod
     def all():
-        return Offer.query.all()
+        return Offer.query.options(joinedload(Offer.user))
 
     @staticmethod
     def get(offer_id) -> Offer:
-        return Offer.query.get(offer_id)
+        return Offer.query.options(joinedload(Offer.user)).get(offer_id)
 
     @staticmethod
     def get_by_company(company_id) -> Offer:
-        return Offer.query.filter_by(company_id=company_id)
+        return Offer.query.options(joinedload(Offer.user)).filter_by(company_id=company_id)
+
+    @staticmethod
+    def list_rows(company_id=None):
+        """Returns the columns of the offers (of a company, if given) followed by their company name, as plain rows."""
+        query = db_session.query(*Offer.__table__.columns, User.name.label('company_name')).join(User, User.id == Offer.company_id)
+        if company_id is not None:
+            query = query.filter(Offer.company_id == company_id)
+        return query
     
     @staticmethod
     def delete_one(offer_id):
         offer = Offer.query.get(offer_id)
         db_session.delete(offer)
-        db_session.commit()
+        save_changes()
         
     @staticmethod
     def exists(offer_id) -> bool:
@@ -258,6 +407,20 @@ class Transaction(Base):
     img_ipfs_hash = Column(String(255))                     # image or screenshot of the action proof
     external_proof_url = Column(String(255))                # external optional proof url (e.g. Strava)
 
+    # Confirmation data, filled by the receipt tracker (src/workers/receipts.py)
+    # pending = submitted, mined = included and succeeded, reverted = included but failed, dropped = lost by the node
+    status = Column(String(15))
+    block_number = Column(BigInteger)
+    gas_used = Column(BigInteger)
+    last_checked_at = Column(DateTime)  # last time the receipt tracker asked the node about a pending transaction
+
+    __table_args__ = (
+        Index('ix_transaction_pending', 'date', postgresql_where=(status == 'pending')),
+        Index('ix_transaction_sender_address_date', 'sender_address', 'date'),
+        Index('ix_transaction_receiver_address_date', 'receiver_address', 'date'),
+        Index('ix_transaction_date_id', 'date', 'id'),
+    )
+
     def __init__(self, date, transaction_hash, sender_address, receiver_address, quantity, transaction_info, img_ipfs_hash, external_proof_url):
         self.date = date    # REVIEW if this works
         self.transaction_hash = transaction_hash
@@ -267,6 +430,7 @@ class Transaction(Base):
         self.transaction_info = transaction_info
         self.img_ipfs_hash = img_ipfs_hash
         self.external_proof_url = external_proof_url
+        self.status = 'pending' if transaction_hash else None
 
     def __repr__(self):
         return f'<Transaction {self.transaction_hash!r} ({self.date!r}) >'
@@ -274,7 +438,7 @@ class Transaction(Base):
     def save(self):
         if not self.id:
             db_session.add(self)
-        db_session.commit()
+        save_changes()
         # db_session.expunge() # REVIEW necessary when using a single session?
         
     def as_dict(self):
@@ -295,4 +459,203 @@ class Transaction(Base):
         return Transaction.query.filter(or_(
             Transaction.sender_address == address,
             Transaction.receiver_address == address
-        )).order_by(Transaction.date.desc())
\ No newline at end of file
+        )).order_by(Transaction.date.desc())
+
+    @staticmethod
+    def get_pending(limit):
+        """Returns the pending transactions checked least recently (never checked first, then oldest), so
+        transactions stuck in the node do not keep newer ones from being checked."""
+        return Transaction.query.filter_by(status='pending').order_by(
+            Transaction.last_checked_at.asc().nullsfirst(), Transaction.date
+        ).limit(limit)
+
+    @staticmethod
+    def history(address=None):
+        """Returns the transactions of an address (or all of them), newest first, in a single query as plain rows of
+        the transaction columns followed by the sender_email, receiver_email, sender_name and receiver_name of their
+        users, which are None for addresses without a user."""
+        sender = aliased(User)
+        receiver = aliased(User)
+        query = db_session.query(
+            *Transaction.__table__.columns,
+            sender.email.label('sender_email'), receiver.email.label('receiver_email'),
+            sender.name.label('sender_name'), receiver.name.label('receiver_name')
+        ).outerjoin(
+            sender, sender.blockchain_public == Transaction.sender_address
+        ).outerjoin(
+            receiver, receiver.blockchain_public == Transaction.receiver_address
+        )
+        if address is not None:
+            query = query.filter(or_(
+                Transaction.sender_address == address,
+                Transaction.receiver_address == address
+            ))
+        return query.order_by(Transaction.date.desc())
+
+
+class Operation(Base):
+    __tablename__ = 'operation'
+    # Blockchain write queued in the outbox, submitted by the outbox worker (src/workers/outbox.py)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    kind = Column(String(31), nullable=False)       # BlockchainManager method: mint, burn, processAction
+    params = Column(JSONB, nullable=False)          # method arguments, except the caller and its key
+    record = Column(JSONB)                          # Transaction row to save once submitted, if any
+
+    # queued = waiting, running = claimed by a worker, done = submitted, failed = out of attempts
+    status = Column(String(15), nullable=False, default='queued')
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False)
+    last_error = Column(String(511))
+    transaction_hash = Column(String(255))
+    signed_transaction = Column(Text)               # signed before sending it, so a retry sends the same transaction
+    reserved_kpi = Column(Integer)                  # KPI reserved by the action registration, given back if it fails
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+    user_id = Column(UUID(as_uuid=True), ForeignKey('user.id', ondelete='SET NULL'))   # user whose request queued it
+
+    __table_args__ = (
+        Index('ix_operation_due', 'next_attempt_at', postgresql_where=status.in_(['queued', 'running'])),
+        Index('ix_operation_transaction_hash', 'transaction_hash'),
+    )
+
+    def __init__(self, kind, params, record, user_id=None):
+        now = datetime.now()
+        self.kind = kind
+        self.params = params
+        self.record = record
+        self.user_id = user_id
+        self.status = 'queued'
+        self.attempts = 0
+        self.next_attempt_at = now
+        self.created_at = now
+        self.updated_at = now
+
+    def __repr__(self):
+        return f'<Operation {self.kind!r} ({self.status!r})>'
+
+    def save(self):
+        if not self.id:
+            db_session.add(self)
+        save_changes()
+
+    def as_dict(self):
+        return {
+            'id': str(self.id),
+            'kind': self.kind,
+            'status': self.status,
+            'attempts': self.attempts,
+            'last_error': self.last_error,
+            'transaction_hash': self.transaction_hash,
+            'created_at': str(self.created_at),
+            'updated_at': str(self.updated_at),
+        }
+
+    @staticmethod
+    def get(operation_id) -> Operation:
+        return Operation.query.get(operation_id)
+
+    @staticmethod
+    def unconfirmed_rewards(promoter) -> int:
+        """Returns the rewards of the submitted processAction operations of a promoter whose transaction is not
+        mined yet, which its balance does not reflect."""
+        pending = select(Transaction.transaction_hash).where(Transaction.status == 'pending')
+        total = db_session.query(func.coalesce(func.sum(Operation.params['reward'].astext.cast(Numeric)), 0)).filter(
+            Operation.kind == 'processAction',
+            Operation.status == 'done',
+            func.lower(Operation.params['promoter'].astext) == promoter.lower(),
+            Operation.transaction_hash.in_(pending)
+        ).scalar()
+        return int(total)
+
+    @staticmethod
+    def claim_due(limit, lease):
+        """Claims up to 'limit' due operations for 'lease' seconds; operations of a worker that dies get claimed again once the lease ends."""
+        now = datetime.now()
+        due = select(Operation.id).where(
+            Operation.status.in_(['queued', 'running']),
+            Operation.next_attempt_at <= now
+        ).order_by(Operation.next_attempt_at).limit(limit).with_for_update(skip_locked=True)
+
+        operations = Operation.query.filter(Operation.id.in_(due.scalar_subquery())).order_by(Operation.created_at).all()
+        for operation in operations:
+            operation.status = 'running'
+            operation.next_attempt_at = now + timedelta(seconds=lease)
+            operation.updated_at = now
+        db_session.commit()
+        return operations
+
+
+class LedgerEntry(Base):
+    __tablename__ = 'ledger_entry'
+    # Transfer and Action events of the Smart Contract, materialized by the indexer (src/workers/indexer.py)
+    # mints come from, and burns go to, the 0x00...0 address; addresses are saved in lowercase
+    id = Column(BigInteger, primary_key=True)
+    block_number = Column(BigInteger, nullable=False)
+    block_hash = Column(String(66), nullable=False)
+    transaction_hash = Column(String(66), nullable=False)
+    log_index = Column(Integer, nullable=False)
+    event = Column(String(15), nullable=False)      # Transfer, Action
+    from_address = Column(String(127), nullable=False)
+    to_address = Column(String(127), nullable=False)
+    value = Column(Numeric(78, 0), nullable=False)   # uint256
+
+    # Only for Action events
+    action_id = Column(UUID(as_uuid=True))
+    time = Column(BigInteger)
+    ipfs_hash = Column(String(66))
+
+    __table_args__ = (
+        Index('ix_ledger_entry_from_address', 'from_address', 'block_number'),
+        Index('ix_ledger_entry_to_address', 'to_address', 'block_number'),
+        Index('ix_ledger_entry_block_number', 'block_number'),
+        Index('ix_ledger_entry_log', 'transaction_hash', 'log_index', unique=True),   # an event is indexed once
+    )
+
+    def __repr__(self):
+        return f'<LedgerEntry {self.event!r} ({self.block_number!r}, {self.log_index!r})>'
+
+    def as_dict(self):
+        entry = {c.name: getattr(self, c.name) for c in self.__table__.columns}
+        entry['value'] = int(entry.get('value'))
+        entry['action_id'] = str(entry.get('action_id')) if entry.get('action_id') else None
+        return entry
+
+    @staticmethod
+    def balance_of(address) -> int:
+        address = address.lower()
+        received = select(func.coalesce(func.sum(LedgerEntry.value), 0)).where(LedgerEntry.to_address == address)
+        sent = select(func.coalesce(func.sum(LedgerEntry.value), 0)).where(LedgerEntry.from_address == address)
+        return int(db_session.execute(select(received.scalar_subquery() - sent.scalar_subquery())).scalar())
+
+    @staticmethod
+    def get_by_address(address):
+        address = address.lower()
+        return LedgerEntry.query.filter(or_(
+            LedgerEntry.from_address == address,
+            LedgerEntry.to_address == address
+        )).order_by(LedgerEntry.block_number.desc(), LedgerEntry.log_index.desc())
+
+
+class IndexedBlock(Base):
+    __tablename__ = 'indexed_block'
+    # Hashes of the last blocks indexed into the ledger, used as checkpoint and to detect reorganizations
+    number = Column(BigInteger, primary_key=True)
+    hash = Column(String(66), nullable=False)
+
+    def __repr__(self):
+        return f'<IndexedBlock {self.number!r}>'
+
+    @staticmethod
+    def latest() -> IndexedBlock:
+        return IndexedBlock.query.order_by(IndexedBlock.number.desc()).first()
+
+
+class Signer(Base):
+    __tablename__ = 'signer'
+    # Next nonce to hand out for a blockchain account that signs server-side transactions,
+    # shared by every worker process (see src/common/nonce.py)
+    address = Column(String(127), primary_key=True)
+    next_nonce = Column(BigInteger, nullable=False)
+
+    def __repr__(self):
+        return f'<Signer {self.address!r} ({self.next_nonce!r})>'
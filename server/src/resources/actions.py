@@ -1,71 +1,52 @@
 from flask import request
 from flask_restful import Resource
-from datetime import datetime
 from marshmallow import fields, Schema, ValidationError
+from src.common import http
 from src.common.blockchain import blockchain_manager
+from src.common.executor import io_executor
 from src.common.ipfs import upload_file
+from src.common.outbox import chain_write
+from src.common.pagination import page_headers, page_params, paginate
 from src.common.utils import get_user_from_token, is_valid_uuid, not_none
-from src.config import ADMIN_ADDRESS, ADMIN_EMAIL, IPFS_ON, IPFS_URL, PRIVATE_KEY
-from src.database.models import Action, Campaign, User, Transaction
+from src.config import ADMIN_ADDRESS, ADMIN_EMAIL, IPFS_ON, IPFS_URL
+from src.database.db import db_session, read_only, release_connection, save_changes
+from src.database.models import Action, Campaign, row_serializer
 import base58
-import requests
 import time
 
 
-def action_creation(*, to_address: str, action_id: int, investment: int):
-    tx_hash = blockchain_manager.mint(
-        caller=ADMIN_ADDRESS,
-        caller_key=PRIVATE_KEY,
-        to=to_address,
-        value=investment
-    )
-    
-    if tx_hash is None:
-        tx_hash = ''
-    
-    transaction = Transaction(
-        date=datetime.now(),
-        transaction_hash=tx_hash,
-        sender_address=ADMIN_ADDRESS,   # TODO test if this breaks anything
-        receiver_address=to_address,
-        quantity=investment,
-        transaction_info=f'Action id-{action_id} creation',
-        img_ipfs_hash='',
-        external_proof_url=''
-    )
-    transaction.save()
+def action_creation(*, to_address: str, action_id: int, investment: int, user_id=None):
+    return chain_write('mint', {
+        'to': to_address,
+        'value': investment
+    }, {
+        'sender_address': ADMIN_ADDRESS,   # TODO test if this breaks anything
+        'receiver_address': to_address,
+        'quantity': investment,
+        'transaction_info': f'Action id-{action_id} creation',
+        'img_ipfs_hash': '',
+        'external_proof_url': ''
+    }, user_id=user_id)
 
 
-def action_reward(*, from_address: str, to_address: str, from_balance: int, action_id: int, reward: int, img_hash: str, url_proof: str):
-    admin_address = ADMIN_ADDRESS
-    admin_key = PRIVATE_KEY
+def action_reward(*, from_address: str, to_address: str, from_balance: int, action_id: int, reward: int, img_hash: str, url_proof: str, user_id=None):
     reward = reward if from_balance > reward else from_balance
 
-    tx_hash = blockchain_manager.processAction(
-        caller=admin_address,
-        caller_key=admin_key,
-        promoter=from_address,
-        to=to_address,
-        action_id=str(action_id),
-        reward=reward,
-        time=int(time.time()),
-        ipfs_hash=img_hash
-    )
-    
-    if tx_hash is None:
-        tx_hash = ''
-    
-    transaction = Transaction(
-        date=datetime.now(),
-        transaction_hash=tx_hash,
-        sender_address=from_address,
-        receiver_address=to_address,
-        quantity=reward,
-        transaction_info=f'Action id-{action_id} registration',
-        img_ipfs_hash=img_hash,
-        external_proof_url=url_proof
-    )
-    transaction.save()
+    return chain_write('processAction', {
+        'promoter': from_address,
+        'to': to_address,
+        'action_id': str(action_id),
+        'reward': reward,
+        'time': int(time.time()),
+        'ipfs_hash': img_hash
+    }, {
+        'sender_address': from_address,
+        'receiver_address': to_address,
+        'quantity': reward,
+        'transaction_info': f'Action id-{action_id} registration',
+        'img_ipfs_hash': img_hash,
+        'external_proof_url': url_proof
+    }, user_id=user_id)
 
 
 def ipfs_add_file(file):
@@ -76,7 +57,7 @@ def ipfs_add_file(file):
     params = (
         ('hash', 'sha2-256'),
     )
-    response = requests.post(IPFS_URL, files=files, params=params)
+    response = http.post(IPFS_URL, files=files, params=params, retry=True)
     return response
 
 
@@ -114,24 +95,33 @@ class ActionRegisterSchema(Schema):
 action_schema = ActionSchema()
 optional_action_schema = OptionalActionSchema()
 action_register_schema = ActionRegisterSchema()
+action_row = row_serializer(Action, 'company_name')
 
 
 class ActionsAll(Resource):
+    @read_only
     def get(self):
         user = get_user_from_token(request)
         
         if not user:
             return {'error': 'not logged in'}, 401
         
+        try:
+            limit, after = page_params(request.args)
+        except ValueError as err:
+            return {'error': str(err)}, 400
+        
         if user.role == 'PM':
-            actions = Action.get_by_company(user.id)
+            actions = Action.list_rows(user.id)
         else:
-            actions = Action.all()
+            actions = Action.list_rows()
+
+        try:
+            actions, next_cursor = paginate(actions, [Action.name, Action.id], limit, after)
+        except ValueError as err:
+            return {'error': str(err)}, 400
         
-        action_dicts = [action.as_dict() for action in actions]
-        for action in action_dicts:
-            action['company_name'] = User.get(action['company_id']).name
-        return action_dicts
+        return [action_row(action) for action in actions], 200, page_headers(next_cursor)
 
     def post(self):
         user = get_user_from_token(request)
@@ -169,22 +159,30 @@ class ActionsAll(Resource):
             company_id=user.id,
             campaign_id=data.get('campaign_id')
         )
-        new_action.save()
-        
-        action = new_action.as_dict()
-        action['company_name'] = User.get(action['company_id']).name
+        db_session.add(new_action)
+        db_session.flush()  # assigns the action id, the action is committed with its blockchain write at the end of the request
         
         total_investment = int(data.get('reward')) * int(data.get('kpi_target'))
-        action_creation(
+        Campaign.add_totals(campaign_id, budget=total_investment)
+        operation = action_creation(
             to_address=user.blockchain_public,
             action_id=new_action.id,
-            investment=total_investment
+            investment=total_investment,
+            user_id=user.id
         )
+        new_action.save()
         
+        action = new_action.as_dict()
+        action['company_name'] = user.name
+        
+        if operation:
+            action['operation_id'] = str(operation.id)
+            return action, 202
         return action, 201
 
 
 class ActionsDetail(Resource):
+    @read_only
     def get(self, action_id):
         if not is_valid_uuid(action_id):
             return {'message': f'no action with id {action_id} found'}, 404
@@ -194,8 +192,9 @@ class ActionsDetail(Resource):
         if not action:
             return {'message': f'no action with id {action_id} found'}, 404
         
+        company_name = action.user.name
         action = action.as_dict()
-        action['company_name'] = User.get(action['company_id']).name
+        action['company_name'] = company_name
 
         return action
 
@@ -243,29 +242,32 @@ class ActionsDetail(Resource):
         
         balance_change = new_remaining_action_reward - old_remaining_action_reward
         
+        operation = None
         if balance_change > 0:
-            blockchain_manager.mint(
-                caller=ADMIN_ADDRESS,
-                caller_key=PRIVATE_KEY,
-                to=user.blockchain_public,
-                value=balance_change
-            )
+            operation = chain_write('mint', {
+                'to': user.blockchain_public,
+                'value': balance_change
+            }, user_id=user.id)
         elif balance_change < 0:
-            blockchain_manager.burn(
-                caller=ADMIN_ADDRESS,
-                caller_key=PRIVATE_KEY,
-                from_acc=user.blockchain_public,
-                value=abs(balance_change)
-            )
+            operation = chain_write('burn', {
+                'from_acc': user.blockchain_public,
+                'value': abs(balance_change)
+            }, user_id=user.id)
         
         action.reward = new_reward
         action.kpi_target = new_target
         
+        db_session.flush()  # the action row is locked before the campaign row, as in the registrations
+        Campaign.add_totals(action.campaign_id, budget=balance_change)
         action.save()
         
+        company_name = action.user.name
         action = action.as_dict()
-        action['company_name'] = User.get(action['company_id']).name
+        action['company_name'] = company_name
         
+        if operation:
+            action['operation_id'] = str(operation.id)
+            return action, 202
         return action, 200
 
     def delete(self, action_id):
@@ -291,14 +293,18 @@ class ActionsDetail(Resource):
         # remaining KPI to reward must get deleted
         balance_to_burn = (action.kpi_target - action.kpi) * action.reward
         
-        Action.delete_one(action.id)
-        blockchain_manager.burn(
-            caller=ADMIN_ADDRESS,
-            caller_key=PRIVATE_KEY,
-            from_acc=User.get(action.company_id).blockchain_public, # remove balance from action owner, not request user
-            value=balance_to_burn
-        )
-
+        operation = chain_write('burn', {
+            'from_acc': action.user.blockchain_public, # remove balance from action owner, not request user
+            'value': balance_to_burn
+        }, user_id=user.id)
+        campaign_id = action.campaign_id
+        db_session.delete(action)
+        db_session.flush()  # the action row is locked before the campaign row, as in the registrations
+        Campaign.add_totals(campaign_id, budget=-balance_to_burn)
+        save_changes()
+
+        if operation:
+            return {'result': 'accepted', 'operation_id': str(operation.id)}, 202
         return {'result': 'success'}, 204
 
 
@@ -312,8 +318,6 @@ class ActionRegister(Resource):
         if user.role == 'PM':
             return {'error': 'promoters cannot register actions'}, 403
         
-        old_balance = blockchain_manager.balance_of(user.blockchain_public)
-        
         if not is_valid_uuid(action_id):
             return {'message': f'no action with id {action_id} found'}, 404
         
@@ -322,8 +326,14 @@ class ActionRegister(Resource):
         if not action:
             return {'message': f'no action with id {action_id} found'}, 404
         
-        company = User.get(action.company_id)
-        company_balance = blockchain_manager.balance_of(company.blockchain_public)
+        # plain values, as the DB connection is released during the blockchain and IPFS calls
+        user_pk = user.id
+        user_address = user.blockchain_public
+        company_address = action.user.blockchain_public
+        action_pk = action.id
+        action_reward_value = action.reward
+        campaign_pk = action.campaign_id
+        release_connection()
         
         # TODO check company balance on API instead of on the blockchain
         # TODO test if the validation works properly
@@ -337,36 +347,67 @@ class ActionRegister(Resource):
         kpi = data.get('kpi')   # 'multiplier' of the action
         url_proof = data.get('verification_url')        # external proof URL (e.g. Strava)
         image_proof = request.files.get('image_proof')  # mandatory photo proof (e.g. Strava)
-        reward = action.reward * float(kpi)    # adjust to the contrat decimals
         
         if not kpi and not url_proof:
             return {'error': 'required at least one of the fields verification_url or image_proof' }, 400
         
-        if IPFS_ON:
-            # ipfs_response = ipfs_add_file(image_proof)
-            # decoded_hash = '0x' + decode_hash(ipfs_response.json()['Hash'])
-            ipfs_response = upload_file(image_proof.read())
-            if ipfs_response.status_code == 200:
-                decoded_hash = ipfs_response.json().get('IpfsHash')
+        # the KPI is taken before the slow calls, so concurrent registrations cannot exceed the target,
+        # and given back if the registration fails (each in its own short transaction)
+        kpi = int(kpi)
+        reward = action_reward_value * kpi    # the reward of the KPI counted against the target
+        if Action.reserve_kpi(action_pk, kpi) is None:
+            return {'error': 'the registered KPI would exceed the action KPI target'}, 400
+        
+        try:
+            # the IPFS upload runs on the shared executor while the balances are read from this thread, as
+            # balance_of_many() may itself use the executor and must not wait on it from one of its workers
+            if IPFS_ON:
+                # ipfs_response = ipfs_add_file(image_proof)
+                # decoded_hash = '0x' + decode_hash(ipfs_response.json()['Hash'])
+                ipfs_upload = io_executor.submit(upload_file, image_proof.read())
+            
+            old_balance, company_balance = blockchain_manager.balance_of_many([
+                user_address,
+                company_address
+            ])
+            
+            if IPFS_ON:
+                ipfs_response = ipfs_upload.result()
+                if ipfs_response.status_code == 200:
+                    decoded_hash = ipfs_response.json().get('IpfsHash')
+                else:
+                    decoded_hash = ''
             else:
                 decoded_hash = ''
-        else:
-            decoded_hash = ''
-        
-        action_reward(
-            from_address=company.blockchain_public,
-            to_address=user.blockchain_public,
-            from_balance=company_balance,
-            action_id=action.id,
-            reward=reward,
-            img_hash=decoded_hash,
-            url_proof=url_proof
-        )
-        
-        action.kpi += int(kpi)
-        action.save()
-        
+            
+            # the Transaction row (or the queued operation) is written after the blockchain call returns
+            operation = action_reward(
+                from_address=company_address,
+                to_address=user_address,
+                from_balance=company_balance,
+                action_id=action_pk,
+                reward=reward,
+                img_hash=decoded_hash,
+                url_proof=url_proof,
+                user_id=user_pk
+            )
+            if operation:
+                operation.reserved_kpi = kpi    # given back if the operation fails
+            if company_balance < reward:
+                # action_reward() only pays what the company has, so the campaign counts that instead
+                Campaign.add_totals(campaign_pk, rewarded=company_balance - reward)
+            db_session.commit()     # the queued operation, if the outbox is on
+        except Exception:
+            db_session.rollback()
+            Action.release_kpi(action_pk, kpi)
+            raise
+        
+        if operation:
+            return {
+                'operation_id': str(operation.id),
+                'old_balance': old_balance
+            }, 202
         return {
-            'new_balance': blockchain_manager.balance_of(user.blockchain_public),
+            'new_balance': blockchain_manager.balance_of(user_address),
             'old_balance': old_balance
         }
\ No newline at end of file
@@ -3,11 +3,11 @@ from flask_restful import Resource
 from xml.dom import ValidationErr
 from urllib.parse import urlencode
 from typing import Dict, Any
+from src.common import http
 from src.common.blockchain import generate_keys
 from src.config import ADMIN_EMAIL, APP_SECRET, BASE_BACKEND_URL, BASE_FRONTEND_URL, BLOCKCHAIN_URL, GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET, NETWORK
 from src.database.models import User
 import jwt
-import requests
 
 GOOGLE_ACCESS_TOKEN_OBTAIN_URL = 'https://oauth2.googleapis.com/token'
 GOOGLE_USER_INFO_URL = 'https://www.googleapis.com/oauth2/v3/userinfo'
@@ -15,8 +15,13 @@ SECRET_KEY = APP_SECRET
 
 def add_account_to_allowlist(address):
     """Adds an account to the permissioned blockchain allowlist."""
-    data = '{"jsonrpc":"2.0","method":"perm_addAccountsToAllowlist","params":[["' + address + '"]], "id":1}'
-    response = requests.post(BLOCKCHAIN_URL, data=data)
+    data = {
+        'jsonrpc': '2.0',
+        'method': 'perm_addAccountsToAllowlist',
+        'params': [[address]],
+        'id': 1
+    }
+    response = http.post(BLOCKCHAIN_URL, json=data, retry=True)  # adding an account twice has no effect
     return response
 
 def get_access_token(*, code: str, redirect_uri: str) -> str:
@@ -29,9 +34,9 @@ def get_access_token(*, code: str, redirect_uri: str) -> str:
     }
     print(data)
     
-    response = requests.post(GOOGLE_ACCESS_TOKEN_OBTAIN_URL, data=data)
+    response = http.post(GOOGLE_ACCESS_TOKEN_OBTAIN_URL, data=data)
     
-    if not response.ok:
+    if response.status_code != 200:
         # TODO: check best error type to use
         print(response)
         print(response.text)
@@ -42,12 +47,12 @@ def get_access_token(*, code: str, redirect_uri: str) -> str:
 
 
 def get_user_info(*, access_token: str) -> Dict[str, Any]:
-    response = requests.get(
+    response = http.get(
         GOOGLE_USER_INFO_URL,
         params={'access_token': access_token}
     )
     
-    if not response.ok:
+    if response.status_code != 200:
         # TODO: check best error type to use
         raise ValidationErr('Failed to obtain user info from Google')
     
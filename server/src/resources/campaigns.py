@@ -1,8 +1,11 @@
 from flask import request
 from flask_restful import Resource
+from itertools import groupby
 from marshmallow import fields, Schema, ValidationError
+from src.common.pagination import page_headers, page_params, paginate
 from src.common.utils import get_user_from_token, is_valid_uuid, not_none
-from src.database.models import Campaign, User
+from src.database.db import read_only
+from src.database.models import Campaign, row_serializer
 
 
 class CampaignSchema(Schema):
@@ -19,24 +22,37 @@ class OptionalCampaignSchema(Schema):
 
 campaign_schema = CampaignSchema()
 optional_campaign_schema = OptionalCampaignSchema()
+campaign_row = row_serializer(Campaign, 'company_name')
+company_campaign_row = row_serializer(Campaign, 'company_name', 'company_email', 'company_role', 'company_blockchain_public')
 
 
 class CampaignsAll(Resource):
+    @read_only
     def get(self):
         user = get_user_from_token(request)
         
         if not user:
             return {'error': 'not logged in'}, 401
         
+        try:
+            limit, after = page_params(request.args)
+        except ValueError as err:
+            return {'error': str(err)}, 400
+        
         if user.role == 'PM':
-            campaigns = Campaign.get_by_company(user.id)
+            campaigns = Campaign.list_rows(user.id)
         else:
-            campaigns = Campaign.all()
+            campaigns = Campaign.list_rows()
+
+        try:
+            campaigns, next_cursor = paginate(campaigns, [Campaign.name, Campaign.id], limit, after)
+        except ValueError as err:
+            return {'error': str(err)}, 400
         
-        campaign_dicts = [campaign.as_dict() for campaign in campaigns]
+        campaign_dicts = [campaign_row(campaign) for campaign in campaigns]
         for campaign in campaign_dicts:
-            campaign['company_name'] = User.get(campaign['company_id']).name
-        return campaign_dicts
+            campaign['percent_complete'] = Campaign.percent_complete(campaign['total_budget'], campaign['rewarded'])
+        return campaign_dicts, 200, page_headers(next_cursor)
 
     def post(self):
         user = get_user_from_token(request)
@@ -64,32 +80,39 @@ class CampaignsAll(Resource):
         new_campaign.save()
         
         campaign = new_campaign.as_dict()
-        campaign['company_name'] = User.get(campaign['company_id']).name
+        campaign['company_name'] = user.name
         
         return new_campaign.as_dict(), 201
 
 
 class CampaignsByCompany(Resource):
+    @read_only
     def get(self):
-        users = User.all()
-        companies = filter(lambda user: user.role != 'CB', users)
         result = []
-        
-        for company in companies:
-            campaign_list = Campaign.get_by_company(company.id)
-            if campaign_list.count() > 0:
-                c = company.as_dict()
-                del c['blockchain_private']
-                del c['picture_url']
-                result.append({
-                    'company': c,
-                    'campaigns': [campaign.as_dict() for campaign in campaign_list]
-                })
+        for company_id, rows in groupby(Campaign.by_company_rows(), key=lambda row: row.company_id):
+            campaigns = [company_campaign_row(row) for row in rows]
+            company = {
+                'id': str(company_id),
+                'name': campaigns[0]['company_name'],
+                'email': campaigns[0]['company_email'],
+                'role': campaigns[0]['company_role'],
+                'blockchain_public': campaigns[0]['company_blockchain_public']
+            }
+            for campaign in campaigns:
+                for key in ('company_name', 'company_email', 'company_role', 'company_blockchain_public'):
+                    del campaign[key]
+                campaign['percent_complete'] = Campaign.percent_complete(campaign['total_budget'], campaign['rewarded'])
+
+            result.append({
+                'company': company,
+                'campaigns': campaigns
+            })
         
         return result
 
 
 class CampaignsDetail(Resource):
+    @read_only
     def get(self, campaign_id):
         if not is_valid_uuid(campaign_id):
             return {'message': f'no campaign with id {campaign_id} found'}, 404
@@ -100,7 +123,7 @@ class CampaignsDetail(Resource):
             return {'message': f'no campaign with id {campaign_id} found'}, 404
         
         campaign_dict = campaign.as_dict()
-        campaign_dict['company_name'] = User.get(campaign_dict['company_id']).name
+        campaign_dict['company_name'] = campaign.user.name
 
         return campaign_dict, 200
 
@@ -136,7 +159,7 @@ class CampaignsDetail(Resource):
         campaign.save()
         
         campaign_dict = campaign.as_dict()
-        campaign_dict['company_name'] = User.get(campaign_dict['company_id']).name
+        campaign_dict['company_name'] = campaign.user.name
 
         return campaign_dict, 200
 
@@ -1,38 +1,30 @@
 from flask import request
 from flask_restful import Resource
-from datetime import datetime
 from marshmallow import fields, Schema, ValidationError
-from src.common.blockchain import blockchain_manager
+from src.common.outbox import chain_write
+from src.common.pagination import page_headers, page_params, paginate
 from src.common.utils import get_user_from_token, is_valid_uuid, not_none
-from src.config import ADMIN_ADDRESS, PRIVATE_KEY
-from src.database.models import Offer, Transaction, User
+from src.config import ADMIN_ADDRESS
+from src.database.db import read_only
+from src.database.models import Offer, row_serializer
 
 
-def offer_redeem(*, buyer_address: str, offer_id: int):
-    admin_address = ADMIN_ADDRESS
-    admin_key = PRIVATE_KEY
+def offer_redeem(*, buyer_address: str, offer_id: int, user_id=None):
     offer = Offer.get(offer_id)
     
     value = int(offer.price)
     
-    tx_hash = blockchain_manager.burn(
-        caller=admin_address,
-        caller_key=admin_key,
-        from_acc=buyer_address,
-        value=value
-    )
-    
-    transaction = Transaction(
-        date=datetime.now(),
-        transaction_hash=tx_hash,
-        sender_address=buyer_address,
-        receiver_address=admin_address,
-        quantity=value,
-        transaction_info=f'Offer id-{offer_id} payment',
-        img_ipfs_hash='',
-        external_proof_url=''
-    )
-    transaction.save()
+    return chain_write('burn', {
+        'from_acc': buyer_address,
+        'value': value
+    }, {
+        'sender_address': buyer_address,
+        'receiver_address': ADMIN_ADDRESS,
+        'quantity': value,
+        'transaction_info': f'Offer id-{offer_id} payment',
+        'img_ipfs_hash': '',
+        'external_proof_url': ''
+    }, user_id=user_id)
 
 
 class OfferSchema(Schema):
@@ -51,24 +43,33 @@ class OptionalOfferSchema(Schema):
     
 offer_schema = OfferSchema()
 optional_offer_schema = OptionalOfferSchema()
+offer_row = row_serializer(Offer, 'company_name')
 
 
 class OffersAll(Resource):
+    @read_only
     def get(self):
         user = get_user_from_token(request)
 
         if not user:
             return {'error': 'not logged in'}, 401
         
+        try:
+            limit, after = page_params(request.args)
+        except ValueError as err:
+            return {'error': str(err)}, 400
+        
         if user.role == 'PM':
-            offers = Offer.get_by_company(user.id)
+            offers = Offer.list_rows(user.id)
         else:
-            offers = Offer.all()
+            offers = Offer.list_rows()
+
+        try:
+            offers, next_cursor = paginate(offers, [Offer.name, Offer.id], limit, after)
+        except ValueError as err:
+            return {'error': str(err)}, 400
         
-        offer_dicts = [offer.as_dict() for offer in offers]
-        for offer in offer_dicts:
-            offer['company_name'] = User.get(offer['company_id']).name
-        return offer_dicts
+        return [offer_row(offer) for offer in offers], 200, page_headers(next_cursor)
 
     def post(self):
         user = get_user_from_token(request)
@@ -94,12 +95,13 @@ class OffersAll(Resource):
         new_offer.save()
         
         offer = new_offer.as_dict()
-        offer['company_name'] = User.get(offer['company_id']).name
+        offer['company_name'] = user.name
         
         return offer, 201
 
 
 class OffersDetail(Resource):
+    @read_only
     def get(self, offer_id):
         if not is_valid_uuid(offer_id):
             return {'message': f'no offer with id {offer_id} found'}, 404
@@ -108,7 +110,7 @@ class OffersDetail(Resource):
         if not offer:
             return {'message': f'no offer with id {offer_id} found'}, 404
         offer_dict = offer.as_dict()
-        offer_dict['company_name'] = User.get(offer.company_id).name
+        offer_dict['company_name'] = offer.user.name
 
         return offer_dict
 
@@ -143,8 +145,9 @@ class OffersDetail(Resource):
         offer.price = not_none(data.get('price'), offer.price)
         offer.save()
         
+        company_name = offer.user.name
         offer = offer.as_dict()
-        offer['company_name'] = User.get(offer['company_id']).name
+        offer['company_name'] = company_name
         
         return offer, 200
 
@@ -189,9 +192,13 @@ class OfferRedeem(Resource):
         if not Offer.exists(offer_id):
             return {'message': f'no offer with id {offer_id} found'}, 404
         
-        offer_redeem(
+        operation = offer_redeem(
             buyer_address=user.blockchain_public,
-            offer_id=offer_id
+            offer_id=offer_id,
+            user_id=user.id
         )
         
+        if operation:
+            operation.save()
+            return {'success': True, 'operation_id': str(operation.id)}, 202
         return {'success': True}
\ No newline at end of file
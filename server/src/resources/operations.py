@@ -0,0 +1,25 @@
+from flask import request
+from flask_restful import Resource
+from src.common.utils import get_user_from_token, is_valid_uuid
+from src.database.models import Operation
+
+
+class OperationsDetail(Resource):
+    def get(self, operation_id):
+        user = get_user_from_token(request)
+        
+        if not user:
+            return {'error': 'not logged in'}, 401
+        
+        if not is_valid_uuid(operation_id):
+            return {'message': f'no operation with id {operation_id} found'}, 404
+        
+        operation = Operation.get(operation_id)
+        
+        if not operation:
+            return {'message': f'no operation with id {operation_id} found'}, 404
+        
+        if operation.user_id != user.id and user.role != 'AD':
+            return {'error': 'users can only read their own operations'}, 403
+        
+        return operation.as_dict()
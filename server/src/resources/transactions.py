@@ -1,26 +1,38 @@
 from flask import request
 from flask_restful import Resource
+from src.common.pagination import page_headers, page_params, paginate
 from src.common.utils import get_user_from_token
-from src.database.models import Transaction, User
+from src.database.db import read_only
+from src.database.models import Transaction, row_serializer
+
+transaction_row = row_serializer(
+    Transaction, 'sender_email', 'receiver_email', 'sender_name', 'receiver_name',
+    date=str, last_checked_at=lambda value: value and str(value)
+)
+
 
 class TransactionsAll(Resource):
+    @read_only
     def get(self):
         user = get_user_from_token(request)
+
+        if not user:
+            return {'error': 'not logged in'}, 401
+
+        try:
+            limit, after = page_params(request.args)
+        except ValueError as err:
+            return {'error': str(err)}, 400
         
         if user.role == 'AD':
-            transactions = Transaction.all()
+            rows = Transaction.history()
         else:
-            transactions = Transaction.get_by_address(user.blockchain_public)
-        transaction_dicts = [transaction.as_dict() for transaction in transactions]
-        
-        # Add user data
-        for transaction in transaction_dicts:
-            sender_user = User.get_by_address(transaction['sender_address'])
-            receiver_user = User.get_by_address(transaction['receiver_address'])
-            transaction['sender_email'] = sender_user.email
-            transaction['receiver_email'] = receiver_user.email
-            transaction['sender_name'] = sender_user.name
-            transaction['receiver_name'] = receiver_user.name
-            transaction['date'] = str(transaction.get('date'))
+            rows = Transaction.history(user.blockchain_public)
+
+        # newest first, the id breaks ties between transactions with the same date
+        try:
+            rows, next_cursor = paginate(rows, [Transaction.date, Transaction.id], limit, after, descending=True)
+        except ValueError as err:
+            return {'error': str(err)}, 400
 
-        return transaction_dicts
\ No newline at end of file
+        return [transaction_row(row) for row in rows], 200, page_headers(next_cursor)
\ No newline at end of file
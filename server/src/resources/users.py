@@ -24,9 +24,10 @@ class UsersAdmin(Resource):
 
         users = User.all()
         user_dicts = [user.as_dict() for user in users]
+        balances = blockchain_manager.balance_of_many([user['blockchain_public'] for user in user_dicts])
         
-        for user in user_dicts:
-            user['balance'] = -1
+        for user, balance in zip(user_dicts, balances):
+            user['balance'] = balance
             del user['blockchain_private']
         
         return user_dicts
@@ -0,0 +1,154 @@
+from eth_utils import event_abi_to_log_topic
+from src import config
+from src.common.blockchain import blockchain_manager
+from src.database.db import db_session
+from src.database.models import IndexedBlock, LedgerEntry
+from sqlalchemy.dialects.postgresql import insert
+from uuid import UUID
+from web3.exceptions import BlockNotFound
+import time
+
+INDEXER_START_BLOCK = getattr(config, 'INDEXER_START_BLOCK', 0)        # block the contract was deployed in
+INDEXER_CONFIRMATIONS = getattr(config, 'INDEXER_CONFIRMATIONS', 0)    # blocks behind the head the indexer stays
+INDEXER_BATCH_BLOCKS = getattr(config, 'INDEXER_BATCH_BLOCKS', 1000)   # blocks read per eth_getLogs call
+INDEXER_POLL_INTERVAL = getattr(config, 'INDEXER_POLL_INTERVAL', 2)     # seconds between polls when up to date
+REORG_HISTORY = 128     # checkpoints (indexed block hashes) kept to find where a reorganization forked
+
+
+class LedgerIndexer:
+    """Follows the chain from the stored checkpoint and writes the contract Transfer and Action events into the
+    ledger_entry table, so balances and histories can be answered from the database.\n
+    Each range of blocks is indexed in a single DB transaction together with the hash of its last block. If the
+    hash of the checkpoint no longer matches the chain, the ledger is rewound to the newest stored block that
+    still matches and indexed again from there. Entries are unique by transaction hash and log index, so a range
+    indexed twice (e.g. by two indexers) does not duplicate them."""
+
+    def __init__(self, manager):
+        self.w3 = manager.w3
+        self.contract = manager.contract
+        self.events = {
+            event_abi_to_log_topic(abi): getattr(self.contract.events, abi['name'])()
+            for abi in self.contract.abi if abi.get('type') == 'event'
+        }
+
+    def block_hash(self, number) -> str or None:
+        """Returns the hash of a block, or None if the chain does not reach it (e.g. after a reorganization to a
+        shorter chain)."""
+        try:
+            return self.w3.eth.get_block(number)['hash'].hex()
+        except BlockNotFound:
+            return None
+
+    def step(self) -> int:
+        """Indexes the next range of blocks, returning how many blocks were indexed."""
+        checkpoint = IndexedBlock.latest()
+        if checkpoint is None:
+            start = INDEXER_START_BLOCK
+        elif self.block_hash(checkpoint.number) != checkpoint.hash:
+            self.rewind()
+            return 0
+        else:
+            start = checkpoint.number + 1
+
+        head = self.w3.eth.block_number - INDEXER_CONFIRMATIONS
+        if start > head:
+            return 0
+        end = min(head, start + INDEXER_BATCH_BLOCKS - 1)
+
+        end_hash = self.block_hash(end)
+        if end_hash is None:
+            return 0
+        logs = self.w3.eth.get_logs({
+            'address': self.contract.address,
+            'fromBlock': start,
+            'toBlock': end
+        })
+        if self.block_hash(end) != end_hash:
+            return 0    # the chain reorganized while reading, try again
+
+        rows = [row for row in map(self.to_row, logs) if row is not None]
+        if rows:
+            db_session.execute(insert(LedgerEntry).values(rows).on_conflict_do_nothing(
+                index_elements=['transaction_hash', 'log_index']
+            ))
+
+        db_session.add(IndexedBlock(number=end, hash=end_hash))
+        self.prune()
+        db_session.commit()
+        return end - start + 1
+
+    def prune(self):
+        """Keeps the newest REORG_HISTORY checkpoints, however many blocks apart they are."""
+        db_session.flush()
+        oldest_kept = db_session.query(IndexedBlock.number).order_by(IndexedBlock.number.desc()).offset(
+            REORG_HISTORY - 1
+        ).limit(1).scalar()
+        if oldest_kept is not None:
+            IndexedBlock.query.filter(IndexedBlock.number < oldest_kept).delete()
+
+    def rewind(self):
+        """Removes the ledger entries of the blocks replaced by a reorganization."""
+        fork_point = INDEXER_START_BLOCK - 1
+        for block in IndexedBlock.query.order_by(IndexedBlock.number.desc()):
+            if self.block_hash(block.number) == block.hash:
+                fork_point = block.number
+                break
+
+        print(f'# Chain reorganization detected, rewinding the ledger to block {fork_point}')
+        LedgerEntry.query.filter(LedgerEntry.block_number > fork_point).delete()
+        IndexedBlock.query.filter(IndexedBlock.number > fork_point).delete()
+        db_session.commit()
+
+    def to_row(self, log) -> dict or None:
+        """Returns the ledger_entry row of a contract event log, or None for other logs."""
+        event = self.events.get(bytes(log['topics'][0])) if log['topics'] else None
+        if event is None:
+            return None
+
+        data = event.processLog(log)
+        args = data['args']
+        row = {
+            'block_number': data['blockNumber'],
+            'block_hash': data['blockHash'].hex(),
+            'transaction_hash': data['transactionHash'].hex(),
+            'log_index': data['logIndex'],
+            'event': data['event'],
+            'from_address': args['_from'].lower(),
+            # the rows of a multi-row insert need the same columns, so the Action only ones are always set
+            'action_id': None,
+            'time': None,
+            'ipfs_hash': None
+        }
+        if data['event'] == 'Transfer':
+            row['to_address'] = args['_to'].lower()
+            row['value'] = args['_value']
+        else:
+            row['to_address'] = args['_who'].lower()
+            row['value'] = args['_reward']
+            row['time'] = args['_time']
+            row['ipfs_hash'] = '0x' + args['_ipfsHash'].hex()
+            # action ids are UUIDs sent as uint256 (see txbuilder.to_uint256)
+            if args['_actionID'] < 2 ** 128:
+                row['action_id'] = UUID(int=args['_actionID'])
+        return row
+
+    def run(self):
+        while True:
+            try:
+                indexed = self.step()
+            except Exception as err:
+                print(f'# Indexer error: {err}')
+                db_session.rollback()
+                indexed = 0
+            finally:
+                db_session.remove()
+
+            # keep indexing without waiting while behind the head
+            if indexed < INDEXER_BATCH_BLOCKS:
+                time.sleep(INDEXER_POLL_INTERVAL)
+
+
+if __name__ == '__main__':
+    if not hasattr(blockchain_manager, 'contract'):
+        raise SystemExit('the ledger indexer is only available on the ethereum network')
+    LedgerIndexer(blockchain_manager).run()
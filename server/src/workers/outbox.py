@@ -0,0 +1,188 @@
+from datetime import datetime, timedelta
+from src import config
+from src.common.blockchain import TransactionRejected, blockchain_manager
+from src.common.outbox import BATCHABLE, add_transactions, write_call
+from src.config import ADMIN_ADDRESS, PRIVATE_KEY
+from src.database.db import db_session
+from src.database.models import Action, Operation
+import random
+import time
+
+OUTBOX_POLL_INTERVAL = getattr(config, 'OUTBOX_POLL_INTERVAL', 1)   # seconds between polls when idle
+OUTBOX_BATCH_SIZE = getattr(config, 'OUTBOX_BATCH_SIZE', 50)        # operations claimed per poll
+OUTBOX_LEASE = getattr(config, 'OUTBOX_LEASE', 120)                 # seconds before a claimed operation can be claimed again
+OUTBOX_MAX_ATTEMPTS = getattr(config, 'OUTBOX_MAX_ATTEMPTS', 8)
+OUTBOX_BACKOFF = getattr(config, 'OUTBOX_BACKOFF', 2)               # base retry delay in seconds, doubled on each attempt
+OUTBOX_MAX_BACKOFF = getattr(config, 'OUTBOX_MAX_BACKOFF', 300)
+
+
+def retry_delay(attempts) -> float:
+    """Exponential backoff with jitter, so failing operations do not retry in lockstep."""
+    delay = min(OUTBOX_MAX_BACKOFF, OUTBOX_BACKOFF * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.5)
+
+
+def retry_later(operations, error):
+    """Queues the operations again after a backoff delay, or marks them as failed once they are out of attempts,
+    giving back the KPI reserved by the action registrations that failed."""
+    for operation in operations:
+        operation.attempts += 1
+        operation.last_error = str(error)[:511]
+        if operation.attempts >= OUTBOX_MAX_ATTEMPTS:
+            operation.status = 'failed'
+            if operation.reserved_kpi:
+                Action.release_kpi(operation.params['action_id'], operation.reserved_kpi)
+        else:
+            operation.status = 'queued'
+            operation.next_attempt_at = datetime.now() + timedelta(seconds=retry_delay(operation.attempts))
+        operation.updated_at = datetime.now()
+
+
+class OutboxWorker:
+    """Drains the outbox, submitting the queued blockchain writes with retries and backoff.\n
+    Consecutive operations of a BATCHABLE kind are submitted together in a single transaction (batchMint and
+    batchProcessAction), keeping the order in which they were queued. As the contract reverts a whole
+    batchProcessAction if one of its actions is not valid, processAction batches only hold the actions of one
+    promoter, and the actions its balance cannot pay are left for a later attempt instead of being submitted.
+    Networks without atomic batches (fabric) get one operation per call, as retrying a batch that failed halfway
+    would apply its first writes twice.
+    On networks that sign transactions here (ethereum), the signed transaction is recorded on its operations before
+    it is sent, and retries send that same transaction again, so a send that timed out after reaching the node is
+    not applied twice.
+    Several workers can run at the same time, as operations are claimed with FOR UPDATE SKIP LOCKED.
+    Elsewhere delivery is at least once: if a worker dies between submitting an operation and recording it, the
+    operation is submitted again when its lease ends."""
+
+    def drain_once(self) -> int:
+        """Submits a batch of due operations, returning how many were claimed."""
+        operations = Operation.claim_due(OUTBOX_BATCH_SIZE, OUTBOX_LEASE)
+
+        groups = []
+        signed = {}     # groups of the operations already signed, by transaction hash
+        for operation in operations:
+            if operation.signed_transaction is not None:
+                if operation.transaction_hash not in signed:
+                    signed[operation.transaction_hash] = []
+                    groups.append(signed[operation.transaction_hash])
+                signed[operation.transaction_hash].append(operation)
+            elif (groups and blockchain_manager.atomic_batches and operation.kind in BATCHABLE
+                  and groups[-1][0].kind == operation.kind and groups[-1][0].signed_transaction is None):
+                groups[-1].append(operation)
+            else:
+                groups.append([operation])
+
+        for group in groups:
+            if group[0].kind == 'processAction' and group[0].signed_transaction is None:
+                for promoter_group in self.by_promoter(group):
+                    self.process(promoter_group)
+            else:
+                self.process(group)
+        return len(operations)
+
+    @staticmethod
+    def by_promoter(operations) -> list:
+        """Splits processAction operations into one group per promoter, keeping the order of each promoter's ones."""
+        groups = {}
+        for operation in operations:
+            groups.setdefault(operation.params['promoter'].lower(), []).append(operation)
+        return list(groups.values())
+
+    def fund(self, operations) -> list:
+        """Returns the leading processAction operations of a promoter that its balance can pay, and queues the
+        rest again, so they do not revert the batch of the ones that can be paid.\n
+        Rewards already submitted but not mined yet are taken from the balance. They are read before the balance,
+        and the balance skips the balance cache, so a transaction mined in between is taken twice rather than
+        missed."""
+        promoter = operations[0].params['promoter']
+        try:
+            if blockchain_manager.instant_writes:
+                balance = blockchain_manager.balance_of(promoter)
+            else:
+                unconfirmed = Operation.unconfirmed_rewards(promoter)
+                balance = getattr(blockchain_manager, 'manager', blockchain_manager).balance_of(promoter) - unconfirmed
+        except Exception as err:
+            retry_later(operations, err)
+            return []
+
+        funded = []
+        for operation in operations:
+            reward = int(operation.params['reward'])
+            if reward > balance:
+                break
+            balance -= reward
+            funded.append(operation)
+
+        retry_later(operations[len(funded):], 'promoter balance too low')
+        return funded
+
+    def send(self, operations) -> str:
+        """Sends the transaction of a group of operations, signing and recording it first on the networks that sign
+        transactions here, and returns its hash."""
+        if operations[0].signed_transaction is None:
+            method, params = write_call(operations[0].kind, [operation.params for operation in operations])
+            signed = blockchain_manager.sign(ADMIN_ADDRESS, PRIVATE_KEY, method, params)
+            if signed is None:
+                return getattr(blockchain_manager, method)(caller=ADMIN_ADDRESS, caller_key=PRIVATE_KEY, **params) or ''
+
+            for operation in operations:
+                operation.signed_transaction, operation.transaction_hash = signed
+            db_session.commit()     # recorded before sending it, as sending it may reach the node and still fail
+
+        operation = operations[0]
+        return blockchain_manager.send_signed(ADMIN_ADDRESS, operation.signed_transaction, operation.transaction_hash)
+
+    def process(self, operations):
+        """Submits a group of operations of the same kind, in a single transaction if there are several."""
+        if operations[0].kind == 'processAction' and operations[0].signed_transaction is None:
+            funded = self.fund(operations)
+            if len(funded) < len(operations):
+                db_session.commit()     # keeps the deferred ones queued even if the submission below fails
+            if not funded:
+                return
+            operations = funded
+
+        try:
+            tx_hash = self.send(operations)
+        except TransactionRejected as err:
+            db_session.rollback()
+            # the node will never mine it, so the next attempt signs a new transaction
+            for operation in operations:
+                operation.signed_transaction = None
+                operation.transaction_hash = None
+            retry_later(operations, err)
+        except Exception as err:
+            db_session.rollback()
+            retry_later(operations, err)
+        else:
+            add_transactions(
+                [operation.record for operation in operations],
+                [operation.created_at for operation in operations],
+                tx_hash
+            )
+            # saved in the same commit as the operations' Transaction rows
+            for operation in operations:
+                operation.attempts += 1
+                operation.transaction_hash = tx_hash
+                operation.status = 'done'
+                operation.last_error = None
+                operation.updated_at = datetime.now()
+        db_session.commit()
+
+    def run(self):
+        while True:
+            try:
+                claimed = self.drain_once()
+            except Exception as err:
+                print(f'# Outbox worker error: {err}')
+                db_session.rollback()
+                claimed = 0
+            finally:
+                db_session.remove()
+
+            # keep draining without waiting while there is a backlog
+            if claimed < OUTBOX_BATCH_SIZE:
+                time.sleep(OUTBOX_POLL_INTERVAL)
+
+
+if __name__ == '__main__':
+    OutboxWorker().run()
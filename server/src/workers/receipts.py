@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+from src import config
+from src.common.blockchain import blockchain_manager
+from src.config import ADMIN_ADDRESS, PRIVATE_KEY
+from src.database.db import db_session
+from src.database.models import Operation, Transaction
+from src.workers.outbox import retry_later
+import time
+
+RECEIPT_POLL_INTERVAL = getattr(config, 'RECEIPT_POLL_INTERVAL', 2)     # seconds between polls when idle
+RECEIPT_BATCH_SIZE = getattr(config, 'RECEIPT_BATCH_SIZE', 200)         # pending transactions checked per poll
+RECEIPT_DROP_AFTER = getattr(config, 'RECEIPT_DROP_AFTER', 600)         # seconds before an unknown transaction is dropped
+
+
+class ReceiptTracker:
+    """Records the confirmation status of submitted transactions on their Transaction rows.\n
+    Pending transactions are checked in batches with eth_getTransactionReceipt, so request handlers never wait for
+    a transaction to be mined. Transactions still without a receipt after RECEIPT_DROP_AFTER seconds are marked as
+    dropped if the node does not know them anymore. Outbox operations whose transaction reverted or was dropped are
+    queued again, as a reverted batch leaves every operation in it undone. Gaps left in the nonces of the
+    administrator are filled (see EthereumManager.fill_nonce_gap)."""
+
+    def __init__(self, manager):
+        self.manager = manager
+
+    def poll_once(self) -> (int, int):
+        """Checks a batch of pending transactions, returning how many were checked and how many of them are no
+        longer pending."""
+        pending = Transaction.get_pending(RECEIPT_BATCH_SIZE).all()
+        if not pending:
+            return 0, 0
+
+        receipts = self.manager.rpc_batch([
+            ('eth_getTransactionReceipt', [transaction.transaction_hash]) for transaction in pending
+        ])
+
+        now = datetime.now()
+        drop_limit = now - timedelta(seconds=RECEIPT_DROP_AFTER)
+        unmined = []
+        for transaction, receipt in zip(pending, receipts):
+            transaction.last_checked_at = now
+            if receipt is None:
+                if transaction.date < drop_limit:
+                    unmined.append(transaction)
+                continue
+
+            transaction.status = 'mined' if int(receipt['status'], 16) == 1 else 'reverted'
+            transaction.block_number = int(receipt['blockNumber'], 16)
+            transaction.gas_used = int(receipt['gasUsed'], 16)
+
+        if unmined:
+            known = self.manager.rpc_batch([
+                ('eth_getTransactionByHash', [transaction.transaction_hash]) for transaction in unmined
+            ])
+            for transaction, tx in zip(unmined, known):
+                if tx is None:
+                    transaction.status = 'dropped'
+
+        failed = {transaction.transaction_hash: transaction.status for transaction in pending
+                  if transaction.status in ('reverted', 'dropped')}
+        if failed:
+            operations = Operation.query.filter(
+                Operation.transaction_hash.in_(failed),
+                Operation.status == 'done'
+            ).all()
+            for operation in operations:
+                status = failed[operation.transaction_hash]
+                if status == 'reverted':
+                    # a new transaction is signed on the next attempt; a dropped one is sent again as is
+                    operation.signed_transaction = None
+                    operation.transaction_hash = None
+                retry_later([operation], f'transaction {status}')
+
+        db_session.commit()
+        return len(pending), sum(1 for transaction in pending if transaction.status != 'pending')
+
+    def run(self):
+        while True:
+            try:
+                checked, resolved = self.poll_once()
+                # transactions stuck behind a nonce that was never sent are released by sending one with it
+                self.manager.fill_nonce_gap(ADMIN_ADDRESS, PRIVATE_KEY)
+            except Exception as err:
+                print(f'# Receipt tracker error: {err}')
+                db_session.rollback()
+                checked, resolved = 0, 0
+            finally:
+                db_session.remove()
+
+            # keep draining without waiting while full batches are being resolved; a batch of transactions that
+            # are all still pending (e.g. stuck behind a nonce gap) waits, and the next poll checks other ones
+            if checked < RECEIPT_BATCH_SIZE or resolved == 0:
+                time.sleep(RECEIPT_POLL_INTERVAL)
+
+
+if __name__ == '__main__':
+    if not hasattr(blockchain_manager, 'rpc_batch'):
+        raise SystemExit('the receipt tracker is only available on the ethereum network')
+    ReceiptTracker(blockchain_manager).run()
@@ -1,7 +1,13 @@
 import pytest
+from concurrent.futures import ThreadPoolExecutor
+from src.common import pagination
 from src.common.blockchain import blockchain_manager
-from src.database.models import Campaign, Action
+from sqlalchemy import event
+from src.database.db import db_session, engine
+from src.database.models import Campaign, Action, Transaction
+import io
 import json
+import threading
 
 
 @pytest.fixture()
@@ -105,6 +111,76 @@ def test_get_actions_promoter(client, test_promoter):
     assert response.json[0].get('name') == 'promoter action'
 
 
+def test_get_actions_query_count(client, base_data, test_admin, test_promoter, query_counter):
+    campaign, action_list = base_data
+    user, token = test_admin
+    promoter, promoter_token = test_promoter
+    campaign_id, promoter_id = campaign.id, promoter.id    # the objects are detached after each request
+
+    for i in range(2):  # the first request caches the logged in user
+        query_counter.clear()
+        response = client.get('/api/actions', headers={
+            'Authorization': f'bearer {token}'
+        })
+        assert response.status_code == 200
+    base_count = len(query_counter)
+
+    for i in range(10):
+        Action(
+            name=f'promoter action {i}',
+            description='description',
+            reward=10,
+            kpi_target=10,
+            kpi_indicator='indicator',
+            company_id=promoter_id,
+            campaign_id=campaign_id
+        ).save()
+
+    query_counter.clear()
+    response = client.get('/api/actions', headers={
+        'Authorization': f'bearer {token}'
+    })
+
+    assert response.status_code == 200
+    assert len(response.json) == len(action_list) + 10
+    assert {'testAD', 'testPM'} == {action['company_name'] for action in response.json}
+    assert len(query_counter) == base_count
+
+
+def test_get_actions_pages(client, base_data, test_admin):
+    campaign, action_list = base_data
+    user, token = test_admin
+    action_ids = [str(action.id) for action in action_list]     # sorted by name
+
+    response = client.get('/api/actions', query_string={'limit': 2}, headers={
+        'Authorization': f'bearer {token}'
+    })
+    assert response.status_code == 200
+    assert [action['id'] for action in response.json] == action_ids[:2]
+
+    response = client.get('/api/actions', query_string={
+        'limit': 2, 'after': response.headers['X-Next-Cursor']
+    }, headers={
+        'Authorization': f'bearer {token}'
+    })
+    assert response.status_code == 200
+    assert [action['id'] for action in response.json] == action_ids[2:]
+    assert 'X-Next-Cursor' not in response.headers
+
+
+def test_get_actions_pages_by_default(client, base_data, test_admin, monkeypatch):
+    campaign, action_list = base_data
+    user, token = test_admin
+    monkeypatch.setattr(pagination, 'MAX_PAGE_SIZE', 2)
+
+    response = client.get('/api/actions', headers={
+        'Authorization': f'bearer {token}'
+    })
+    assert response.status_code == 200
+    assert [action['name'] for action in response.json] == ['action 1', 'action 2']
+    assert 'X-Next-Cursor' in response.headers
+
+
 # POST
 def test_post_actions(client, base_data, test_admin):
     campaign, action_list = base_data
@@ -145,6 +221,38 @@ def test_post_actions(client, base_data, test_admin):
     assert new_balance == base_balance + total_investment
 
 
+def test_post_actions_single_commit(client, base_data, test_admin, query_counter):
+    campaign, action_list = base_data
+    user, token = test_admin
+    campaign_id = str(campaign.id)  # the objects are detached after each request
+    commits = []
+
+    def count(conn):
+        commits.append(conn)
+
+    event.listen(engine, 'commit', count)
+
+    try:
+        query_counter.clear()
+        response = client.post('/api/actions', headers={
+            'Authorization': f'bearer {token}'
+        }, json={
+            'name': 'test action',
+            'description': 'test action description',
+            'reward': 10,
+            'kpi_target': 10,
+            'kpi_indicator': 'test indicator',
+            'campaign_id': campaign_id
+        })
+    finally:
+        event.remove(engine, 'commit', count)
+
+    assert response.status_code == 201
+    assert response.json.get('name') == 'test action'
+    assert len(commits) == 1
+    assert not any(statement.startswith('SELECT action.') for statement in query_counter)
+
+
 def test_post_actions_no_token(client):
     response = client.post('/api/actions')
     assert response.status_code == 401
@@ -315,4 +423,85 @@ def test_put_action(client, base_data, test_admin):
 
 # /api/actions/:action:id/register
 # POST
-# TODO
\ No newline at end of file
+def test_register_action(client, base_data, test_collaborator):
+    campaign, action_list = base_data
+    user, token = test_collaborator
+    action_id = action_list[0].id
+
+    response = client.post(f'/api/actions/{action_id}/register', headers={
+        'Authorization': f'bearer {token}'
+    }, data={
+        'kpi': 3,
+        'verification_url': 'https://example.com/proof'
+    })
+
+    assert response.status_code == 200
+    assert Action.get(action_id).kpi == 3
+
+
+def test_register_action_uploads_concurrently(client, base_data, test_collaborator, monkeypatch):
+    campaign, action_list = base_data
+    user, token = test_collaborator
+    action_id = action_list[0].id
+    upload_threads = []
+
+    class UploadResponse:
+        status_code = 200
+
+        def json(self):
+            return {'IpfsHash': 'QmProof'}
+
+    def upload_file(file):
+        upload_threads.append(threading.current_thread().name)
+        return UploadResponse()
+
+    monkeypatch.setattr('src.resources.actions.IPFS_ON', True)
+    monkeypatch.setattr('src.resources.actions.upload_file', upload_file)
+
+    response = client.post(f'/api/actions/{action_id}/register', headers={
+        'Authorization': f'bearer {token}'
+    }, data={
+        'kpi': 1,
+        'verification_url': 'https://example.com/proof',
+        'image_proof': (io.BytesIO(b'proof'), 'proof.png')
+    })
+
+    assert response.status_code == 200
+    assert len(upload_threads) == 1 and upload_threads[0].startswith('io')
+    transaction = Transaction.query.filter_by(transaction_info=f'Action id-{action_id} registration').one()
+    assert transaction.img_ipfs_hash == 'QmProof'
+
+
+def test_register_action_exceeding_target(client, base_data, test_collaborator):
+    campaign, action_list = base_data
+    user, token = test_collaborator
+    action_id, kpi_target = action_list[0].id, action_list[0].kpi_target
+
+    response = client.post(f'/api/actions/{action_id}/register', headers={
+        'Authorization': f'bearer {token}'
+    }, data={
+        'kpi': kpi_target + 1,
+        'verification_url': 'https://example.com/proof'
+    })
+
+    assert response.status_code == 400
+    assert Action.get(action_id).kpi == 0
+
+
+def test_reserve_kpi_concurrent(base_data):
+    campaign, action_list = base_data
+    action_id = action_list[0].id
+    Action.query.filter_by(id=action_id).update({'kpi': 0, 'kpi_target': 20})
+    db_session.commit()
+
+    def register():
+        try:
+            return Action.reserve_kpi(action_id, 1)
+        finally:
+            db_session.remove()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: register(), range(40)))
+
+    assert sorted(result for result in results if result is not None) == list(range(1, 21))
+    assert Action.get(action_id).kpi == 20
\ No newline at end of file
@@ -1,6 +1,10 @@
 import pytest
 import json
+from sqlalchemy import text
+from src.database.db import db_session
+from src.database.migrations import MIGRATIONS
 from src.database.models import Campaign
+from src.resources import actions
 
 
 @pytest.fixture()
@@ -28,13 +32,14 @@ def base_data(test_admin):
 # GET
 def test_get_campaigns(client, base_data):
     user, token, base_campaign_list = base_data
+    campaign_name = base_campaign_list[0].name  # the objects are detached after each request
 
     response = client.get(
         '/api/campaigns', headers={'Authorization': f'bearer {token}'}
     )
 
     assert len(response.json) == len(base_campaign_list)
-    assert base_campaign_list[0].name in json.dumps(response.json)
+    assert campaign_name in json.dumps(response.json)
 
 
 def test_get_campaigns_no_token(client):
@@ -53,13 +58,42 @@ def test_get_campaigns_only_promoter(client, base_data, test_promoter):
         company_id=promoter.id,
     )
     promoter_campaign.save()
+    campaign_name = promoter_campaign.name  # the objects are detached after each request
 
     response = client.get(
         '/api/campaigns', headers={'Authorization': f'bearer {promoter_token}'}
     )
 
     assert len(response.json) == 1
-    assert response.json[0].get('name') == promoter_campaign.name
+    assert response.json[0].get('name') == campaign_name
+
+
+def test_get_campaigns_query_count(client, base_data, test_promoter, query_counter):
+    user, token, base_campaign_list = base_data
+    promoter, promoter_token = test_promoter
+    promoter_id = promoter.id   # the objects are detached after each request
+
+    for i in range(2):  # the first request caches the logged in user
+        query_counter.clear()
+        response = client.get(
+            '/api/campaigns', headers={'Authorization': f'bearer {token}'}
+        )
+        assert response.status_code == 200
+    base_count = len(query_counter)
+
+    for i in range(10):
+        Campaign(
+            name=f'promoter campaign {i}', description='description', company_id=promoter_id
+        ).save()
+
+    query_counter.clear()
+    response = client.get(
+        '/api/campaigns', headers={'Authorization': f'bearer {token}'}
+    )
+
+    assert len(response.json) == len(base_campaign_list) + 10
+    assert {'testAD', 'testPM'} == {campaign['company_name'] for campaign in response.json}
+    assert len(query_counter) == base_count
 
 
 # POST
@@ -122,7 +156,23 @@ def test_post_campaigns_validation_error(client, base_data):
 
 
 # /api/campaigns/company
-# GET TODO
+# GET
+def test_get_campaigns_by_company(client, base_data, test_promoter, test_collaborator, query_counter):
+    user, token, base_campaign_list = base_data
+    promoter, promoter_token = test_promoter
+    user_id, promoter_id = str(user.id), str(promoter.id)   # the objects are detached after each request
+    Campaign(name='promoter campaign', description='description', company_id=promoter.id).save()
+    query_counter.clear()
+
+    response = client.get('/api/campaigns/company')
+
+    assert response.status_code == 200
+    companies = {entry['company']['id']: entry for entry in response.json}
+    assert set(companies) == {user_id, promoter_id}
+    assert len(companies[user_id]['campaigns']) == len(base_campaign_list)
+    assert len(companies[promoter_id]['campaigns']) == 1
+    assert set(companies[promoter_id]['company']) == {'id', 'name', 'email', 'role', 'blockchain_public'}
+    assert len(query_counter) == 1
 
 
 # /api/campaigns/:campaign_id
@@ -136,6 +186,97 @@ def test_get_campaign(client, base_data):
     assert response.json.get('name') == base_campaign_list[0].name
 
 
+def test_get_campaign_progress(client, base_data, test_collaborator):
+    user, token, base_campaign_list = base_data
+    collaborator, collaborator_token = test_collaborator
+    campaign_id = base_campaign_list[0].id
+
+    response = client.post('/api/actions', headers={
+        'Authorization': f'bearer {token}'
+    }, json={
+        'name': 'action',
+        'description': 'description',
+        'reward': 10,
+        'kpi_target': 20,
+        'kpi_indicator': 'indicator',
+        'campaign_id': str(campaign_id)
+    })
+    assert response.status_code == 201
+    action_id = response.json.get('id')
+
+    response = client.put(f'/api/actions/{action_id}', headers={
+        'Authorization': f'bearer {token}'
+    }, json={
+        'kpi_target': 30
+    })
+    assert response.status_code == 200
+
+    response = client.post(f'/api/actions/{action_id}/register', headers={
+        'Authorization': f'bearer {collaborator_token}'
+    }, data={
+        'kpi': 6,
+        'verification_url': 'https://example.com/proof'
+    })
+    assert response.status_code == 200
+
+    response = client.get(f'/api/campaigns/{campaign_id}')
+
+    assert response.json.get('total_budget') == 300
+    assert response.json.get('rewarded') == 60
+    assert response.json.get('registration_count') == 1
+    assert response.json.get('percent_complete') == 20
+
+    # the migration backfill gives the values kept up to date by the endpoints
+    version, description, concurrent, statements = MIGRATIONS[3]
+    db_session.execute(text(statements[-1]))
+    db_session.commit()
+    response = client.get(f'/api/campaigns/{campaign_id}')
+    assert response.json.get('total_budget') == 300
+    assert response.json.get('rewarded') == 60
+    assert response.json.get('registration_count') == 1
+
+    response = client.delete(f'/api/actions/{action_id}', headers={
+        'Authorization': f'bearer {token}'
+    })
+    assert response.status_code == 204
+
+    response = client.get(f'/api/campaigns/{campaign_id}')
+
+    assert response.json.get('total_budget') == 60
+    assert response.json.get('percent_complete') == 100
+
+
+def test_campaign_progress_counts_the_paid_reward(client, base_data, test_collaborator, monkeypatch):
+    user, token, base_campaign_list = base_data
+    collaborator, collaborator_token = test_collaborator
+    campaign_id = base_campaign_list[0].id
+
+    response = client.post('/api/actions', headers={
+        'Authorization': f'bearer {token}'
+    }, json={
+        'name': 'action',
+        'description': 'description',
+        'reward': 10,
+        'kpi_target': 20,
+        'kpi_indicator': 'indicator',
+        'campaign_id': str(campaign_id)
+    })
+    action_id = response.json.get('id')
+
+    # the company can only pay 25 of the 60 the registration is worth
+    monkeypatch.setattr(actions.blockchain_manager, 'balance_of_many', lambda addresses: [0, 25])
+    response = client.post(f'/api/actions/{action_id}/register', headers={
+        'Authorization': f'bearer {collaborator_token}'
+    }, data={
+        'kpi': 6,
+        'verification_url': 'https://example.com/proof'
+    })
+    assert response.status_code == 200
+
+    response = client.get(f'/api/campaigns/{campaign_id}')
+    assert response.json.get('rewarded') == 25
+
+
 def test_get_campaign_invalid_uuid(client):
     response = client.get('/api/campaigns/404')
     
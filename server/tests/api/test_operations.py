@@ -0,0 +1,177 @@
+import pytest
+from src.database.models import Action, Campaign, Offer, Operation
+
+
+@pytest.fixture()
+def outbox(monkeypatch):
+    monkeypatch.setattr('src.common.outbox.OUTBOX_ON', True)
+    Operation.query.delete()
+    yield
+
+
+@pytest.fixture()
+def base_data(test_admin, test_promoter):
+    admin, admin_token = test_admin
+    promoter, promoter_token = test_promoter
+
+    Campaign.query.delete()
+    campaign = Campaign(name='campaign', description='description', company_id=promoter.id)
+    campaign.save()
+    action = Action(
+        name='action',
+        description='description',
+        reward=10,
+        kpi_target=10,
+        kpi_indicator='indicator',
+        company_id=promoter.id,
+        campaign_id=campaign.id
+    )
+    action.save()
+    offer = Offer(name='offer', description='description', price=5, company_id=promoter.id)
+    offer.save()
+
+    yield [str(campaign.id), str(action.id), str(offer.id), promoter_token]
+
+
+def queued_operation(operation_id):
+    operation = Operation.get(operation_id)
+    assert operation.status == 'queued'
+    return operation
+
+
+# /api/actions
+# POST
+def test_post_actions_queued(client, outbox, base_data):
+    campaign_id, action_id, offer_id, token = base_data
+
+    response = client.post('/api/actions', headers={
+        'Authorization': f'bearer {token}'
+    }, json={
+        'name': 'queued action',
+        'description': 'description',
+        'reward': 10,
+        'kpi_target': 10,
+        'kpi_indicator': 'indicator',
+        'campaign_id': campaign_id
+    })
+
+    assert response.status_code == 202
+    operation = queued_operation(response.json.get('operation_id'))
+    assert operation.kind == 'mint'
+    assert operation.params['value'] == 100
+    assert operation.record['transaction_info'] == f'Action id-{response.json.get("id")} creation'
+
+
+# /api/actions/:action_id
+# PUT
+def test_put_action_queued(client, outbox, base_data):
+    campaign_id, action_id, offer_id, token = base_data
+
+    response = client.put(f'/api/actions/{action_id}', headers={
+        'Authorization': f'bearer {token}'
+    }, json={
+        'kpi_target': 12
+    })
+
+    assert response.status_code == 202
+    operation = queued_operation(response.json.get('operation_id'))
+    assert operation.kind == 'mint'
+    assert operation.params['value'] == 20
+
+
+# DELETE
+def test_delete_action_queued(client, outbox, base_data):
+    campaign_id, action_id, offer_id, token = base_data
+
+    response = client.delete(f'/api/actions/{action_id}', headers={
+        'Authorization': f'bearer {token}'
+    })
+
+    assert response.status_code == 202
+    operation = queued_operation(response.json.get('operation_id'))
+    assert operation.kind == 'burn'
+    assert operation.params['value'] == 100
+    assert Action.get(action_id) is None
+
+
+# /api/actions/:action_id/register
+# POST
+def test_register_action_queued(client, outbox, base_data, test_collaborator):
+    campaign_id, action_id, offer_id, token = base_data
+    collaborator, collaborator_token = test_collaborator
+
+    response = client.post(f'/api/actions/{action_id}/register', headers={
+        'Authorization': f'bearer {collaborator_token}'
+    }, data={
+        'kpi': 2,
+        'verification_url': 'https://example.com/proof'
+    })
+
+    assert response.status_code == 202
+    assert 'old_balance' in response.json
+    operation = queued_operation(response.json.get('operation_id'))
+    assert operation.kind == 'processAction'
+    assert operation.record['transaction_info'] == f'Action id-{action_id} registration'
+    assert Action.get(action_id).kpi == 2
+
+
+# /api/offers/:offer_id/redeem
+# POST
+def test_redeem_offer_queued(client, outbox, base_data, test_collaborator):
+    campaign_id, action_id, offer_id, token = base_data
+    collaborator, collaborator_token = test_collaborator
+
+    response = client.post(f'/api/offers/{offer_id}/redeem', headers={
+        'Authorization': f'bearer {collaborator_token}'
+    })
+
+    assert response.status_code == 202
+    operation = queued_operation(response.json.get('operation_id'))
+    assert operation.kind == 'burn'
+    assert operation.params['value'] == 5
+
+
+# /api/operations/:operation_id
+# GET
+def test_get_operation(client, outbox, base_data, test_admin, test_collaborator):
+    campaign_id, action_id, offer_id, token = base_data
+    admin, admin_token = test_admin
+    collaborator, collaborator_token = test_collaborator
+
+    response = client.put(f'/api/actions/{action_id}', headers={
+        'Authorization': f'bearer {token}'
+    }, json={
+        'kpi_target': 12
+    })
+    operation_id = response.json.get('operation_id')
+
+    response = client.get(f'/api/operations/{operation_id}', headers={
+        'Authorization': f'bearer {token}'
+    })
+    assert response.status_code == 200
+    assert response.json.get('status') == 'queued'
+    assert response.json.get('kind') == 'mint'
+
+    response = client.get(f'/api/operations/{operation_id}', headers={
+        'Authorization': f'bearer {admin_token}'
+    })
+    assert response.status_code == 200
+
+    response = client.get(f'/api/operations/{operation_id}', headers={
+        'Authorization': f'bearer {collaborator_token}'
+    })
+    assert response.status_code == 403
+
+
+def test_get_operation_no_token(client):
+    response = client.get('/api/operations/401')
+    assert response.status_code == 401
+
+
+def test_get_operation_not_found(client, test_admin):
+    admin, admin_token = test_admin
+
+    response = client.get('/api/operations/6a4c3b0e-5a43-4f7c-8a4b-1b1c1d1e1f10', headers={
+        'Authorization': f'bearer {admin_token}'
+    })
+    assert response.status_code == 404
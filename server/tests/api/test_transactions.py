@@ -0,0 +1,123 @@
+import pytest
+from datetime import datetime, timedelta
+from src.database.db import db_session
+from src.database.models import Transaction
+
+
+@pytest.fixture()
+def base_data(test_admin, test_collaborator):
+    admin, admin_token = test_admin
+    collaborator, collaborator_token = test_collaborator
+
+    Transaction.query.delete()
+
+    transactions = [
+        Transaction(
+            date=datetime.now() - timedelta(minutes=i),
+            transaction_hash=f'0x{i}',
+            sender_address=admin.blockchain_public,
+            receiver_address=collaborator.blockchain_public,
+            quantity=10 * i,
+            transaction_info='test transaction',
+            img_ipfs_hash='',
+            external_proof_url=''
+        )
+        for i in range(3)
+    ]
+    transactions.append(Transaction(
+        date=datetime.now() - timedelta(minutes=10),
+        transaction_hash='0xunknown',
+        sender_address=admin.blockchain_public,
+        receiver_address='0x0000000000000000000000000000000000000001',
+        quantity=1,
+        transaction_info='transaction to an address without user',
+        img_ipfs_hash='',
+        external_proof_url=''
+    ))
+    for transaction in transactions:
+        transaction.save()
+
+    yield [admin_token, collaborator_token]
+
+
+# /api/transactions
+# GET
+def test_get_transactions_admin(client, base_data, query_counter):
+    admin_token, collaborator_token = base_data
+    query_counter.clear()
+
+    response = client.get('/api/transactions', headers={
+        'Authorization': f'bearer {admin_token}'
+    })
+
+    assert response.status_code == 200
+    assert len(response.json) == 4
+    assert [t['transaction_hash'] for t in response.json] == ['0x0', '0x1', '0x2', '0xunknown']
+    assert response.json[0]['sender_name'] == 'testAD'
+    assert response.json[0]['receiver_email'] == 'collaborator@socialcoin.com'
+    assert response.json[3]['receiver_name'] is None
+    assert len(query_counter) == 2     # the logged in user and the transaction history
+
+
+def test_get_transactions_collaborator(client, base_data):
+    admin_token, collaborator_token = base_data
+
+    response = client.get('/api/transactions', headers={
+        'Authorization': f'bearer {collaborator_token}'
+    })
+
+    assert response.status_code == 200
+    assert len(response.json) == 3
+    assert all(t['receiver_name'] == 'testCB' for t in response.json)
+
+
+def test_get_transactions_no_token(client):
+    response = client.get('/api/transactions')
+
+    assert response.status_code == 401
+
+
+def test_get_transactions_pages(client, base_data):
+    admin_token, collaborator_token = base_data
+
+    hashes = []
+    params = {'limit': 3}
+    while True:
+        response = client.get('/api/transactions', query_string=params, headers={
+            'Authorization': f'bearer {admin_token}'
+        })
+        assert response.status_code == 200
+        assert len(response.json) <= 3
+        hashes += [t['transaction_hash'] for t in response.json]
+
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            break
+        params = {'limit': 3, 'after': cursor}
+
+    assert hashes == ['0x0', '0x1', '0x2', '0xunknown']
+
+
+def test_get_transactions_invalid_cursor(client, base_data):
+    admin_token, collaborator_token = base_data
+
+    response = client.get('/api/transactions', query_string={'after': 'invalid'}, headers={
+        'Authorization': f'bearer {admin_token}'
+    })
+
+    assert response.status_code == 400
+
+
+def test_get_transactions_checked_by_the_receipt_tracker(client, base_data):
+    admin_token, collaborator_token = base_data
+    checked_at = datetime.now()
+    Transaction.query.filter_by(transaction_hash='0x1').update({'last_checked_at': checked_at})
+    db_session.commit()
+
+    response = client.get('/api/transactions', headers={
+        'Authorization': f'bearer {admin_token}'
+    })
+
+    assert response.status_code == 200
+    assert response.json[1]['last_checked_at'] == str(checked_at)
+    assert response.json[0]['last_checked_at'] is None
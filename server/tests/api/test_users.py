@@ -0,0 +1,71 @@
+import pytest
+
+
+# /api/users/self
+# GET
+def test_get_self_cached_user(client, test_admin, test_collaborator, query_counter):
+    user, token = test_collaborator
+
+    response = client.get('/api/users/self', headers={
+        'Authorization': f'bearer {token}'
+    })
+    assert response.status_code == 200
+
+    query_counter.clear()
+    response = client.get('/api/users/self', headers={
+        'Authorization': f'bearer {token}'
+    })
+
+    assert response.status_code == 200
+    assert response.json.get('name') == 'testCB'
+    assert not any('FROM "user"' in statement for statement in query_counter)
+
+
+# PUT
+def test_put_self_invalidates_cached_user(client, test_admin, test_collaborator):
+    user, token = test_collaborator
+
+    response = client.get('/api/users/self', headers={
+        'Authorization': f'bearer {token}'
+    })
+    assert response.json.get('name') == 'testCB'
+
+    response = client.put('/api/users/self', headers={
+        'Authorization': f'bearer {token}'
+    }, json={
+        'name': 'new name'
+    })
+    assert response.status_code == 200
+
+    response = client.get('/api/users/self', headers={
+        'Authorization': f'bearer {token}'
+    })
+    assert response.json.get('name') == 'new name'
+
+
+# /api/users/admin/:user_id
+# PUT
+def test_put_role_invalidates_cached_user(client, test_admin, test_collaborator):
+    admin, admin_token = test_admin
+    user, token = test_collaborator
+    user_id = user.id   # the objects are detached after each request
+
+    response = client.post('/api/campaigns', headers={
+        'Authorization': f'bearer {token}'
+    })
+    assert response.status_code == 403
+
+    response = client.put(f'/api/users/admin/{user_id}', headers={
+        'Authorization': f'bearer {admin_token}'
+    }, json={
+        'new_role': 'PM'
+    })
+    assert response.status_code == 200
+
+    response = client.post('/api/campaigns', headers={
+        'Authorization': f'bearer {token}'
+    }, json={
+        'name': 'campaign',
+        'description': 'description'
+    })
+    assert response.status_code == 201
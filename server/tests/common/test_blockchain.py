@@ -0,0 +1,194 @@
+import pytest
+from src.common import cache
+from src.common.blockchain import CachedBlockchainManager, EthereumManager, FabricManager, MemoryManager, TransactionRejected
+from src.common.txbuilder import TransactionBuilder, nonce_of
+from eth_account import Account
+from web3 import Web3
+
+CALLER = '0x00000000000000000000000000000000000000ee'
+HOLDER = '0x00000000000000000000000000000000000000aa'
+OTHER = '0x00000000000000000000000000000000000000bb'
+TTL = 5
+
+
+class FakeEth:
+    """Node that rejects every transaction, unless 'accept' is set."""
+
+    def __init__(self):
+        self.chain_id = 1
+        self.gas_price = 1
+        self.accept = False
+        self.sent = []
+
+    def send_raw_transaction(self, raw_transaction):
+        if not self.accept:
+            raise ValueError({'message': 'nonce too low'})
+        self.sent.append(raw_transaction)
+
+
+class FakeNonces:
+    def __init__(self):
+        self.released = []
+        self.resynced = 0
+        self.stalled = None
+
+    def stalled_nonce(self):
+        return self.stalled
+
+    def release(self, nonce):
+        self.released.append(nonce)
+
+    def resync(self):
+        self.resynced += 1
+
+
+def ethereum_manager():
+    """EthereumManager of a node that knows no transactions."""
+    manager = EthereumManager.__new__(EthereumManager)
+    manager.w3 = type('FakeWeb3', (), {'eth': FakeEth(), 'toWei': staticmethod(lambda value, unit: value)})()
+    manager.rpc_batch = lambda calls: [None for _ in calls]
+    manager.builder = TransactionBuilder(manager.w3, Web3.toChecksumAddress(CALLER), [
+        {'type': 'function', 'name': 'mint', 'inputs': [{'type': 'address'}, {'type': 'uint256'}]}
+    ])
+    manager.nonces = {CALLER: FakeNonces()}
+    return manager
+
+
+def sign(manager):
+    transaction = manager.builder.build('mint', [CALLER, 10], 7)
+    signed_tx = manager.builder.sign(transaction, Account.create().key)
+    return signed_tx.rawTransaction.hex(), signed_tx.hash.hex()
+
+
+def test_send_signed_known_transaction():
+    manager = ethereum_manager()
+    signed_transaction, tx_hash = sign(manager)
+    manager.rpc_batch = lambda calls: [{'hash': tx_hash}]
+
+    # the node already has it (e.g. from a send that timed out), so it is taken as sent
+    assert manager.send_signed(CALLER, signed_transaction, tx_hash) == tx_hash
+    assert manager.nonces[CALLER].released == []
+
+
+def test_send_signed_rejected_transaction():
+    manager = ethereum_manager()
+    signed_transaction, tx_hash = sign(manager)
+
+    with pytest.raises(TransactionRejected):
+        manager.send_signed(CALLER, signed_transaction, tx_hash)
+    assert manager.nonces[CALLER].released == [7]
+    assert manager.nonces[CALLER].resynced == 1
+
+
+def test_fill_nonce_gap():
+    manager = ethereum_manager()
+    manager.w3.eth.accept = True
+    key = Account.create().key
+
+    assert manager.fill_nonce_gap(CALLER, key) is None
+    assert manager.w3.eth.sent == []
+
+    manager.nonces[CALLER].stalled = 3
+    assert manager.fill_nonce_gap(CALLER, key)
+    assert [nonce_of(raw_transaction) for raw_transaction in manager.w3.eth.sent] == [3]
+
+
+def test_fabric_write_errors_are_raised():
+    manager = FabricManager.__new__(FabricManager)
+
+    def call(method, *args):
+        raise ConnectionError('gateway unreachable')
+
+    manager.client = type('FakeClient', (), {'call': staticmethod(call)})()
+
+    # the outbox retries the writes that raise, instead of taking them as done
+    with pytest.raises(ConnectionError):
+        manager.mint(CALLER, '', CALLER, 10)
+    with pytest.raises(ConnectionError):
+        manager.processAction(CALLER, '', CALLER, CALLER, 1, 10, 0, '')
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture()
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache, 'time', clock)
+    return clock
+
+
+def test_cached_balances_expire(clock):
+    manager = MemoryManager()
+    cached = CachedBlockchainManager(manager, TTL)
+    assert cached.balance_of(HOLDER) == 0
+
+    # a write by another process is seen once the cached balance expires
+    manager.ledger.mint(HOLDER, 5)
+    assert cached.balance_of(HOLDER) == 0
+    clock.now += TTL
+    assert cached.balance_of(HOLDER) == 5
+
+
+def test_balances_are_not_cached_after_a_write(clock):
+    manager = MemoryManager()
+    cached = CachedBlockchainManager(manager, TTL)
+    assert cached.balance_of(HOLDER) == 0
+
+    # the write expires the cached balance, and the balances read while it may be unmined are not cached
+    cached.mint(CALLER, '', HOLDER, 5)
+    assert cached.balance_of(HOLDER) == 5
+    manager.ledger.mint(HOLDER, 5)
+    assert cached.balance_of(HOLDER) == 10
+
+    clock.now += TTL
+    assert cached.balance_of(HOLDER) == 10
+    manager.ledger.mint(HOLDER, 5)
+    assert cached.balance_of(HOLDER) == 10
+
+
+def test_stale_balances_are_served_when_the_network_fails(clock):
+    manager = MemoryManager()
+    manager.ledger.mint(HOLDER, 5)
+    cached = CachedBlockchainManager(manager, TTL, serve_stale=True)
+    assert cached.balance_of(HOLDER) == 5
+    assert cached.balance_of_many([HOLDER]) == [5]
+
+    clock.now += TTL
+    manager.failure_rate = 1
+    assert cached.balance_of(HOLDER) == 5
+    assert cached.balance_of_many([HOLDER]) == [5]
+
+    # there is no stale balance of a new address to fall back to
+    with pytest.raises(ConnectionError):
+        cached.balance_of(OTHER)
+    with pytest.raises(ConnectionError):
+        cached.balance_of_many([HOLDER, OTHER])
+
+    # without serve_stale the error is raised
+    with pytest.raises(ConnectionError):
+        CachedBlockchainManager(manager, TTL).balance_of(HOLDER)
+
+
+def test_balance_of_many_only_fetches_the_missing_balances(clock):
+    manager = MemoryManager()
+    manager.ledger.mint(HOLDER, 5)
+    manager.ledger.mint(OTHER, 7)
+    cached = CachedBlockchainManager(manager, TTL)
+    assert cached.balance_of(HOLDER) == 5
+
+    fetched = []
+    balance_of_many = manager.balance_of_many
+    manager.balance_of_many = lambda addresses: fetched.append(addresses) or balance_of_many(addresses)
+
+    assert cached.balance_of_many([OTHER, HOLDER]) == [7, 5]
+    assert fetched == [[OTHER]]
+
+    # the fetched balances are cached too
+    assert cached.balance_of_many([HOLDER, OTHER]) == [5, 7]
+    assert fetched == [[OTHER]]
@@ -0,0 +1,48 @@
+import pytest
+import threading
+from bench.fake_fabric import serve
+from concurrent.futures import ThreadPoolExecutor
+from src.common.fabric import FabricClient
+
+SESSION_TTL = 60
+HOLDER = '0x00000000000000000000000000000000000000aa'
+
+
+@pytest.fixture()
+def gateway():
+    server = serve(port=0, session_ttl=SESSION_TTL)
+    gateway = server.RequestHandlerClass.gateway
+    gateway.logins = 0
+    login = gateway.login
+
+    def counted_login():
+        gateway.logins += 1
+        return login()
+
+    gateway.login = counted_login
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield gateway, f'http://localhost:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def test_concurrent_calls_log_in_once(gateway):
+    gateway, url = gateway
+    gateway.ledger.mint(HOLDER, 5)
+    client = FabricClient(f'{url}/login', url, 'user', 'password')
+
+    def balance(i):
+        return client.call('balanceOf', HOLDER)
+
+    # every call finds no session, and a single one of them logs in
+    with ThreadPoolExecutor(8) as executor:
+        assert list(executor.map(balance, range(32))) == ['5'] * 32
+    assert gateway.logins == 1
+
+    # the same happens when the session expires
+    with gateway.lock:
+        gateway.sessions = dict.fromkeys(gateway.sessions, 0)
+    with ThreadPoolExecutor(8) as executor:
+        assert list(executor.map(balance, range(32))) == ['5'] * 32
+    assert gateway.logins == 2
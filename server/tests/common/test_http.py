@@ -0,0 +1,83 @@
+import pytest
+import requests
+from src.common import http
+
+URL = 'http://service.test/resource'
+
+
+class FakeClient:
+    """Answers each request with the next of 'outcomes': a status code, or an exception to raise."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append(method)
+        outcome = self.outcomes.pop(0) if len(self.outcomes) > 1 else self.outcomes[0]
+        if isinstance(outcome, Exception):
+            raise outcome
+        response = requests.Response()
+        response.status_code = outcome
+        return response
+
+
+@pytest.fixture()
+def client(monkeypatch):
+    monkeypatch.setattr(http, 'HTTP_BACKOFF', 0)
+    monkeypatch.setattr(http, 'HTTP_RETRIES', 2)
+    monkeypatch.setattr(http, 'HTTP2', False)
+
+    def use(*outcomes):
+        client = FakeClient(*outcomes)
+        monkeypatch.setattr(http, 'client_for', lambda url: client)
+        return client
+    return use
+
+
+@pytest.mark.parametrize('method', http.IDEMPOTENT_METHODS)
+def test_idempotent_methods_are_retried(client, method):
+    fake = client(requests.ConnectionError(), 503, 200)
+    assert http.request(method, URL).status_code == 200
+    assert fake.requests == [method] * 3
+
+
+def test_post_is_not_retried(client):
+    fake = client(503, 200)
+    assert http.post(URL).status_code == 503
+    assert fake.requests == ['POST']
+
+    fake = client(requests.Timeout(), 200)
+    with pytest.raises(requests.Timeout):
+        http.post(URL)
+    assert fake.requests == ['POST']
+
+    # unless the caller knows it can be sent again
+    fake = client(503, 200)
+    assert http.post(URL, retry=True).status_code == 200
+    assert fake.requests == ['POST', 'POST']
+
+
+@pytest.mark.parametrize('status', http.RETRY_STATUSES)
+def test_retry_statuses_are_retried(client, status):
+    fake = client(status, 200)
+    assert http.get(URL).status_code == 200
+    assert len(fake.requests) == 2
+
+
+@pytest.mark.parametrize('status', [400, 404, 500])
+def test_other_statuses_are_returned(client, status):
+    fake = client(status, 200)
+    assert http.get(URL).status_code == status
+    assert len(fake.requests) == 1
+
+
+def test_retries_are_limited(client):
+    fake = client(503)
+    assert http.get(URL).status_code == 503
+    assert len(fake.requests) == http.HTTP_RETRIES + 1
+
+    fake = client(requests.ConnectionError())
+    with pytest.raises(requests.ConnectionError):
+        http.get(URL)
+    assert len(fake.requests) == http.HTTP_RETRIES + 1
@@ -0,0 +1,104 @@
+import pytest
+from hexbytes import HexBytes
+from src.database.db import db_session
+from src.database.models import IndexedBlock, LedgerEntry
+from src.workers import indexer
+from src.workers.indexer import LedgerIndexer
+from web3.exceptions import BlockNotFound
+
+ADDRESS = '0x00000000000000000000000000000000000000dd'
+
+
+class FakeEth:
+    """Chain of 'length' blocks, whose hashes end with 'fork' from the block 'fork_at' on, with one log per block."""
+
+    def __init__(self, length):
+        self.block_number = length - 1
+        self.fork_at = length
+        self.fork = 'a'
+
+    def get_block(self, number):
+        if number > self.block_number:
+            raise BlockNotFound(number)
+        return {'hash': HexBytes(f'{number:x}'.rjust(63, '0') + (self.fork if number >= self.fork_at else '0'))}
+
+    def get_logs(self, params):
+        return list(range(params['fromBlock'], params['toBlock'] + 1))
+
+
+class FakeManager:
+    def __init__(self, length):
+        self.w3 = type('FakeWeb3', (), {'eth': FakeEth(length)})()
+        self.contract = type('FakeContract', (), {'abi': [], 'address': ADDRESS})()
+
+
+def to_row(log):
+    return {
+        'block_number': log,
+        'block_hash': '0x0',
+        'transaction_hash': f'0x{log:x}',
+        'log_index': 0,
+        'event': 'Transfer',
+        'from_address': ADDRESS,
+        'to_address': ADDRESS,
+        'value': 1,
+        'action_id': None,
+        'time': None,
+        'ipfs_hash': None
+    }
+
+
+@pytest.fixture()
+def ledger(monkeypatch):
+    monkeypatch.setattr(indexer, 'INDEXER_START_BLOCK', 0)
+    monkeypatch.setattr(indexer, 'INDEXER_CONFIRMATIONS', 0)
+    monkeypatch.setattr(indexer, 'INDEXER_BATCH_BLOCKS', 2)
+    monkeypatch.setattr(LedgerIndexer, 'to_row', staticmethod(to_row))
+    LedgerEntry.query.delete()
+    IndexedBlock.query.delete()
+    db_session.commit()
+    yield
+    LedgerEntry.query.delete()
+    IndexedBlock.query.delete()
+    db_session.commit()
+
+
+def index_all(ledger_indexer):
+    while ledger_indexer.step():
+        pass
+
+
+def test_rewinds_to_a_shorter_chain(ledger):
+    manager = FakeManager(10)
+    ledger_indexer = LedgerIndexer(manager)
+    index_all(ledger_indexer)
+    assert IndexedBlock.latest().number == 9
+
+    # the chain reorganizes from block 4 on into a chain that only reaches block 6
+    manager.w3.eth.block_number = 6
+    manager.w3.eth.fork_at = 4
+    assert ledger_indexer.step() == 0
+    assert IndexedBlock.latest().number == 3
+    assert LedgerEntry.query.count() == 4
+
+    index_all(ledger_indexer)
+    assert IndexedBlock.latest().number == 6
+    assert LedgerEntry.query.count() == 7
+
+
+def test_prune_keeps_checkpoints_by_count(ledger, monkeypatch):
+    monkeypatch.setattr(indexer, 'REORG_HISTORY', 3)
+    index_all(LedgerIndexer(FakeManager(10)))
+
+    assert [block.number for block in IndexedBlock.query.order_by(IndexedBlock.number)] == [5, 7, 9]
+
+
+def test_entries_are_indexed_once(ledger):
+    index_all(LedgerIndexer(FakeManager(4)))
+
+    # a second indexer going through the same blocks does not duplicate their entries
+    IndexedBlock.query.delete()
+    db_session.commit()
+    index_all(LedgerIndexer(FakeManager(4)))
+
+    assert LedgerEntry.query.count() == 4
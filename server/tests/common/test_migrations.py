@@ -0,0 +1,37 @@
+import pytest
+from sqlalchemy import text
+from src.database.db import engine
+from src.database.migrations import drop_invalid_indexes
+
+
+@pytest.fixture()
+def conn():
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+        conn.execute(text('CREATE TABLE test_migration (value INTEGER)'))
+        conn.execute(text('INSERT INTO test_migration VALUES (1), (1)'))
+        yield conn
+        conn.execute(text('DROP TABLE test_migration'))
+
+
+def invalid_indexes(conn):
+    return set(conn.execute(text(
+        'SELECT indexrelid::regclass::text FROM pg_index WHERE NOT indisvalid'
+    )).scalars())
+
+
+def test_drop_invalid_indexes_of_the_migration(conn):
+    # a failed CREATE INDEX CONCURRENTLY leaves an invalid index behind
+    for name in ['ix_test_migration_a', 'ix_test_migration_b']:
+        with pytest.raises(Exception):
+            conn.execute(text(f'CREATE UNIQUE INDEX CONCURRENTLY {name} ON test_migration (value)'))
+    assert {'ix_test_migration_a', 'ix_test_migration_b'} <= invalid_indexes(conn)
+
+    drop_invalid_indexes(conn, [
+        'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ix_test_migration_a ON test_migration (value)'
+    ])
+
+    # the invalid indexes of other migrations may be being built, so they are kept
+    invalid = invalid_indexes(conn)
+    assert 'ix_test_migration_a' not in invalid
+    assert 'ix_test_migration_b' in invalid
@@ -0,0 +1,113 @@
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from src.common import nonce
+from src.common.nonce import NonceManager
+from src.database.db import engine
+from src.database.models import Signer
+
+ADDRESS = '0x00000000000000000000000000000000000000aa'
+
+
+class FakeEth:
+    def __init__(self, pending):
+        self.pending = pending
+        self.latest = pending
+
+    def get_transaction_count(self, address, block_identifier):
+        return self.latest if block_identifier == 'latest' else self.pending
+
+
+class FakeWeb3:
+    def __init__(self, pending):
+        self.eth = FakeEth(pending)
+
+
+@pytest.fixture()
+def nonces():
+    with engine.begin() as conn:
+        conn.execute(Signer.__table__.delete().where(Signer.address == ADDRESS))
+    w3 = FakeWeb3(pending=7)
+    yield NonceManager(w3, ADDRESS)
+    with engine.begin() as conn:
+        conn.execute(Signer.__table__.delete().where(Signer.address == ADDRESS))
+
+
+def stored_nonce():
+    with engine.connect() as conn:
+        return conn.execute(Signer.__table__.select().where(Signer.address == ADDRESS)).first().next_nonce
+
+
+def test_allocate_starts_at_node_count(nonces):
+    assert [nonces.allocate() for i in range(3)] == [7, 8, 9]
+    assert stored_nonce() == 10
+
+
+def test_allocate_concurrent(nonces):
+    nonces.allocate()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        allocated = list(executor.map(lambda _: nonces.allocate(), range(40)))
+
+    assert sorted(allocated) == list(range(8, 48))
+
+
+def test_resync_moves_forward(nonces):
+    nonces.allocate()
+    nonces.w3.eth.pending = 20
+
+    nonces.resync()
+
+    assert nonces.allocate() == 20
+
+
+def test_resync_never_moves_back(nonces):
+    # nonces allocated by other workers but not sent yet are above the node count
+    for i in range(5):
+        nonces.allocate()
+
+    nonces.resync()
+
+    assert nonces.allocate() == 12
+
+
+def test_release_last_nonce(nonces):
+    nonce = nonces.allocate()
+
+    assert nonces.release(nonce)
+    assert nonces.allocate() == nonce
+
+
+def test_release_after_later_allocation(nonces):
+    nonce = nonces.allocate()
+    later = nonces.allocate()
+
+    assert not nonces.release(nonce)
+    assert nonces.allocate() == later + 1
+
+
+def test_stalled_nonce_of_two_workers(nonces, monkeypatch):
+    monkeypatch.setattr(nonce, 'NONCE_GAP_TIMEOUT', 0)
+    other = NonceManager(nonces.w3, ADDRESS)
+
+    # the send of the first worker fails without reaching the node after the other worker allocated a nonce,
+    # so the nonce cannot be given back and the other worker's transaction waits behind it in the node
+    lost = nonces.allocate()
+    sent = other.allocate()
+    assert not nonces.release(lost)
+    nonces.w3.eth.pending = sent + 1
+
+    assert nonces.stalled_nonce() is None   # the node count has to stay behind for NONCE_GAP_TIMEOUT first
+    assert nonces.stalled_nonce() == lost
+
+    # once the gap is filled, both transactions are mined
+    nonces.w3.eth.latest = sent + 1
+    assert nonces.stalled_nonce() is None
+
+
+def test_stalled_nonce_waits_for_the_timeout(nonces, monkeypatch):
+    monkeypatch.setattr(nonce, 'NONCE_GAP_TIMEOUT', 60)
+    nonces.allocate()
+
+    # a nonce being sent right now is not a gap
+    assert nonces.stalled_nonce() is None
+    assert nonces.stalled_nonce() is None
@@ -0,0 +1,244 @@
+import pytest
+from datetime import datetime
+from src.common import outbox
+from src.common.blockchain import TransactionRejected, blockchain_manager
+from src.common.memory import MemoryLedger
+from src.common.outbox import chain_write
+from src.database.db import db_session
+from src.database.models import Operation, Transaction
+from src.workers import outbox as outbox_worker
+from src.workers.outbox import OutboxWorker
+
+RECIPIENT = '0x00000000000000000000000000000000000000bb'
+PROMOTERS = ['0x00000000000000000000000000000000000000c1', '0x00000000000000000000000000000000000000c2']
+
+
+@pytest.fixture()
+def queue(monkeypatch):
+    monkeypatch.setattr(outbox, 'OUTBOX_ON', True)
+    Operation.query.delete()
+    Transaction.query.delete()
+    db_session.commit()
+    yield
+    Operation.query.delete()
+    Transaction.query.delete()
+    db_session.commit()
+
+
+def queue_mints(count):
+    operations = [
+        chain_write('mint', {'to': RECIPIENT, 'value': 10}, {
+            'sender_address': RECIPIENT,
+            'receiver_address': RECIPIENT,
+            'quantity': 10,
+            'transaction_info': f'test mint {i}',
+            'img_ipfs_hash': '',
+            'external_proof_url': ''
+        })
+        for i in range(count)
+    ]
+    db_session.commit()
+    return [operation.id for operation in operations]
+
+
+def test_claim_due(queue):
+    queue_mints(3)
+
+    claimed = Operation.claim_due(2, lease=60)
+
+    assert len(claimed) == 2
+    assert all(operation.status == 'running' for operation in claimed)
+    assert all(operation.next_attempt_at > datetime.now() for operation in claimed)
+    # the claimed operations are leased, so only the remaining one is due
+    assert len(Operation.claim_due(10, lease=60)) == 1
+
+
+def test_process_retries_with_backoff(queue, monkeypatch):
+    operation_id, = queue_mints(1)
+    monkeypatch.setattr(outbox_worker, 'OUTBOX_MAX_ATTEMPTS', 2)
+
+    def mint(*args, **kwargs):
+        raise ConnectionError('node unreachable')
+
+    monkeypatch.setattr(outbox_worker.blockchain_manager, 'mint', mint)
+    worker = OutboxWorker()
+
+    worker.process(Operation.claim_due(10, lease=60))
+    operation = Operation.get(operation_id)
+    assert operation.status == 'queued'
+    assert operation.attempts == 1
+    assert operation.last_error == 'node unreachable'
+    assert operation.next_attempt_at > datetime.now()
+    assert Operation.claim_due(10, lease=60) == []  # not due until the backoff ends
+
+    worker.process([operation])
+    assert Operation.get(operation_id).status == 'failed'
+
+
+def test_drain_once(queue):
+    operation_ids = queue_mints(3)
+    base_balance = blockchain_manager.balance_of(RECIPIENT)
+
+    assert OutboxWorker().drain_once() == 3
+
+    operations = [Operation.get(operation_id) for operation_id in operation_ids]
+    assert all(operation.status == 'done' for operation in operations)
+    # consecutive mints are submitted in a single batch transaction
+    assert len({operation.transaction_hash for operation in operations}) == 1
+    assert Transaction.query.filter(Transaction.transaction_info.like('test mint %')).count() == 3
+    assert blockchain_manager.balance_of(RECIPIENT) == base_balance + 30
+
+
+def queue_actions(rewards):
+    operations = [
+        chain_write('processAction', {
+            'promoter': promoter,
+            'to': RECIPIENT,
+            'action_id': i,
+            'reward': reward,
+            'time': 0,
+            'ipfs_hash': ''
+        })
+        for i, (promoter, reward) in enumerate(rewards)
+    ]
+    db_session.commit()
+    return [operation.id for operation in operations]
+
+
+def test_memory_batch_is_all_or_nothing():
+    ledger = MemoryLedger()
+    ledger.mint(PROMOTERS[0], 10)
+
+    assert not ledger.process_actions([(PROMOTERS[0], RECIPIENT, 6), (PROMOTERS[0], RECIPIENT, 6)])
+    assert ledger.balance_of(PROMOTERS[0]) == 10
+    assert ledger.balance_of(RECIPIENT) == 0
+
+    assert ledger.process_actions([(PROMOTERS[0], RECIPIENT, 6), (PROMOTERS[0], RECIPIENT, 4)])
+    assert ledger.balance_of(PROMOTERS[0]) == 0
+    assert ledger.balance_of(RECIPIENT) == 10
+
+
+def test_drain_once_batches_actions_per_promoter(queue, monkeypatch):
+    balances = {PROMOTERS[0]: 10, PROMOTERS[1]: 5}
+    batches = []
+    monkeypatch.setattr(outbox_worker.blockchain_manager, 'balance_of', lambda address: balances[address])
+    monkeypatch.setattr(outbox_worker.blockchain_manager, 'processAction', lambda **kwargs: batches.append(1) or '0x1')
+    monkeypatch.setattr(outbox_worker.blockchain_manager, 'batchProcessAction',
+                        lambda actions, **kwargs: batches.append(len(actions)) or '0x2')
+
+    first, second, third, fourth = queue_actions([
+        (PROMOTERS[0], 4), (PROMOTERS[1], 5), (PROMOTERS[0], 6), (PROMOTERS[1], 1)
+    ])
+
+    assert OutboxWorker().drain_once() == 4
+
+    # the first promoter's actions go in one batch, and the second promoter cannot pay its last one
+    assert batches == [2, 1]
+    assert Operation.get(first).transaction_hash == Operation.get(third).transaction_hash == '0x2'
+    assert Operation.get(second).status == 'done'
+    deferred = Operation.get(fourth)
+    assert deferred.status == 'queued'
+    assert deferred.last_error == 'promoter balance too low'
+    assert deferred.next_attempt_at > datetime.now()
+
+
+class FakeSigner:
+    """Signs transactions with consecutive hashes, and fails the sends listed in 'errors', in order."""
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.signed = []
+        self.sent = []
+
+    def sign(self, caller, caller_key, method, params):
+        tx_hash = f'0x{len(self.signed):x}'
+        self.signed.append((method, tx_hash))
+        return f'signed {tx_hash}', tx_hash
+
+    def send_signed(self, caller, signed_transaction, transaction_hash):
+        self.sent.append(signed_transaction)
+        if self.errors:
+            raise self.errors.pop(0)
+        return transaction_hash
+
+
+def test_drain_once_sends_the_same_signed_transaction_again(queue, monkeypatch):
+    operation_ids = queue_mints(2)
+    signer = FakeSigner(errors=[TimeoutError('read timeout')])
+    monkeypatch.setattr(outbox_worker.blockchain_manager, 'sign', signer.sign)
+    monkeypatch.setattr(outbox_worker.blockchain_manager, 'send_signed', signer.send_signed)
+    worker = OutboxWorker()
+
+    worker.drain_once()
+    operations = [Operation.get(operation_id) for operation_id in operation_ids]
+    assert all(operation.status == 'queued' for operation in operations)
+    assert all(operation.signed_transaction == 'signed 0x0' for operation in operations)
+
+    # the timed out send may have reached the node, so the retry does not sign a new transaction
+    worker.process(operations)
+    assert signer.signed == [('batchMint', '0x0')]
+    assert signer.sent == ['signed 0x0', 'signed 0x0']
+    operations = [Operation.get(operation_id) for operation_id in operation_ids]
+    assert all(operation.status == 'done' and operation.transaction_hash == '0x0' for operation in operations)
+    assert Transaction.query.filter(Transaction.transaction_info.like('test mint %')).count() == 2
+
+
+def test_rejected_transactions_are_signed_again(queue, monkeypatch):
+    operation_id, = queue_mints(1)
+    signer = FakeSigner(errors=[TransactionRejected('nonce too low')])
+    monkeypatch.setattr(outbox_worker.blockchain_manager, 'sign', signer.sign)
+    monkeypatch.setattr(outbox_worker.blockchain_manager, 'send_signed', signer.send_signed)
+    worker = OutboxWorker()
+
+    worker.drain_once()
+    operation = Operation.get(operation_id)
+    assert operation.status == 'queued'
+    assert operation.signed_transaction is None
+
+    worker.process([operation])
+    assert signer.signed == [('mint', '0x0'), ('mint', '0x1')]
+    assert Operation.get(operation_id).transaction_hash == '0x1'
+
+
+def test_drain_once_without_atomic_batches(queue, monkeypatch):
+    operation_ids = queue_mints(3)
+    monkeypatch.setattr(type(outbox_worker.blockchain_manager), 'atomic_batches', False, raising=False)
+
+    assert OutboxWorker().drain_once() == 3
+
+    # each mint is submitted on its own, so one failing does not make the others be applied again
+    operations = [Operation.get(operation_id) for operation_id in operation_ids]
+    assert len({operation.transaction_hash for operation in operations}) == 3
+
+
+def test_fund_takes_unconfirmed_rewards_from_the_balance(queue, monkeypatch):
+    manager = getattr(outbox_worker.blockchain_manager, 'manager', outbox_worker.blockchain_manager)
+    monkeypatch.setattr(manager, 'instant_writes', False, raising=False)
+    monkeypatch.setattr(manager, 'balance_of', lambda address: 10)
+
+    # a reward of the promoter submitted by an earlier drain, not mined yet
+    submitted, = queue_actions([(PROMOTERS[0], 6)])
+    operation = Operation.get(submitted)
+    operation.status = 'done'
+    operation.transaction_hash = '0xunmined'
+    db_session.add(Transaction(datetime.now(), '0xunmined', PROMOTERS[0], RECIPIENT, 6, 'test action', '', ''))
+    db_session.commit()
+    queued, = queue_actions([(PROMOTERS[0], 6)])
+
+    assert OutboxWorker().fund(Operation.claim_due(10, lease=60)) == []
+    assert Operation.get(queued).last_error == 'promoter balance too low'
+
+
+def test_failed_registrations_give_back_their_kpi(queue, monkeypatch):
+    operation_id, = queue_actions([(PROMOTERS[0], 6)])
+    operation = Operation.get(operation_id)
+    operation.reserved_kpi = 3
+    db_session.commit()
+    released = []
+    monkeypatch.setattr(outbox_worker, 'OUTBOX_MAX_ATTEMPTS', 1)
+    monkeypatch.setattr(outbox_worker.Action, 'release_kpi', lambda action_id, kpi: released.append((action_id, kpi)))
+
+    outbox_worker.retry_later([operation], 'transaction reverted')
+
+    assert operation.status == 'failed'
+    assert released == [(0, 3)]
@@ -0,0 +1,78 @@
+import pytest
+from datetime import datetime, timedelta
+from src.database.db import db_session
+from src.database.models import Operation, Transaction
+from src.workers import receipts
+from src.workers.receipts import ReceiptTracker
+
+
+class FakeNode:
+    """Answers the receipt tracker batches, knowing the receipts of 'mined' and 'reverted' and every transaction otherwise."""
+
+    def __init__(self, mined, reverted=()):
+        self.mined = mined
+        self.reverted = reverted
+        self.checked = []
+
+    def rpc_batch(self, calls):
+        results = []
+        for method, (tx_hash,) in calls:
+            if method == 'eth_getTransactionReceipt':
+                self.checked.append(tx_hash)
+                if tx_hash in self.mined or tx_hash in self.reverted:
+                    status = '0x1' if tx_hash in self.mined else '0x0'
+                    results.append({'status': status, 'blockNumber': '0x10', 'gasUsed': '0x5208'})
+                else:
+                    results.append(None)
+            else:
+                results.append({'hash': tx_hash})
+        return results
+
+
+@pytest.fixture()
+def pending_transactions():
+    Transaction.query.delete()
+    now = datetime.now()
+    for i, tx_hash in enumerate(['0xa', '0xb', '0xc']):
+        Transaction(now - timedelta(minutes=3 - i), tx_hash, '0x1', '0x2', 1, 'test', '', '').save()
+    yield
+    Transaction.query.delete()
+    db_session.commit()
+
+
+def test_poll_rotates_stuck_transactions(pending_transactions, monkeypatch):
+    monkeypatch.setattr(receipts, 'RECEIPT_BATCH_SIZE', 2)
+    node = FakeNode(mined={'0xc'})
+    tracker = ReceiptTracker(node)
+
+    assert tracker.poll_once() == (2, 0)
+    assert node.checked == ['0xa', '0xb']
+
+    # the newest transaction is checked next, even though the older ones are still pending
+    assert tracker.poll_once() == (2, 1)
+    assert node.checked[2] == '0xc'
+    assert Transaction.query.filter_by(transaction_hash='0xc').one().status == 'mined'
+
+
+def test_reverted_operations_are_queued_again(pending_transactions):
+    Operation.query.delete()
+    operations = [Operation('processAction', {'promoter': '0x1', 'reward': 1}, None) for _ in range(2)]
+    for operation, tx_hash in zip(operations, ['0xa', '0xb']):
+        operation.status = 'done'
+        operation.attempts = 1
+        operation.transaction_hash = tx_hash
+        operation.signed_transaction = f'signed {tx_hash}'
+        db_session.add(operation)
+    db_session.commit()
+    operation_ids = [operation.id for operation in operations]
+
+    ReceiptTracker(FakeNode(mined={'0xb'}, reverted={'0xa'})).poll_once()
+
+    reverted, mined = [Operation.get(operation_id) for operation_id in operation_ids]
+    assert reverted.status == 'queued'
+    assert reverted.transaction_hash is None
+    assert reverted.signed_transaction is None    # signed again with a new nonce, as the reverted one was mined
+    assert reverted.last_error == 'transaction reverted'
+    assert mined.status == 'done'
+    Operation.query.delete()
+    db_session.commit()
@@ -0,0 +1,55 @@
+from src.common import utils
+from src.common.utils import get_cached_user, user_cache
+from src.database.db import db_session
+from src.database.models import User
+
+EMAIL = 'collaborator@socialcoin.com'
+
+
+def test_orm_changes_are_forgotten_on_commit(test_admin, test_collaborator):
+    get_cached_user(EMAIL)
+    assert user_cache.get(EMAIL) is not None
+
+    # e.g. an edit from the admin panel, which does not go through the API
+    user = User.get_by_email(EMAIL)
+    user.name = 'edited'
+    db_session.flush()
+    assert user_cache.get(EMAIL) is not None    # not committed yet
+
+    db_session.commit()
+    assert user_cache.get(EMAIL) is None
+    assert get_cached_user(EMAIL).name == 'edited'
+
+
+def test_rolled_back_changes_are_kept_in_the_cache(test_admin, test_collaborator):
+    get_cached_user(EMAIL)
+
+    User.get_by_email(EMAIL).name = 'edited'
+    db_session.flush()
+    db_session.rollback()
+
+    assert user_cache.get(EMAIL)['name'] == 'testCB'
+
+
+def test_users_loaded_before_a_change_are_not_cached(test_admin, test_collaborator, monkeypatch):
+    get_by_email = User.get_by_email
+
+    def load_then_commit_change(email):
+        # another request commits a change to users while this one loads the old row
+        user = get_by_email(email)
+        utils.forget_users([email])
+        return user
+
+    monkeypatch.setattr(User, 'get_by_email', staticmethod(load_then_commit_change))
+    get_cached_user(EMAIL)
+
+    assert user_cache.get(EMAIL) is None
+
+
+def test_bulk_deletes_are_forgotten(test_admin, test_collaborator):
+    get_cached_user(EMAIL)
+
+    User.query.filter_by(email=EMAIL).delete()
+    db_session.commit()
+
+    assert get_cached_user(EMAIL) is None
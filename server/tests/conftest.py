@@ -1,8 +1,10 @@
 from dotenv import load_dotenv
+from sqlalchemy import event
 import pytest
 import jwt
 from src.app import app
 from src.config import APP_SECRET
+from src.database.db import engine
 from src.database.models import User
 
 
@@ -27,6 +29,19 @@ def runner(app_fixture):
   return app_fixture.test_cli_runner()
 
 
+@pytest.fixture()
+def query_counter():
+  """List of the SQL statements sent to the database while the test runs."""
+  statements = []
+
+  def count(conn, cursor, statement, parameters, context, executemany):
+    statements.append(statement)
+
+  event.listen(engine, 'before_cursor_execute', count)
+  yield statements
+  event.remove(engine, 'before_cursor_execute', count)
+
+
 @pytest.fixture()
 def test_admin():
   User.query.delete()